@@ -1,2 +1,11 @@
 # Makes this directory a package so you can: from analytics_utils import db_utils
-from . import db_utils
\ No newline at end of file
+# Submodules load on first import, so e.g. `import analytics_utils.jobs` doesn't pull
+# in pandas and the database drivers; analytics_utils.db_utils still works after
+# a bare `import analytics_utils`.
+import importlib
+
+
+def __getattr__(name):
+    if name == "db_utils":
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
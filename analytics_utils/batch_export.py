@@ -0,0 +1,302 @@
+# batch_export.py
+"""
+Resumable batch export of many programs to Parquet, partitioned by program and source.
+
+The program list is split into work units (BATCH_EXPORT_CONFIG["programs_per_unit"]
+programs each) that run on a bounded thread pool ("max_workers" units at a time).
+Each unit is one run_combined_engagement_query call, so a unit holds at most one
+pooled connection per source while it runs (one in total with sequential_sources).
+A finished unit's rows are written as
+
+    <output>/program_identifier=<id>/source=<source>/part-<unit>.parquet
+
+(hive-style, so pd.read_parquet(output) / pyarrow.dataset read it back with both
+partition columns), all files sharing EXPORT_SCHEMA so they read as one dataset.
+
+<output>/_manifest.json records every unit's programs, status, row count and files,
+and is rewritten as units finish. Running the same export again skips the programs
+of units already done and first deletes whatever files an unfinished unit left.
+A unit whose sources failed or timed out, or whose rows don't fit EXPORT_SCHEMA (e.g. a
+non-numeric email_campaign_identifier), is marked failed and retried on the next run.
+Choozle rows follow the Choozle query's BTL concentrate rule for the programs of a
+unit, as they do in a multi-program Run of the same programs.
+"""
+import datetime as dt
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analytics_utils import config, db_utils
+from analytics_utils.db_utils import QueryCancelled
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.BATCH_EXPORT_CONFIG
+BATCH_EXPORT_DEFAULTS = {
+    "programs_per_unit": 10,
+    "max_workers": 2,      # units running at once; each may hold one connection per source
+    "compression": "zstd",
+}
+
+MANIFEST_NAME = "_manifest.json"
+PARTITION_COLUMNS = ["program_identifier", "source"]
+DONE, FAILED, RUNNING = "done", "failed", "running"
+
+# Column types for every exported file, so per-unit files always share one schema
+EXPORT_SCHEMA = pa.schema([
+    ("program_name", pa.string()),
+    ("program_drug_brand_name", pa.string()),
+    ("program_start_date", pa.timestamp("us")),
+    ("program_end_date", pa.timestamp("us")),
+    ("program_status", pa.string()),
+    ("provider_npi", pa.string()),
+    ("specialty", pa.string()),
+    ("email_campaign_identifier", pa.int64()),
+    ("email_campaign_subject", pa.string()),
+    ("email_campaign_link_url", pa.string()),
+    ("choozle_banner_ad_name", pa.string()),
+    ("choozle_banner_link_url", pa.string()),
+    ("engaged_on", pa.date32()),
+    ("engaged_at", pa.timestamp("us")),
+    ("engagement_type", pa.string()),
+    ("survey_question_number", pa.int64()),
+    ("survey_response", pa.string()),
+    ("survey_location", pa.string()),
+])
+
+
+def batch_export_settings():
+    return {**BATCH_EXPORT_DEFAULTS, **(getattr(config, "BATCH_EXPORT_CONFIG", None) or {})}
+
+
+def _export_array(series, arrow_type):
+    """One column coerced to its EXPORT_SCHEMA type. Raises ValueError for integer columns holding non-numeric values."""
+    if pa.types.is_string(arrow_type):
+        return pa.array(series.astype("string"), type=pa.string(), from_pandas=True)
+    if pa.types.is_integer(arrow_type):
+        values = pd.to_numeric(series, errors="coerce")
+        # Never export a value as null just because it isn't numeric; fail the unit instead
+        lost = values.isna() & series.notna()
+        if lost.any():
+            raise ValueError(
+                f"{series.name}: {int(lost.sum())} non-numeric value(s) can't be exported as "
+                f"{arrow_type}, e.g. {series[lost].iloc[0]!r}"
+            )
+        return pa.array(values.astype("Int64"), type=arrow_type, from_pandas=True)
+    values = pd.to_datetime(series, errors="coerce")
+    if getattr(values.dt, "tz", None) is not None:
+        values = values.dt.tz_convert(None)
+    return pa.array(values.astype("datetime64[us]"), from_pandas=True).cast(arrow_type)
+
+def export_table(df):
+    """
+    A partition's rows as an Arrow table: EXPORT_SCHEMA columns first (all-null where
+    the frame lacks them), then any extra columns with inferred types.
+    """
+    arrays, fields = [], []
+    for field in EXPORT_SCHEMA:
+        arrays.append(_export_array(df[field.name], field.type) if field.name in df.columns else pa.nulls(len(df), field.type))
+        fields.append(field)
+    for col in df.columns:
+        if col not in EXPORT_SCHEMA.names and col not in PARTITION_COLUMNS and col != "program_activation_ranges":
+            array = pa.array(df[col], from_pandas=True)
+            arrays.append(array)
+            fields.append(pa.field(col, array.type))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+class BatchExport:
+    """
+    One export directory: its manifest, the unit plan, and the files units write.
+    """
+
+    def __init__(self, output_dir, campaign_type="custom", programs_per_unit=None, max_workers=None,
+                 sequential_sources=False, compression=None, **query_kwargs):
+        settings = batch_export_settings()
+        self.output_dir = os.path.expanduser(output_dir)
+        self.campaign_type = campaign_type
+        self.programs_per_unit = programs_per_unit or settings["programs_per_unit"]
+        self.max_workers = max_workers or settings["max_workers"]
+        self.compression = compression or settings["compression"]
+        self.sequential_sources = sequential_sources
+        # Export straight from the databases: no stale rows, and no second copy under the result cache
+        self.query_kwargs = {"use_cache": False, **query_kwargs}
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    # --- Manifest ---
+    @property
+    def manifest_path(self):
+        return os.path.join(self.output_dir, MANIFEST_NAME)
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"campaign_type": self.campaign_type, "created_at": dt.datetime.now().isoformat(timespec="seconds"), "units": {}}
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest["campaign_type"] != self.campaign_type:
+            raise ValueError(
+                f"{self.output_dir} holds a {manifest['campaign_type']} export; use another directory for {self.campaign_type}"
+            )
+        return manifest
+
+    def _save_manifest(self):
+        # Called with self._lock held; atomic, so an interrupted write can't corrupt it
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _update_unit(self, unit_id, **fields):
+        with self._lock:
+            self.manifest["units"][unit_id].update(fields)
+            self._save_manifest()
+
+    def done_programs(self):
+        return {pid for unit in self.manifest["units"].values() if unit["status"] == DONE for pid in unit["programs"]}
+
+    # --- Planning ---
+    def _remove_unit_files(self, unit_id, unit):
+        """Deletes files an unfinished unit may have written before it stopped."""
+        removed = 0
+        for pid in unit["programs"]:
+            program_dir = os.path.join(self.output_dir, f"program_identifier={pid}")
+            if not os.path.isdir(program_dir):
+                continue
+            for source_dir in os.listdir(program_dir):
+                path = os.path.join(program_dir, source_dir, f"part-{unit_id}.parquet")
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def plan(self, program_ids):
+        """
+        Work units for the programs not exported yet. Units that never finished are
+        dropped from the manifest (with their files) and their programs planned again.
+        Returns [(unit_id, programs)].
+        """
+        done = self.done_programs()
+        with self._lock:
+            for unit_id, unit in list(self.manifest["units"].items()):
+                if unit["status"] != DONE:
+                    self._remove_unit_files(unit_id, unit)
+                    del self.manifest["units"][unit_id]
+
+            todo = [pid for pid in dict.fromkeys(program_ids) if pid not in done]
+            next_number = max((int(unit_id.split("-")[1]) for unit_id in self.manifest["units"]), default=0) + 1
+            units = []
+            for i in range(0, len(todo), self.programs_per_unit):
+                unit_id = f"unit-{next_number:05d}"
+                next_number += 1
+                programs = todo[i:i + self.programs_per_unit]
+                self.manifest["units"][unit_id] = {"programs": programs, "status": RUNNING, "files": []}
+                units.append((unit_id, programs))
+            self._save_manifest()
+        return units
+
+    # --- Running ---
+    def _write_partitions(self, unit_id, df):
+        files = []
+        for (pid, source), part in df.groupby(PARTITION_COLUMNS, observed=True, sort=False):
+            directory = os.path.join(self.output_dir, f"program_identifier={pid}", f"source={source}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{unit_id}.parquet")
+            tmp_path = f"{path}.tmp"
+            pq.write_table(export_table(part), tmp_path, compression=self.compression)
+            os.replace(tmp_path, path)
+            files.append(os.path.relpath(path, self.output_dir))
+        return files
+
+    def run_unit(self, unit_id, programs):
+        """Pulls and writes one unit; returns its manifest entry."""
+        statuses = {}
+        start = time.perf_counter()
+        df = db_utils.run_combined_engagement_query(
+            programs,
+            campaign_type=self.campaign_type,
+            concurrent=not self.sequential_sources,
+            optimize=False,  # export_table sets the column types
+            progress=lambda step, status: statuses.__setitem__(step, status),
+            cancel_event=self.cancel_event,
+            **self.query_kwargs,
+        )
+        failed = {source: status for source, status in statuses.items() if status in ("failed", "timed out")}
+        if failed:
+            # Writing now would export those programs without these sources; retry next run
+            self._update_unit(unit_id, status=FAILED, error=f"sources {failed}")
+            return self.manifest["units"][unit_id]
+
+        files = self._write_partitions(unit_id, df) if not df.empty else []
+        self._update_unit(
+            unit_id, status=DONE, files=files, rows=len(df),
+            seconds=round(time.perf_counter() - start, 2),
+            finished_at=dt.datetime.now().isoformat(timespec="seconds"),
+        )
+        return self.manifest["units"][unit_id]
+
+    def run(self, program_ids):
+        """
+        Exports program_ids, skipping programs already done in this directory, and logs
+        throughput as units finish. Returns a summary dict.
+        """
+        units = self.plan(program_ids)
+        skipped = len(set(program_ids)) - sum(len(programs) for _, programs in units)
+        if skipped:
+            logger.info("Resuming: %d program(s) already exported", skipped)
+        logger.info("Exporting %d program(s) in %d unit(s), %d at a time", sum(len(p) for _, p in units), len(units), self.max_workers)
+
+        start = time.perf_counter()
+        rows = finished = failed = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="batch-export")
+        try:
+            futures = {executor.submit(self.run_unit, unit_id, programs): unit_id for unit_id, programs in units}
+            for future in as_completed(futures):
+                unit_id = futures[future]
+                try:
+                    unit = future.result()
+                except QueryCancelled:
+                    continue
+                except Exception as e:
+                    logger.exception("%s failed: %s", unit_id, e)
+                    self._update_unit(unit_id, status=FAILED, error=f"{type(e).__name__}: {e}")
+                    unit = self.manifest["units"][unit_id]
+                finished += 1
+                if unit["status"] != DONE:
+                    failed += 1
+                    logger.warning("%s failed (%s); it will be retried on the next run", unit_id, unit.get("error"))
+                    continue
+                rows += unit["rows"]
+                elapsed = time.perf_counter() - start
+                remaining = (elapsed / finished) * (len(units) - finished)
+                logger.info(
+                    "%s done: %d program(s), %s rows in %.1fs | %d/%d units, %s rows/s overall, ~%.0fs left",
+                    unit_id, len(unit["programs"]), f"{unit['rows']:,}", unit["seconds"],
+                    finished, len(units), f"{rows / max(elapsed, 1e-9):,.0f}", remaining,
+                )
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; stopping running units (rerun to resume)")
+            self.cancel_event.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        elapsed = time.perf_counter() - start
+        summary = {
+            "units": len(units), "failed_units": failed, "rows": rows, "seconds": round(elapsed, 2),
+            "rows_per_second": round(rows / elapsed, 1) if elapsed else None,
+            "programs_done": len(self.done_programs() & set(program_ids)), "programs_requested": len(set(program_ids)),
+        }
+        with self._lock:
+            self.manifest.setdefault("runs", []).append({**summary, "finished_at": dt.datetime.now().isoformat(timespec="seconds")})
+            self._save_manifest()
+        return summary
@@ -0,0 +1,146 @@
+# bulk_fetch.py
+"""
+COPY-based bulk fetch for large Postgres source queries.
+
+The regular path (cur.fetchall() -> pd.DataFrame) decodes every value into a Python
+object and then has pandas box it again. read_postgres_copy() instead runs
+    COPY (SELECT ...) TO STDOUT WITH (FORMAT csv, HEADER true)
+and feeds the stream straight into pyarrow's multithreaded CSV reader, which parses
+into typed columnar buffers. Column types come from describing the query first, so
+ints, dates and timestamps are parsed natively; types Arrow has no equivalent for
+(e.g. the tsmultirange activation ranges) and numeric (kept exact, as Decimal) arrive
+as text and are decoded once per distinct value with psycopg's own loader, giving the
+same objects as the row path.
+
+Which sources use it is set per source in config.COPY_FETCH_SOURCES.
+"""
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from analytics_utils import config
+
+# Postgres type name -> Arrow type for the CSV reader; anything else is read as text.
+# numeric is left out on purpose: psycopg's loader decodes it to Decimal, as the row path does.
+_ARROW_TYPES = {
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "bool": pa.bool_(),
+    "text": pa.string(),
+    "varchar": pa.string(),
+    "bpchar": pa.string(),
+    "name": pa.string(),
+    "uuid": pa.string(),
+    "json": pa.string(),
+    "jsonb": pa.string(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("us"),
+    "timestamptz": pa.timestamp("us", tz="UTC"),  # the COPY runs with TimeZone = UTC
+}
+
+
+def copy_fetch_sources():
+    """Sources configured to use the COPY path (config.COPY_FETCH_SOURCES)."""
+    return set(getattr(config, "COPY_FETCH_SOURCES", None) or [])
+
+
+class _CopyStream(io.RawIOBase):
+    """Readable file object over the data blocks of a psycopg Copy."""
+
+    def __init__(self, copy):
+        self._blocks = iter(copy)
+        self._pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._pending = memoryview(block)
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _describe(cur, query, params):
+    """[(column name, type oid)] for a query, without fetching any rows."""
+    cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0", params)
+    return [(desc.name, desc.type_code) for desc in cur.description]
+
+def _column_plan(columns, context):
+    """
+    Arrow types for the CSV reader, plus psycopg text loaders for columns Arrow
+    can't type (decoded afterwards). context is the psycopg connection.
+    """
+    from psycopg.pq import Format  # loaded already: context is a live psycopg connection
+
+    adapters = context.adapters
+    column_types, loaders = {}, {}
+    for name, oid in columns:
+        info = adapters.types.get(oid)
+        arrow_type = _ARROW_TYPES.get(info.name if info is not None else None)
+        if arrow_type is not None:
+            column_types[name] = arrow_type
+            continue
+        column_types[name] = pa.string()
+        loader_cls = adapters.get_loader(oid, Format.TEXT)
+        if loader_cls is not None:
+            loaders[name] = loader_cls(oid, context)
+    return column_types, loaders
+
+def table_from_csv(stream, column_types):
+    """Parses COPY ... (FORMAT csv, HEADER true) output into an Arrow table."""
+    return pa_csv.read_csv(
+        stream,
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            # COPY writes NULL as an empty unquoted field and '' as ""
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=["t"],
+            false_values=["f"],
+        ),
+    )
+
+def frame_from_table(table, loaders):
+    """
+    Arrow table -> DataFrame shaped like the row path's: dates as datetime.date,
+    nullable integers, and loader-decoded values for text-transported types.
+    """
+    df = table.to_pandas(
+        date_as_object=True,
+        types_mapper=lambda t: pd.Int64Dtype() if pa.types.is_integer(t) else None,
+    )
+    for name, loader in loaders.items():
+        # Decode each distinct value once (activation ranges repeat on every row of a program)
+        decoded = {value: loader.load(value.encode()) for value in df[name].dropna().unique()}
+        df[name] = pd.Series(
+            [None if value is None or value != value else decoded[value] for value in df[name]],
+            index=df.index, dtype=object,
+        )
+    return df
+
+
+def read_postgres_copy(query, params, conn):
+    """
+    Runs query through COPY ... TO STDOUT (CSV) on conn and returns a DataFrame.
+    """
+    with conn.cursor() as cur:
+        columns = _describe(cur, query, params)
+        column_types, loaders = _column_plan(columns, conn)
+        # Scoped to this transaction: ISO dates and UTC timestamptz for the Arrow parser
+        cur.execute("SET LOCAL TimeZone = 'UTC'")
+        cur.execute("SET LOCAL DateStyle = 'ISO, YMD'")
+        with cur.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)", params) as copy:
+            table = table_from_csv(io.BufferedReader(_CopyStream(copy), buffer_size=1 << 20), column_types)
+    return frame_from_table(table, loaders)
@@ -18,4 +18,114 @@ SSH_CREDS = {
     "ssh_host": "ssh_host",
     "ssh_user": "ssh_user",
     "ssh_key_path": r"C:\Path\to\Secret_Key.pem"
-}
\ No newline at end of file
+}
+
+# Optional: process-wide Postgres connection pool (see connections.py)
+POSTGRES_POOL_CONFIG = {
+    "min_size": 1,
+    "max_size": 8,
+    "timeout": 30,
+    "max_idle": 300,
+    "max_lifetime": 3600,
+    "prepare_threshold": 0
+}
+
+# Optional: shared SSH tunnel + MySQL connection pool (see connections.py)
+MYSQL_POOL_CONFIG = {
+    "max_size": 4,
+    "checkout_timeout": 30,
+    "connect_timeout": 10,
+    "health_check_interval": 30,
+    "ssh_keepalive": 30
+}
+
+
+# Optional: in-process NPI -> specialty cache (see specialties.py)
+SPECIALTY_CACHE_CONFIG = {
+    "max_size": 500000,
+    "ttl_seconds": 86400
+}
+
+# Optional: local result cache for source queries (see result_cache.py)
+RESULT_CACHE_CONFIG = {
+    "enabled": False,
+    "directory": r"~/.cache/healthcasts-analytics/results",
+    "ttl_seconds": 3600,
+    "max_memory_bytes": 512 * 1024 ** 2,
+    "max_disk_bytes": 4 * 1024 ** 3
+}
+
+# Optional: local store for incremental (watermark-based) refreshes (see incremental.py)
+INCREMENTAL_CONFIG = {
+    "directory": r"~/.cache/healthcasts-analytics/incremental",
+    "overlap_days": 2
+}
+
+# Optional: give up on any single engagement source after this many seconds
+SOURCE_TIMEOUT_SECONDS = 300
+
+# Optional: background query jobs for the Dash app (see jobs.py)
+JOB_CONFIG = {
+    "max_workers": 2,
+    "keep_finished_seconds": 3600
+}
+
+# Optional: Postgres sources to fetch with COPY ... TO STDOUT into Arrow instead of
+# row by row (see bulk_fetch.py); worth it for the biggest sources
+COPY_FETCH_SOURCES = []
+
+# Optional: time-on-asset summary settings (see time_spent.py)
+TIME_SPENT_CONFIG = {
+    "min_seconds": 8,
+    "max_seconds": 3600,
+    "bucket_edges_seconds": [30, 60, 180, 360],
+    "bucket_labels": ["3-30 seconds", "30 sec -1 minute", "1 min - 3 minutes", "3 min - 6 minutes", "> 6 min"],
+    "percentiles": [25, 75, 90]
+}
+
+# Optional: large Choozle program lists go through session temp tables in parallel chunks
+CHOOZLE_QUERY_CONFIG = {
+    "temp_table_min_programs": 100,
+    "chunk_size": 500,
+    "max_workers": 4
+}
+
+# Optional: daily per-program rollups behind the app's summary view (see rollups.py)
+ROLLUP_CONFIG = {
+    "directory": r"~/.cache/healthcasts-analytics/rollups",
+    "incremental": False
+}
+
+# Optional: frequency bands and funnel stages for the app's metrics (see engagement_metrics.py)
+METRICS_CONFIG = {
+    "frequency_bands": [1, 2, 3, 5, 10],
+    "funnel_stages": [
+        {"name": "Email engagement", "source": "email_engagement"},
+        {"name": "Asset view", "source": "asset_view"},
+        {"name": "Survey response", "source": "survey_response"}
+    ]
+}
+
+# Optional: batch Parquet exports (see batch_export.py); keep max_workers x sources
+# within the database pools' max_size
+BATCH_EXPORT_CONFIG = {
+    "programs_per_unit": 10,
+    "max_workers": 2,
+    "compression": "zstd"
+}
+
+# Optional: identical Runs in flight at the same time share one query (see single_flight.py)
+SINGLE_FLIGHT_CONFIG = {
+    "enabled": True
+}
+
+# Optional: open the database pools and SSH tunnel when app.py is imported, instead of
+# on the first Run (see startup.py; with gunicorn --preload use its post_fork hook)
+STARTUP_CONFIG = {
+    "warm_up": False,
+    "warm_up_postgres": True,
+    "warm_up_mysql": True
+}
+
+# Optional: log level for the Dash app (query timings are logged per stage at DEBUG)
+LOG_LEVEL = "INFO"
@@ -0,0 +1,389 @@
+# connections.py
+"""
+Long-lived, process-wide connections for the query functions in db_utils.
+
+The MySQL sources sit behind an SSH bastion. Rather than opening a new
+tunnel and a new MySQL login for every query, a single MySQLTunnelPool per
+set of credentials keeps one tunnel open (on an ephemeral local port) and
+hands out pooled pymysql connections over it. The Postgres (dbt.*) sources
+share a psycopg_pool.ConnectionPool per set of credentials in the same way.
+
+The drivers (psycopg, psycopg_pool, pymysql) and the SSH stack (sshtunnel/paramiko)
+are imported on first use through import_driver(), so a process that only talks to
+Postgres never loads the MySQL/SSH side, and importing this module is cheap.
+Credentials default to config.POSTGRES_CREDS / MYSQL_CREDS / SSH_CREDS as they are
+when a pool is first requested, not when this module was imported.
+"""
+import atexit
+import importlib
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from analytics_utils import config
+from analytics_utils.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.MYSQL_POOL_CONFIG
+MYSQL_POOL_DEFAULTS = {
+    "max_size": 4,                 # max open MySQL connections per tunnel
+    "checkout_timeout": 30,        # seconds to wait for a free connection
+    "connect_timeout": 10,         # seconds for a new MySQL login
+    "health_check_interval": 30,   # ping connections idle longer than this
+    "ssh_keepalive": 30,           # SSH transport keepalive, in seconds
+}
+
+# Defaults for anything not set in config.POSTGRES_POOL_CONFIG
+POSTGRES_POOL_DEFAULTS = {
+    "min_size": 1,                 # connections kept open while idle
+    "max_size": 8,                 # hard cap per process
+    "timeout": 30,                 # seconds to wait for a free connection
+    "max_idle": 300,               # close surplus connections idle this long
+    "max_lifetime": 3600,          # recycle connections after this many seconds
+    "prepare_threshold": 0,        # prepare server-side on first use; None disables (transaction-mode pgbouncer)
+}
+
+
+def import_driver(name):
+    """
+    The module `name`, imported on first use. The first import is timed as an
+    "import" stage (instrumentation.py), so it shows up in that request's breakdown.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        with timed("import", name):
+            module = importlib.import_module(name)
+    return module
+
+
+def postgres_creds(creds=None):
+    """creds, or config.POSTGRES_CREDS as it is now."""
+    return config.POSTGRES_CREDS if creds is None else creds
+
+def mysql_creds(my_creds=None, ss_creds=None):
+    """(my_creds, ss_creds), defaulting to config.MYSQL_CREDS / config.SSH_CREDS as they are now."""
+    return (
+        config.MYSQL_CREDS if my_creds is None else my_creds,
+        config.SSH_CREDS if ss_creds is None else ss_creds,
+    )
+
+
+def _pool_settings(name, defaults):
+    settings = dict(defaults)
+    settings.update(getattr(config, name, None) or {})
+    return settings
+
+
+# pymysql errors that mean the forwarded connection never reached MySQL
+# (CR_CONN_HOST_ERROR, CR_SERVER_LOST); only these are worth a tunnel restart
+_MYSQL_TRANSPORT_ERRORS = {2003, 2013}
+
+
+class MySQLTunnelPool:
+    """
+    One SSH tunnel plus a bounded pool of MySQL connections riding on it.
+
+    The tunnel is started lazily, restarted whenever the SSH transport drops,
+    and binds to an OS-assigned local port so several pools (or processes)
+    never compete for the same port. Connections are health-checked on
+    checkout and dropped if they were opened on an older tunnel.
+    """
+
+    def __init__(self, my_creds, ss_creds, **settings):
+        self.my_creds = my_creds
+        self.ss_creds = ss_creds
+        self.settings = {**_pool_settings("MYSQL_POOL_CONFIG", MYSQL_POOL_DEFAULTS), **settings}
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.settings["max_size"])
+        self._idle = queue.LifoQueue()  # (conn, tunnel_generation, last_used)
+        self._tunnel = None
+        self._generation = 0
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._stats = {"checkouts": 0, "in_use": 0, "connections_opened": 0, "tunnel_starts": 0, "wait_ms": 0.0}
+
+    # --- Tunnel ---
+    def _tunnel_is_healthy(self):
+        return self._tunnel is not None and self._tunnel.is_active
+
+    def _start_tunnel(self):
+        ss_creds, my_creds = self.ss_creds, self.my_creds
+        SSHTunnelForwarder = import_driver("sshtunnel").SSHTunnelForwarder
+        tunnel = SSHTunnelForwarder(
+            (ss_creds['ssh_host'], ss_creds.get('ssh_port', 22)),
+            ssh_username=ss_creds['ssh_user'],
+            ssh_pkey=ss_creds['ssh_key_path'],
+            remote_bind_address=(my_creds['mysql_host'], my_creds['mysql_port']),
+            local_bind_address=('127.0.0.1', 0),  # let the OS pick a free port
+            set_keepalive=self.settings["ssh_keepalive"],
+        )
+        # Don't let tunnel threads keep the interpreter alive on exit
+        tunnel.daemon_forward_servers = True
+        tunnel.daemon_transport = True
+        with timed("tunnel", "mysql"):
+            tunnel.start()
+        return tunnel
+
+    def _ensure_tunnel(self, failed_generation=None):
+        """
+        (local port, generation) of a running tunnel. failed_generation forces a
+        restart, unless another thread has already replaced that tunnel.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MySQL tunnel pool has been closed.")
+            force_restart = failed_generation is not None and failed_generation == self._generation
+            if force_restart or not self._tunnel_is_healthy():
+                if self._tunnel is not None:
+                    self._stop_tunnel()
+                self._tunnel = self._start_tunnel()
+                self._generation += 1
+                with self._stats_lock:
+                    self._stats["tunnel_starts"] += 1
+            return self._tunnel.local_bind_port, self._generation
+
+    def _stop_tunnel(self):
+        self._drain_idle()
+        try:
+            self._tunnel.stop(force=True)
+        except Exception as e:
+            logger.warning("Failed to stop SSH tunnel cleanly: %s", e)
+        self._tunnel = None
+
+    # --- Connections ---
+    def _connect(self, port):
+        my_creds = self.my_creds
+        pymysql = import_driver("pymysql")
+        with timed("login", "mysql"):
+            return pymysql.connect(
+                host='127.0.0.1',
+                port=port,
+                user=my_creds['mysql_user'],
+                password=my_creds['mysql_password'],
+                db=my_creds['mysql_db'],
+                connect_timeout=self.settings["connect_timeout"],
+                # Pooled connections are reused across queries; without autocommit
+                # each one would keep reading from its first REPEATABLE READ snapshot.
+                autocommit=True,
+            )
+
+    def _new_connection(self):
+        port, generation = self._ensure_tunnel()
+        try:
+            conn = self._connect(port)
+        except import_driver("pymysql").err.OperationalError as e:
+            # Login errors (e.g. 1045 access denied) aren't the tunnel's fault
+            code = e.args[0] if e.args else None
+            if code not in _MYSQL_TRANSPORT_ERRORS and self._tunnel_is_healthy():
+                raise
+            # The tunnel can look alive while its forward is dead; rebuild it once
+            # (unless a thread that hit the same dead tunnel already did)
+            port, generation = self._ensure_tunnel(failed_generation=generation)
+            conn = self._connect(port)
+        with self._stats_lock:
+            self._stats["connections_opened"] += 1
+        return conn, generation
+
+    def _checkout(self):
+        while True:
+            try:
+                conn, generation, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection()
+
+            if generation != self._generation or not self._tunnel_is_healthy():
+                _close_quietly(conn)
+                continue
+            if time.monotonic() - last_used > self.settings["health_check_interval"]:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    _close_quietly(conn)
+                    continue
+            return conn, generation
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a MySQL connection for the duration of a with-block.
+        The connection is returned to the pool afterwards, or discarded if
+        the block raised a connection-level error.
+        """
+        pymysql = import_driver("pymysql")
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.settings["checkout_timeout"]):
+            raise TimeoutError("Timed out waiting for a pooled MySQL connection.")
+        with self._stats_lock:
+            self._stats["wait_ms"] += (time.perf_counter() - started) * 1000
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        conn = None
+        try:
+            conn, generation = self._checkout()
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            if conn is not None:
+                _close_quietly(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._closed or generation != self._generation:
+                    _close_quietly(conn)
+                else:
+                    self._idle.put((conn, generation, time.monotonic()))
+            with self._stats_lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def _drain_idle(self):
+        while True:
+            try:
+                conn, _, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            _close_quietly(conn)
+
+    def get_stats(self):
+        """Pool counters, in the same spirit as psycopg_pool's get_stats()."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            "pool_max": self.settings["max_size"],
+            "pool_available": self._idle.qsize(),
+            "tunnel_active": self._tunnel_is_healthy(),
+            "local_port": self._tunnel.local_bind_port if self._tunnel_is_healthy() else None,
+        })
+        return stats
+
+    def close(self):
+        """Close idle connections and stop the tunnel."""
+        with self._lock:
+            self._closed = True
+            if self._tunnel is not None:
+                self._stop_tunnel()
+            else:
+                self._drain_idle()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+# --- Process-wide registry ---
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _creds_key(*creds):
+    return tuple(tuple(sorted(c.items())) for c in creds)
+
+
+def get_mysql_pool(my_creds=None, ss_creds=None):
+    """
+    Return the shared MySQLTunnelPool for these credentials (default: config's),
+    creating it on first use.
+    """
+    my_creds, ss_creds = mysql_creds(my_creds, ss_creds)
+    key = ("mysql",) + _creds_key(my_creds, ss_creds)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = MySQLTunnelPool(my_creds, ss_creds)
+        return pool
+
+
+def get_postgres_pool(creds=None):
+    """
+    Return the shared psycopg ConnectionPool for these credentials (default: config's),
+    creating it on first use. Sizing, idle timeout and max lifetime come from
+    config.POSTGRES_POOL_CONFIG.
+    """
+    creds = postgres_creds(creds)
+    key = ("postgres",) + _creds_key(creds)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            ConnectionPool = import_driver("psycopg_pool").ConnectionPool
+            settings = _pool_settings("POSTGRES_POOL_CONFIG", POSTGRES_POOL_DEFAULTS)
+            pool = _POOLS[key] = ConnectionPool(
+                # Prepared statements live per connection, so pooled connections reuse their plans
+                kwargs={**creds, "prepare_threshold": settings["prepare_threshold"]},
+                min_size=settings["min_size"],
+                max_size=settings["max_size"],
+                timeout=settings["timeout"],
+                max_idle=settings["max_idle"],
+                max_lifetime=settings["max_lifetime"],
+                check=ConnectionPool.check_connection,  # validate before handing out
+                name=f"postgres-{creds.get('host')}-{creds.get('dbname')}",
+                open=True,
+            )
+        return pool
+
+
+def test_postgres_connection(creds=None) -> bool:
+    try:
+        conn = import_driver("psycopg").connect(**postgres_creds(creds))
+        conn.close()
+        logger.info("PostgreSQL connection successful.")
+        return True
+    except Exception as e:
+        logger.error("PostgreSQL connection failed: %s", e)
+        return False
+
+def test_mysql_connection(my_creds=None, ss_creds=None) -> bool:
+    try:
+        # Borrow a connection over the shared SSH tunnel
+        with get_mysql_pool(my_creds, ss_creds).connection() as conn:
+            conn.ping(reconnect=False)
+        logger.info("MySQL connection successful.")
+        return True
+    except Exception as e:
+        logger.error("MySQL connection failed: %s", e)
+        return False
+
+
+def pool_stats():
+    """
+    Snapshot of every open pool: checkouts, wait time, connections in use, etc.
+    Keys are the pool names ("postgres-<host>-<db>", "mysql-<host>-<db>").
+    """
+    with _POOLS_LOCK:
+        pools = list(_POOLS.items())
+    stats = {}
+    for key, pool in pools:
+        if key[0] == "postgres":
+            raw = pool.get_stats()
+            stats[pool.name] = {
+                **raw,
+                "checkouts": raw.get("requests_num", 0),
+                "wait_ms": raw.get("requests_wait_ms", 0),
+                "in_use": raw.get("pool_size", 0) - raw.get("pool_available", 0),
+            }
+        else:
+            stats[f"mysql-{pool.my_creds.get('mysql_host')}-{pool.my_creds.get('mysql_db')}"] = pool.get_stats()
+    return stats
+
+
+def close_all_pools():
+    """Shut down every pool and tunnel opened by this process."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_all_pools)
+# A forked worker (e.g. gunicorn --preload) must not reuse the parent's sockets;
+# forget inherited pools so each child builds its own on first use.
+os.register_at_fork(after_in_child=_POOLS.clear)
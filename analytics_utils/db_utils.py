@@ -1,247 +1,467 @@
 # db_utils.py
-import psycopg
-import pymysql
-from sshtunnel import SSHTunnelForwarder
+"""
+Engagement and time-spent queries against the dbt Postgres tables and the Choozle
+MySQL database, returned as DataFrames.
+
+The database drivers are imported on first use (connections.import_driver), and
+credentials left as None resolve to config.POSTGRES_CREDS / MYSQL_CREDS / SSH_CREDS
+when the query runs, so config changes apply without re-importing this module.
+"""
+import logging
+import time
+from contextlib import ExitStack
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 import warnings
 warnings.filterwarnings(action='ignore')
 
 import pandas as pd
-from analytics_utils.config import POSTGRES_CREDS, MYSQL_CREDS, SSH_CREDS
+from analytics_utils import config
+from analytics_utils.bulk_fetch import copy_fetch_sources, read_postgres_copy
+from analytics_utils.connections import (
+    get_mysql_pool, get_postgres_pool, import_driver, postgres_creds, test_mysql_connection, test_postgres_connection,
+)
+from analytics_utils.dtypes import memory_report, optimize_dtypes
+from analytics_utils.incremental import get_incremental_store
+from analytics_utils.instrumentation import frame_bytes, in_current_context, timed, with_run_timer
+from analytics_utils.result_cache import get_result_cache, program_set_key, result_cache_settings, split_by_program
+from analytics_utils.specialties import get_specialty_resolver
+from analytics_utils.time_spent import summarize_durations, time_spent_settings
 
-# --- Test Connection ---
-def test_postgres_connection(creds=POSTGRES_CREDS) -> bool:
-    try:
-        conn = psycopg.connect(**creds)
-        conn.close()
-        print("✅ PostgreSQL connection successful.")
-        return True
-    except Exception as e:
-        print("❌ PostgreSQL connection failed:", e)
-        return False
+logger = logging.getLogger(__name__)
 
-def test_mysql_connection(my_creds=MYSQL_CREDS, ss_creds=SSH_CREDS) -> bool:
-    try:
-        # Start SSH tunnel
-        server = SSHTunnelForwarder(
-            (ss_creds['ssh_host'], 22),
-            ssh_username=ss_creds['ssh_user'],
-            ssh_pkey=ss_creds['ssh_key_path'],
-            remote_bind_address=(my_creds['mysql_host'], my_creds['mysql_port']),
-            local_bind_address=('127.0.0.1', 3307)  # Local port forwarded
-        )
-        server.start()
-        # Connect to MySQL using pymysql
-        conn = pymysql.connect(
-            host='127.0.0.1',
-            port=server.local_bind_port,
-            user=my_creds['mysql_user'],
-            password=my_creds['mysql_password'],
-            db=my_creds['mysql_db']
-        )
-        conn.close()
-        print("✅ MySQL connection successful.")
-        return True
-    except Exception as e:
-        print("❌ MySQL connection failed:", e)
-        return False
-    
-# --- Data Queries ---
-def run_email_engagement_query(program_ids, creds=POSTGRES_CREDS):
-    if isinstance(program_ids, int):
-        program_ids = [program_ids]
+# --- Query Builders ---
+# Bump whenever a source query changes what it returns; older cached results are then ignored
+QUERY_VERSION = 1
+
+# dbt table behind each Postgres engagement source, keyed by its `source` label
+POSTGRES_SOURCE_TABLES = {
+    "email_engagement": "dbt.email_engagements",
+    "asset_view": "dbt.asset_views",
+    "survey_response": "dbt.survey_responses",
+    "adbutler_banner_ad": "dbt.banner_ad_impressions",
+}
+
+# Columns each source actually needs: what run_combined_engagement_query keeps,
+# plus program_activation_ranges, which is only used to derive program dates/status.
+_PROGRAM_COLUMNS = [
+    "program_identifier",
+    "program_name",
+    "program_drug_brand_name",
+    "program_activation_ranges",
+    "provider_npi",
+    "engaged_on",
+    "engaged_at",
+    "engagement_type",
+]
+POSTGRES_SOURCE_COLUMNS = {
+    "email_engagement": _PROGRAM_COLUMNS + ["email_campaign_identifier", "email_campaign_subject", "email_campaign_link_url"],
+    "asset_view": _PROGRAM_COLUMNS,
+    "survey_response": _PROGRAM_COLUMNS + ["survey_question_number", "survey_response", "survey_location"],
+    "adbutler_banner_ad": _PROGRAM_COLUMNS,
+}
+
+_table_columns_cache = {}
+
+def _table_columns(table, creds):
+    """
+    Column names of a dbt table, looked up once per process from information_schema.
+    Returns an empty list if the catalog can't be read.
+    """
+    creds = postgres_creds(creds)
+    key = (table, creds.get("host"), creds.get("dbname"))
+    if key not in _table_columns_cache:
+        schema, name = table.split(".")
+        try:
+            df = _read_postgres(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+                [schema, name], creds, source="catalog"
+            )
+            _table_columns_cache[key] = df["column_name"].tolist() if not df.empty else []
+        except Exception as e:
+            logger.error("Could not read columns for %s: %s", table, e)
+            return []
+    return _table_columns_cache[key]
 
+def watermark_column(source, creds=None):
+    """
+    The engagement timestamp a source can be filtered on incrementally: engaged_at
+    where the dbt table has it, engaged_on otherwise (always for Choozle).
+    """
+    if source in POSTGRES_SOURCE_TABLES and "engaged_at" in _table_columns(POSTGRES_SOURCE_TABLES[source], creds):
+        return "engaged_at"
+    return "engaged_on"
+
+def _program_id_array(program_ids):
+    """
+    Program IDs as a single int8[] parameter. Typing every element as Int8 keeps the
+    parameter type fixed; psycopg would otherwise pick int2/int4/int8 by value.
+    """
+    Int8 = import_driver("psycopg.types.numeric").Int8
+    return [Int8(pid) for pid in program_ids]
+
+def _postgres_source_query(source, program_ids, creds, extra_columns=None, since=None):
+    """
+    SQL and parameters for one of the dbt engagement tables in POSTGRES_SOURCE_TABLES.
+
+    Selects only POSTGRES_SOURCE_COLUMNS[source] plus any extra_columns, limited to
+    the columns the table really has. Falls back to SELECT * if the table's
+    columns can't be looked up. With since set, only rows whose watermark_column
+    is at or after it are returned.
+    """
+    table = POSTGRES_SOURCE_TABLES[source]
+    wanted = POSTGRES_SOURCE_COLUMNS[source] + [c for c in (extra_columns or []) if c not in POSTGRES_SOURCE_COLUMNS[source]]
+    available = set(_table_columns(table, creds))
+    if available:
+        select_list = ', '.join(f't."{col}"' for col in wanted if col in available)
+    else:
+        select_list = '*'
+
+    query = f"""
+        SELECT {select_list}, '{source}' as source
+        FROM {table} t
+        WHERE t.program_identifier = ANY(%s)
+    """
+    params = [_program_id_array(program_ids)]
+    if since is not None:
+        query += f'    AND t."{watermark_column(source, creds)}" >= %s\n'
+        params.append(since)
+    return query, params
+
+# Shared by the IN-list and temp-table forms of the Choozle query so both return the same rows
+_CHOOZLE_SELECT = """
+    SELECT
+        PRG_ID AS program_identifier,
+        npiNumber AS provider_npi,
+        MAX(date) AS engaged_on,
+        ad_name AS choozle_banner_ad_name,
+        CASE
+            WHEN activity = 'Ad View' THEN 'choozle_banner_impression'
+            ELSE 'choozle_banner_click'
+        END AS engagement_type,
+        destination_url AS choozle_banner_link_url,
+        'choozle_banner_ad' AS source
+"""
+_CHOOZLE_GROUP_BY = """
+    GROUP BY
+        program_identifier,
+        provider_npi,
+        choozle_banner_ad_name,
+        engagement_type,
+        choozle_banner_link_url,
+        source
+"""
+
+def _choozle_query(program_ids, since=None):
     placeholders = ','.join(['%s'] * len(program_ids))
+    date_filter = "AND date >= %s" if since is not None else ""
+
     query = f"""
-        SELECT *, 'email_engagement' as source
-        FROM dbt.email_engagements ee
-        WHERE ee.program_identifier IN ({placeholders})
+    {_CHOOZLE_SELECT}
+    FROM healthst_media.tbl_banner_data
+    WHERE PRG_ID IN ({placeholders})
+      {date_filter}
+      AND npiNumber IN (
+          SELECT npi
+          FROM healthst_master.tbl_btl_concentrate
+          WHERE fk_prgID IN ({placeholders})
+      )
+    {_CHOOZLE_GROUP_BY}
     """
+    # Use the same list of program_ids for both placeholders
+    since_params = [since] if since is not None else []
+    return query, list(program_ids) + since_params + list(program_ids)
 
-    try:
-        with psycopg.connect(**creds) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, program_ids)
+# --- Temp-table Choozle query for large program lists ---
+# Defaults for anything not set in config.CHOOZLE_QUERY_CONFIG
+CHOOZLE_QUERY_DEFAULTS = {
+    "temp_table_min_programs": 100,  # use temp tables from this many programs up
+    "chunk_size": 500,               # programs per temp-table query
+    "max_workers": 4,                # chunks queried at once (each holds a pooled connection)
+}
+
+# Session temp tables: the programs whose banner rows a chunk reads, and every
+# requested program for the BTL concentrate filter (as in the IN-list query, an
+# NPI qualifies if it is in the concentrate of any requested program)
+_CHOOZLE_PROGRAMS_TABLE = "tmp_choozle_programs"
+_CHOOZLE_CONCENTRATE_TABLE = "tmp_choozle_concentrate_programs"
+
+# MySQL error codes for a missing privilege (ER_DBACCESS_DENIED_ERROR, ER_TABLEACCESS_DENIED_ERROR);
+# only these make the temp-table query fall back to IN lists
+_MYSQL_ACCESS_DENIED = {1044, 1142}
+
+def _choozle_temp_table_query(since=None):
+    date_filter = "AND date >= %s" if since is not None else ""
+
+    query = f"""
+    {_CHOOZLE_SELECT}
+    FROM healthst_media.tbl_banner_data
+    JOIN {_CHOOZLE_PROGRAMS_TABLE} p ON p.prg_id = PRG_ID
+    WHERE npiNumber IN (
+          SELECT c.npi
+          FROM healthst_master.tbl_btl_concentrate c
+          JOIN {_CHOOZLE_CONCENTRATE_TABLE} cp ON cp.prg_id = c.fk_prgID
+      )
+      {date_filter}
+    {_CHOOZLE_GROUP_BY}
+    """
+    return query, [since] if since is not None else []
+
+def _read_choozle_temp_table(program_ids, all_program_ids, my_creds, ss_creds, since=None):
+    """Runs the Choozle query for program_ids on one pooled connection, joined against temp tables."""
+    source = "choozle_banner_ad"
+    tables = ((_CHOOZLE_PROGRAMS_TABLE, program_ids), (_CHOOZLE_CONCENTRATE_TABLE, all_program_ids))
+    with ExitStack() as stack:
+        with timed("connect", source):
+            conn = stack.enter_context(get_mysql_pool(my_creds, ss_creds).connection())
+        cur = stack.enter_context(conn.cursor())
+        try:
+            with timed("temp_tables", source) as stage:
+                for table, ids in tables:
+                    cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}")
+                    cur.execute(f"CREATE TEMPORARY TABLE {table} (prg_id BIGINT PRIMARY KEY)")
+                    # executemany batches these into multi-row INSERTs
+                    cur.executemany(f"INSERT IGNORE INTO {table} (prg_id) VALUES (%s)", [(pid,) for pid in ids])
+                stage["rows"] = len(program_ids)
+            with timed("execute", source):
+                cur.execute(*_choozle_temp_table_query(since))
+            with timed("fetch", source) as stage:
                 rows = cur.fetchall()
-                colnames = [desc.name for desc in cur.description]
-                df = pd.DataFrame(rows, columns=colnames)
-                print(f"✅ Pulled {len(df)} email engagements for {program_ids}")
+                stage["rows"] = len(rows)
+            colnames = [desc[0] for desc in cur.description]
+        finally:
+            # Pooled connections outlive this query; don't leave the tables in the session.
+            # A failed DROP is only logged, so it never hides the query's own error.
+            try:
+                for table, _ in tables:
+                    cur.execute(f"DROP TEMPORARY TABLE IF EXISTS {table}")
+            except Exception as e:
+                logger.warning("Could not drop the Choozle temp tables: %s", e)
+    return _rows_to_frame(rows, colnames, source)
+
+def _read_choozle(program_ids, my_creds, ss_creds, since=None):
+    """
+    The Choozle query for any number of programs. Short lists use the IN-list query;
+    from CHOOZLE_QUERY_CONFIG["temp_table_min_programs"] up the IDs go into session
+    temp tables instead, in chunks queried in parallel. Rows are grouped per program,
+    so concatenating the chunks gives the same rows as one query.
+    """
+    settings = {**CHOOZLE_QUERY_DEFAULTS, **(getattr(config, "CHOOZLE_QUERY_CONFIG", None) or {})}
+    program_ids = list(dict.fromkeys(program_ids))
+    if len(program_ids) < settings["temp_table_min_programs"]:
+        return _read_mysql(*_choozle_query(program_ids, since), my_creds, ss_creds, source="choozle_banner_ad")
+
+    chunk_size = settings["chunk_size"]
+    chunks = [program_ids[i:i + chunk_size] for i in range(0, len(program_ids), chunk_size)]
+    read_chunk = partial(_read_choozle_temp_table, all_program_ids=program_ids, my_creds=my_creds, ss_creds=ss_creds, since=since)
+    try:
+        if len(chunks) == 1:
+            return read_chunk(chunks[0])
+        with ThreadPoolExecutor(max_workers=min(settings["max_workers"], len(chunks)), thread_name_prefix="choozle-chunk") as executor:
+            return pd.concat(list(executor.map(in_current_context(read_chunk), chunks)), ignore_index=True)
+    except import_driver("pymysql").MySQLError as e:
+        # No CREATE TEMPORARY TABLES privilege; anything else is a real failure
+        if not e.args or e.args[0] not in _MYSQL_ACCESS_DENIED:
+            raise
+        logger.warning("Choozle temp-table query failed, falling back to IN lists: %s", e)
+        return _read_mysql(*_choozle_query(program_ids, since), my_creds, ss_creds, source="choozle_banner_ad")
+
+def _rows_to_frame(rows, colnames, source=None):
+    with timed("dataframe", source) as stage:
+        df = pd.DataFrame(rows, columns=colnames)
+        stage["rows"], stage["bytes"] = len(df), frame_bytes(df)
+    return df
+
+def _read_postgres(query, params, creds, source=None):
+    with ExitStack() as stack:
+        with timed("connect", source):
+            conn = stack.enter_context(get_postgres_pool(creds).connection())
+        cur = stack.enter_context(conn.cursor())
+        with timed("execute", source):
+            cur.execute(query, params)
+        with timed("fetch", source) as stage:
+            rows = cur.fetchall()
+            stage["rows"] = len(rows)
+        colnames = [desc.name for desc in cur.description]
+    return _rows_to_frame(rows, colnames, source)
+
+def _read_postgres_source(source, query, params, creds):
+    """
+    Reads one source query, through COPY into Arrow (bulk_fetch.py) for sources listed
+    in config.COPY_FETCH_SOURCES and row by row otherwise.
+    """
+    if source in copy_fetch_sources():
+        try:
+            with ExitStack() as stack:
+                with timed("connect", source):
+                    conn = stack.enter_context(get_postgres_pool(creds).connection())
+                with timed("copy", source) as stage:
+                    df = read_postgres_copy(query, params, conn)
+                    stage["rows"], stage["bytes"] = len(df), frame_bytes(df)
                 return df
+        except Exception as e:
+            logger.warning("COPY fetch failed for %s, falling back to row fetch: %s", source, e)
+    return _read_postgres(query, params, creds, source)
+
+def _read_mysql(query, params, my_creds, ss_creds, source=None):
+    with ExitStack() as stack:
+        # Borrow a pooled connection over the shared SSH tunnel (timed as "tunnel" when it has to open)
+        with timed("connect", source):
+            conn = stack.enter_context(get_mysql_pool(my_creds, ss_creds).connection())
+        cur = stack.enter_context(conn.cursor())
+        with timed("execute", source):
+            cur.execute(query, params)
+        with timed("fetch", source) as stage:
+            rows = cur.fetchall()
+            stage["rows"] = len(rows)
+        colnames = [desc[0] for desc in cur.description]
+    return _rows_to_frame(rows, colnames, source)
+
+# --- Data Queries ---
+def run_email_engagement_query(program_ids, creds=None, extra_columns=None, since=None):
+    """
+    Fetch email engagements for one or more program_identifiers. Only the columns
+    in POSTGRES_SOURCE_COLUMNS are selected; pass extra_columns to pull more, and
+    since to only pull engagements at or after that timestamp.
+    """
+    if isinstance(program_ids, int):
+        program_ids = [program_ids]
+
+    try:
+        df = _read_postgres_source("email_engagement", *_postgres_source_query("email_engagement", program_ids, creds, extra_columns, since), creds)
+        logger.info("Pulled %d email engagements for %s", len(df), program_ids)
+        return df
     except Exception as e:
-        print("❌ Email engagement query failed:", e)
+        logger.exception("Email engagement query failed: %s", e)
         return pd.DataFrame()
 
-def run_asset_view_query(program_ids, creds=POSTGRES_CREDS):
+def run_asset_view_query(program_ids, creds=None, extra_columns=None, since=None):
     if isinstance(program_ids, int):
         program_ids = [program_ids]
 
-    placeholders = ','.join(['%s'] * len(program_ids))
-    query = f"""
-        SELECT *, 'asset_view' as source
-        FROM dbt.asset_views av
-        WHERE av.program_identifier IN ({placeholders})
-    """
-
     try:
-        with psycopg.connect(**creds) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, program_ids)
-                rows = cur.fetchall()
-                colnames = [desc.name for desc in cur.description]
-                df = pd.DataFrame(rows, columns=colnames)
-                print(f"✅ Pulled {len(df)} asset views for {program_ids}")
-                return df
+        df = _read_postgres_source("asset_view", *_postgres_source_query("asset_view", program_ids, creds, extra_columns, since), creds)
+        logger.info("Pulled %d asset views for %s", len(df), program_ids)
+        return df
     except Exception as e:
-        print("❌ Asset view query failed:", e)
+        logger.exception("Asset view query failed: %s", e)
         return pd.DataFrame()
 
-def run_survey_response_query(program_ids, creds=POSTGRES_CREDS):
+def run_survey_response_query(program_ids, creds=None, extra_columns=None, since=None):
     """
     Fetch survey responses for one or more program_identifiers.
     """
     if isinstance(program_ids, int):
         program_ids = [program_ids]
 
-    placeholders = ','.join(['%s'] * len(program_ids))
-    query = f"""
-        SELECT *, 'survey_response' as source
-        FROM dbt.survey_responses sr
-        WHERE sr.program_identifier IN ({placeholders})
-    """
-
     try:
-        with psycopg.connect(**creds) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, program_ids)
-                rows = cur.fetchall()
-                colnames = [desc.name for desc in cur.description]
-                df = pd.DataFrame(rows, columns=colnames)
-                print(f"✅ Pulled {len(df)} survey responses for {program_ids}")
-                return df
+        df = _read_postgres_source("survey_response", *_postgres_source_query("survey_response", program_ids, creds, extra_columns, since), creds)
+        logger.info("Pulled %d survey responses for %s", len(df), program_ids)
+        return df
     except Exception as e:
-        print("❌ Survey response query failed:", e)
+        logger.exception("Survey response query failed: %s", e)
         return pd.DataFrame()
     
-def run_adbutler_banner_impression_query(program_ids, creds=POSTGRES_CREDS):
+def run_adbutler_banner_impression_query(program_ids, creds=None, extra_columns=None, since=None):
     """
     Fetch AdButler banner ad impressions from dbt.banner_ad_impressions.
     """
     if isinstance(program_ids, int):
         program_ids = [program_ids]
 
-    placeholders = ','.join(['%s'] * len(program_ids))
-    query = f"""
-        SELECT *, 'adbutler_banner_ad' as source
-        FROM dbt.banner_ad_impressions bai
-        WHERE bai.program_identifier IN ({placeholders})
-    """
-
     try:
-        with psycopg.connect(**creds) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, program_ids)
-                rows = cur.fetchall()
-                colnames = [desc.name for desc in cur.description]
-                df = pd.DataFrame(rows, columns=colnames)
-                print(f"✅ Pulled {len(df)} AdButler banner impressions for {program_ids}")
-                return df
+        df = _read_postgres_source("adbutler_banner_ad", *_postgres_source_query("adbutler_banner_ad", program_ids, creds, extra_columns, since), creds)
+        logger.info("Pulled %d AdButler banner impressions for %s", len(df), program_ids)
+        return df
     except Exception as e:
-        print("❌ AdButler banner impression query failed:", e)
+        logger.exception("AdButler banner impression query failed: %s", e)
         return pd.DataFrame()
     
-def run_choozle_banner_engagement_query(program_ids, my_creds=MYSQL_CREDS, ss_creds=SSH_CREDS):
+def run_choozle_banner_engagement_query(program_ids, my_creds=None, ss_creds=None, since=None):
     """
     Fetch Choozle banner ad impressions and clicks for one or more program IDs.
-    Filters to users in BTL concentrate. Returns a pandas DataFrame.
+    Filters to users in BTL concentrate. Returns a pandas DataFrame. Large program
+    lists are joined through temp tables in parallel chunks (see _read_choozle).
     """
     if isinstance(program_ids, int):
         program_ids = [program_ids]
 
-    placeholders = ','.join(['%s'] * len(program_ids))
-
-    query = f"""
-    SELECT
-        PRG_ID AS program_identifier,
-        npiNumber AS provider_npi,
-        MAX(date) AS engaged_on,
-        ad_name AS choozle_banner_ad_name,
-        CASE
-            WHEN activity = 'Ad View' THEN 'choozle_banner_impression'
-            ELSE 'choozle_banner_click'
-        END AS engagement_type,
-        destination_url AS choozle_banner_link_url,
-        'choozle_banner_ad' AS source
-    FROM healthst_media.tbl_banner_data
-    WHERE PRG_ID IN ({placeholders})
-      AND npiNumber IN (
-          SELECT npi
-          FROM healthst_master.tbl_btl_concentrate
-          WHERE fk_prgID IN ({placeholders})
-      )
-    GROUP BY
-        program_identifier,
-        provider_npi,
-        choozle_banner_ad_name,
-        engagement_type,
-        choozle_banner_link_url,
-        source
-    """
-
     try:
-        # Start SSH tunnel
-        server = SSHTunnelForwarder(
-            (ss_creds['ssh_host'], 22),
-            ssh_username=ss_creds['ssh_user'],
-            ssh_pkey=ss_creds['ssh_key_path'],
-            remote_bind_address=(my_creds['mysql_host'], my_creds['mysql_port']),
-            local_bind_address=('127.0.0.1', 3307)  # Local port forwarded
-        )
-        server.start()
-        # Connect to MySQL using pymysql
-        conn = pymysql.connect(
-            host='127.0.0.1',
-            port=server.local_bind_port,
-            user=my_creds['mysql_user'],
-            password=my_creds['mysql_password'],
-            db=my_creds['mysql_db']
-        )
-        with conn.cursor() as cur:
-            # Use the same list of program_ids for both placeholders
-            cur.execute(query, program_ids + program_ids)
-            rows = cur.fetchall()
-            colnames = [desc[0] for desc in cur.description]
-            df = pd.DataFrame(rows, columns=colnames)
-            print(f"✅ Pulled {len(df)} Choozle banner engagements for {program_ids}")
-            return df
+        df = _read_choozle(program_ids, my_creds, ss_creds, since)
+        logger.info("Pulled %d Choozle banner engagements for %s", len(df), program_ids)
+        return df
     except Exception as e:
-        print("❌ Choozle banner engagement query failed:", e)
+        logger.exception("Choozle banner engagement query failed: %s", e)
         return pd.DataFrame()
-    finally:
-        conn.close()
 
-def get_provider_specialties_for_npis(npis, creds=POSTGRES_CREDS):
+# --- Streaming Queries ---
+DEFAULT_CHUNK_SIZE = 50_000
+
+def _iter_postgres_chunks(query, params, creds, chunk_size):
+    with get_postgres_pool(creds).connection() as conn:
+        # A named cursor keeps the result set on the server; rows arrive chunk_size at a time
+        with conn.cursor(name="engagement_stream") as cur:
+            cur.itersize = chunk_size
+            cur.execute(query, params)
+            colnames = [desc.name for desc in cur.description]
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=colnames)
+
+def _iter_mysql_chunks(query, params, my_creds, ss_creds, chunk_size):
+    with get_mysql_pool(my_creds, ss_creds).connection() as conn:
+        # SSCursor reads rows off the socket as they are fetched instead of buffering them all
+        with conn.cursor(import_driver("pymysql.cursors").SSCursor) as cur:
+            cur.execute(query, params)
+            colnames = [desc[0] for desc in cur.description]
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=colnames)
+
+def iter_engagement_source(
+    source,
+    program_ids,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    pg_creds=None,
+    my_creds=None,
+    ss_creds=None,
+    extra_columns=None,
+    since=None
+):
+    """
+    Streams one engagement source as DataFrame chunks of at most chunk_size rows.
+
+    Uses a server-side (named) cursor on Postgres and an unbuffered SSCursor on
+    MySQL, so only one chunk of rows is held in memory at a time. The pooled
+    connection is held until the generator is exhausted or closed.
+    """
+    if isinstance(program_ids, int):
+        program_ids = [program_ids]
+
+    if source == "choozle_banner_ad":
+        yield from _iter_mysql_chunks(*_choozle_query(program_ids, since), my_creds, ss_creds, chunk_size)
+    elif source in POSTGRES_SOURCE_TABLES:
+        yield from _iter_postgres_chunks(*_postgres_source_query(source, program_ids, pg_creds, extra_columns, since), pg_creds, chunk_size)
+    else:
+        raise ValueError(f"Unknown engagement source: {source}")
+
+def get_provider_specialties_for_npis(npis, creds=None):
     """
     Returns specialties for the given list of NPIs from dbt.int_provider_specialties.
+    Served from the shared SpecialtyResolver cache; only unseen NPIs are queried.
     """
     if not npis:
         return pd.DataFrame(columns=["provider_npi", "specialty"])
 
-    placeholders = ','.join(['%s'] * len(npis))
-    query = f"""
-        SELECT provider_npi, specialty
-        FROM dbt.int_provider_specialties
-        WHERE provider_npi IN ({placeholders})
-    """
-
     try:
-        with psycopg.connect(**creds) as conn:
-            with conn.cursor() as cur:
-                cur.execute(query, npis)
-                rows = cur.fetchall()
-                colnames = [desc.name for desc in cur.description]
-                return pd.DataFrame(rows, columns=colnames)
+        return get_specialty_resolver(creds).resolve(npis)
     except Exception as e:
-        print("❌ Failed to load provider specialties:", e)
+        logger.exception("Failed to load provider specialties: %s", e)
         return pd.DataFrame(columns=["provider_npi", "specialty"])
 
 def parse_psycopg_tsmultirange(multirange_obj):
@@ -262,15 +482,374 @@ def parse_psycopg_tsmultirange(multirange_obj):
         return pd.Series([start_date, end_date, status])
 
     except Exception as e:
-        print(f"Error parsing range: {e}")
+        logger.warning("Error parsing range: %s", e)
         return pd.Series([None, None, None])
 
+def program_activation_dates(df):
+    """
+    Parses program_activation_ranges once per distinct program rather than once per row.
+
+    The ranges are a program-level attribute repeated on every engagement row, so the
+    first non-null value per program is parsed with parse_psycopg_tsmultirange.
+    Returns a DataFrame indexed by program_identifier with program_start_date,
+    program_end_date and program_status.
+    """
+    ranges = (
+        df.loc[df['program_activation_ranges'].notna(), ['program_identifier', 'program_activation_ranges']]
+        .drop_duplicates('program_identifier')
+        .set_index('program_identifier')['program_activation_ranges']
+    )
+    with timed("parse_ranges") as stage:
+        dates = ranges.apply(parse_psycopg_tsmultirange)
+        stage["rows"] = len(ranges)
+    if dates.empty:
+        dates = pd.DataFrame(index=ranges.index, columns=[0, 1, 2])
+    dates.columns = ['program_start_date', 'program_end_date', 'program_status']
+    return dates
+
+# Program-level attributes, one value per program_identifier
+PROGRAM_DIMENSION_COLUMNS = [
+    'program_name',
+    'program_drug_brand_name',
+    'program_start_date',
+    'program_end_date',
+    'program_status'
+]
+
+def program_dimension(df):
+    """
+    One row of program metadata per program_identifier, built from the rows in df.
+
+    Takes the first non-null name/brand per program and parses its activation ranges
+    once (see program_activation_dates). Built per call and keyed by program id;
+    programs whose rows carry no metadata (e.g. Choozle only) get an all-null row.
+    """
+    names = df.groupby('program_identifier')[['program_name', 'program_drug_brand_name']].first()
+    dates = program_activation_dates(df)
+    return names.join(dates, how='outer').reindex(columns=PROGRAM_DIMENSION_COLUMNS)
+
+# Engagement sources pulled for each campaign type, named after their `source` column
+CAMPAIGN_SOURCES = {
+    "custom": ["email_engagement", "asset_view", "survey_response", "choozle_banner_ad"],
+    "turnkey": ["email_engagement", "adbutler_banner_ad"],
+    "all": ["email_engagement", "asset_view", "survey_response", "choozle_banner_ad", "adbutler_banner_ad"],
+}
+
+# Sources whose rows for one program depend on the other programs requested with it
+# (Choozle's BTL concentrate rule), so they are never cached or split per program
+PROGRAM_SET_SOURCES = {"choozle_banner_ad"}
+
+# Columns returned by run_combined_engagement_query, in order
+COMBINED_COLUMNS = [
+    "program_identifier",
+    "program_name",
+    "program_drug_brand_name",
+    "program_start_date",
+    "program_end_date",
+    "program_status",
+    "provider_npi",
+    "specialty",
+    "email_campaign_identifier",
+    "email_campaign_subject",
+    "email_campaign_link_url",
+    "choozle_banner_ad_name",
+    "choozle_banner_link_url",
+    "engaged_on",
+    "engaged_at",
+    "engagement_type",
+    "source",
+    "survey_question_number",
+    "survey_response",
+    "survey_location"
+]
+
+def _run_source(source, program_ids, pg_creds, my_creds, ss_creds, extra_columns=None, since=None):
+    if source == "email_engagement":
+        return run_email_engagement_query(program_ids, pg_creds, extra_columns, since)
+    if source == "asset_view":
+        return run_asset_view_query(program_ids, pg_creds, extra_columns, since)
+    if source == "survey_response":
+        return run_survey_response_query(program_ids, pg_creds, extra_columns, since)
+    if source == "adbutler_banner_ad":
+        return run_adbutler_banner_impression_query(program_ids, pg_creds, extra_columns, since)
+    if source == "choozle_banner_ad":
+        return run_choozle_banner_engagement_query(program_ids, my_creds, ss_creds, since)
+    raise ValueError(f"Unknown engagement source: {source}")
+
+class QueryCancelled(Exception):
+    """Raised when the caller's cancel_event is set while a combined query is running."""
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise QueryCancelled("Query was cancelled.")
+
+def _report(progress, step, status):
+    if progress is not None:
+        progress(step, status)
+
+def _source_status(df):
+    # Source functions return a frame without columns when their query failed
+    return f"done ({len(df):,} rows)" if len(df.columns) else "failed"
+
+def _wait_for_source(future, deadline, cancel_event):
+    """
+    future.result() that gives up at the deadline and checks cancel_event every half second.
+    """
+    while True:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        step = remaining if cancel_event is None else min(0.5, 0.5 if remaining is None else remaining)
+        try:
+            return future.result(timeout=step)
+        except FutureTimeoutError:
+            _check_cancelled(cancel_event)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+
+def _collect_source_chunks(source, program_ids, pg_creds, my_creds, ss_creds, chunk_size, extra_columns=None, since=None):
+    """
+    Streams a source chunk by chunk, keeping only the columns the combined frame
+    needs, so raw driver rows and unused wide columns never exceed a single chunk.
+
+    The trimmed chunks are still concatenated into one frame, so memory grows with
+    the source's row count (and briefly doubles during the concat). Callers that need
+    memory bounded by chunk_size should consume iter_engagement_source directly.
+    """
+    keep = set(COMBINED_COLUMNS) | {"program_activation_ranges"} | set(extra_columns or [])
+    chunks = []
+    try:
+        with timed("stream", source) as stage:
+            for chunk in iter_engagement_source(source, program_ids, chunk_size, pg_creds, my_creds, ss_creds, extra_columns, since):
+                chunks.append(chunk[[col for col in chunk.columns if col in keep]])
+            stage["rows"] = sum(len(chunk) for chunk in chunks)
+            stage["bytes"] = sum(frame_bytes(chunk) for chunk in chunks)
+    except Exception as e:
+        logger.exception("%s streaming query failed: %s", source, e)
+        return pd.DataFrame()
+
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+    logger.info("Streamed %d %s rows in %d chunk(s) for %s", len(df), source, len(chunks), program_ids)
+    return df
+
+def fetch_engagement_sources(
+    sources,
+    program_ids,
+    pg_creds=None,
+    my_creds=None,
+    ss_creds=None,
+    concurrent=True,
+    source_timeout=None,
+    chunk_size=None,
+    extra_columns=None,
+    since=None,
+    progress=None,
+    cancel_event=None
+):
+    """
+    Runs the given source queries and returns {source: DataFrame}.
+
+    With concurrent=True every source is issued at once on its own thread, so
+    wall-clock time is roughly the slowest source rather than the sum. A source
+    that fails, or is still running after source_timeout seconds, comes back as
+    an empty DataFrame without affecting the others. With chunk_size set, each
+    source is streamed (see iter_engagement_source) instead of fetched whole.
+    extra_columns are selected on top of each Postgres source's declared columns,
+    and since limits every source to engagements at or after that timestamp.
+
+    program_ids and since may also be dicts keyed by source, to query each source
+    for a different set of programs or from a different point in time.
+
+    progress, if given, is called as progress(source, status) as each source starts
+    and finishes. Setting cancel_event stops waiting and raises QueryCancelled.
+    """
+    ids_for = program_ids if isinstance(program_ids, dict) else dict.fromkeys(sources, program_ids)
+    since_for = since if isinstance(since, dict) else dict.fromkeys(sources, since)
+
+    if chunk_size:
+        run = partial(_collect_source_chunks, chunk_size=chunk_size, extra_columns=extra_columns)
+    else:
+        run = partial(_run_source, extra_columns=extra_columns)
+
+    def run_source(source):
+        _report(progress, source, "running")
+        with timed("source", source) as stage:
+            df = run(source, ids_for[source], pg_creds, my_creds, ss_creds, since=since_for.get(source))
+            stage["rows"], stage["bytes"] = len(df), frame_bytes(df)
+            if not len(df.columns):
+                stage["error"] = "query failed"
+        return df
+
+    if not concurrent:
+        results = {}
+        for source in sources:
+            _check_cancelled(cancel_event)
+            results[source] = run_source(source)
+            _report(progress, source, _source_status(results[source]))
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix="engagement-source")
+    try:
+        # in_current_context: source threads record their stages into the caller's run
+        futures = {source: executor.submit(in_current_context(run_source), source) for source in sources}
+        deadline = None if source_timeout is None else time.monotonic() + source_timeout
+        results = {}
+        for source, future in futures.items():
+            try:
+                results[source] = _wait_for_source(future, deadline, cancel_event)
+                _report(progress, source, _source_status(results[source]))
+            except QueryCancelled:
+                raise
+            except FutureTimeoutError:
+                logger.error("%s query timed out after %ss", source, source_timeout)
+                _report(progress, source, "timed out")
+                results[source] = pd.DataFrame()
+            except Exception as e:
+                logger.exception("%s query failed: %s", source, e)
+                _report(progress, source, "failed")
+                results[source] = pd.DataFrame()
+        return results
+    finally:
+        # Don't block on a timed-out source; its thread finishes in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _cache_units(source, program_ids):
+    """
+    {cache unit: program IDs it covers} for one source: one unit per program, except
+    for PROGRAM_SET_SOURCES, whose rows depend on the whole program list and are
+    cached as one entry for exactly that (sorted) list.
+    """
+    if source in PROGRAM_SET_SOURCES:
+        return {program_set_key(program_ids): program_ids}
+    return {pid: [pid] for pid in program_ids}
+
+def _fetch_sources_cached(sources, program_ids, campaign_type, pg_creds, my_creds, ss_creds, extra_columns=None, **fetch_kwargs):
+    """
+    fetch_engagement_sources behind the result cache: each source is only queried for
+    the programs that have no fresh cached result, and what comes back is split per
+    program (per program list for PROGRAM_SET_SOURCES) and stored.
+    """
+    cache = get_result_cache()
+    program_ids = list(dict.fromkeys(program_ids))
+    units = {source: _cache_units(source, program_ids) for source in sources}
+    names = {
+        (source, unit): cache.entry_name(source, unit, campaign_type, QUERY_VERSION, extra_columns)
+        for source in sources for unit in units[source]
+    }
+    with timed("cache_lookup") as stage:
+        parts = {key: cache.get(name) for key, name in names.items()}
+        stage["rows"] = sum(len(part) for part in parts.values() if part is not None)
+
+    to_fetch, misses = {}, 0
+    for source in sources:
+        missing = [unit for unit in units[source] if parts[(source, unit)] is None]
+        misses += len(missing)
+        if missing:
+            to_fetch[source] = [pid for unit in missing for pid in units[source][unit]]
+        else:
+            _report(fetch_kwargs.get("progress"), source, "cached")
+
+    if to_fetch:
+        fetched = fetch_engagement_sources(
+            list(to_fetch), to_fetch, pg_creds, my_creds, ss_creds, extra_columns=extra_columns, **fetch_kwargs
+        )
+        for source, df in fetched.items():
+            # A frame without columns means the query failed or timed out; never cache that
+            if len(df.columns) == 0:
+                continue
+            with timed("cache_store", source):
+                if source in PROGRAM_SET_SOURCES:
+                    split = {program_set_key(program_ids): df}
+                else:
+                    split = split_by_program(df, to_fetch[source])
+                for unit, part in split.items():
+                    cache.put(names[(source, unit)], part)
+                    parts[(source, unit)] = part
+
+    hits = len(names) - misses
+    logger.info("Result cache served %d/%d source results for %s", hits, len(names), program_ids)
+
+    source_dfs = {}
+    for source in sources:
+        frames = [parts[(source, unit)] for unit in units[source] if parts[(source, unit)] is not None]
+        frames = [df for df in frames if not df.empty]
+        source_dfs[source] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return source_dfs
+
+def _fetch_sources_incremental(sources, program_ids, pg_creds, my_creds, ss_creds, extra_columns=None, **fetch_kwargs):
+    """
+    fetch_engagement_sources against the local incremental store: programs seen before
+    are only queried for rows past their watermark (less the overlap window), new
+    programs get a full pull, and the merged rows become the new stored state.
+    PROGRAM_SET_SOURCES are stored per exact program list (see _cache_units) and
+    always queried with the whole list.
+    """
+    store = get_incremental_store()
+    program_ids = list(dict.fromkeys(program_ids))
+    units = {source: _cache_units(source, program_ids) for source in sources}
+    with timed("incremental_load"):
+        stored = {(source, unit): store.load(source, unit, extra_columns) for source in sources for unit in units[source]}
+
+    # Split each source into programs needing a full pull and programs with a watermark
+    full_ids, incremental_ids, since = {}, {}, {}
+    for source in sources:
+        watermarks = {unit: stored[(source, unit)][1] for unit in units[source]}
+        new = [pid for unit, wm in watermarks.items() if wm is None for pid in units[source][unit]]
+        known = [unit for unit, wm in watermarks.items() if wm is not None]
+        if new:
+            full_ids[source] = new
+        if known:
+            incremental_ids[source] = [pid for unit in known for pid in units[source][unit]]
+            since[source] = store.since(min(watermarks[unit] for unit in known))
+
+    fetched = {}
+    for ids, since_arg in ((full_ids, None), (incremental_ids, since)):
+        if not ids:
+            continue
+        results = fetch_engagement_sources(
+            list(ids), ids, pg_creds, my_creds, ss_creds, extra_columns=extra_columns, since=since_arg, **fetch_kwargs
+        )
+        for source, df in results.items():
+            fetched.setdefault(source, []).append((ids[source], (since_arg or {}).get(source), df))
+
+    source_dfs = {}
+    for source in sources:
+        wm_col = watermark_column(source, pg_creds)
+        parts = {unit: stored[(source, unit)][0] for unit in units[source]}
+        new_rows = 0
+        for ids, source_since, df in fetched.get(source, []):
+            # A frame without columns means the query failed or timed out; keep what's stored
+            if len(df.columns) == 0:
+                continue
+            new_rows += len(df)
+            with timed("incremental_merge", source):
+                if source in PROGRAM_SET_SOURCES:
+                    split = {program_set_key(program_ids): df}
+                else:
+                    split = split_by_program(df, ids)
+                for unit, fresh in split.items():
+                    parts[unit] = store.merge(source, parts[unit], fresh, source_since, wm_col)
+                    store.save(source, unit, parts[unit], wm_col, extra_columns)
+        logger.info("Incremental refresh pulled %d %s rows for %s", new_rows, source, program_ids)
+
+        frames = [df for df in parts.values() if df is not None and not df.empty]
+        source_dfs[source] = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return source_dfs
+
+@with_run_timer("combined_engagement")
 def run_combined_engagement_query(
     program_ids,
-    pg_creds=POSTGRES_CREDS,
-    my_creds=MYSQL_CREDS,
-    ss_creds=SSH_CREDS,
-    campaign_type="custom"  # "custom" or "turnkey"
+    pg_creds=None,
+    my_creds=None,
+    ss_creds=None,
+    campaign_type="custom",  # "custom", "turnkey" or "all"
+    concurrent=True,
+    source_timeout=None,
+    chunk_size=None,
+    extra_columns=None,
+    use_cache=None,
+    incremental=False,
+    optimize=True,
+    progress=None,
+    cancel_event=None
 ):
     """
     Combines engagement sources based on campaign type.
@@ -278,7 +857,26 @@ def run_combined_engagement_query(
     Parameters:
         - program_ids (list[int] or int)
         - campaign_type: "custom" includes all except AdButler, 
-                         "turnkey" includes only AdButler and Email
+                         "turnkey" includes only AdButler and Email,
+                         "all" includes every source (used to build rollups.py)
+        - concurrent: query all sources at once instead of one after another
+        - source_timeout: seconds to wait for each source before treating it as empty
+                          (defaults to config.SOURCE_TIMEOUT_SECONDS, if set)
+        - chunk_size: stream each source in chunks of this many rows, trimming
+                      unused columns as they arrive. This avoids holding a source's
+                      full list of driver tuples, but the result is still one frame of
+                      every row; use iter_engagement_source to stay within a chunk
+        - extra_columns: additional dbt columns to select and keep, beyond COMBINED_COLUMNS
+        - use_cache: serve per-program source results from the local result cache
+                     (defaults to config.RESULT_CACHE_CONFIG["enabled"], off unless set)
+        - incremental: keep a local copy of each program's rows and only pull rows newer
+                       than its watermark (see incremental.py); takes precedence over use_cache
+        - optimize: convert the result to compact dtypes (categoricals, downcast/nullable
+                    integers, Arrow strings, parsed dates; see dtypes.py) and print the savings
+        - progress: optional progress(step, status) callback, called per source and
+                    for the final "combine" step
+        - cancel_event: optional threading.Event; once set, the query stops at the next
+                        check and raises QueryCancelled
 
     Returns:
         - pandas DataFrame of unified engagement data
@@ -286,152 +884,150 @@ def run_combined_engagement_query(
     if isinstance(program_ids, int):
         program_ids = [program_ids]
 
-    email_df = run_email_engagement_query(program_ids, pg_creds)
+    if campaign_type not in CAMPAIGN_SOURCES:
+        raise ValueError(f"campaign_type must be one of {', '.join(CAMPAIGN_SOURCES)}")
+    if source_timeout is None:
+        source_timeout = getattr(config, "SOURCE_TIMEOUT_SECONDS", None)
 
-    # Initialize source list
-    dfs = [email_df]
+    if use_cache is None:
+        use_cache = result_cache_settings()["enabled"]
 
-    if campaign_type == "custom":
-        dfs.append(run_asset_view_query(program_ids, pg_creds))
-        dfs.append(run_survey_response_query(program_ids, pg_creds))
-        dfs.append(run_choozle_banner_engagement_query(program_ids, my_creds, ss_creds))
-    elif campaign_type == "turnkey":
-        dfs.append(run_adbutler_banner_impression_query(program_ids, pg_creds))
-    else:
-        raise ValueError("campaign_type must be either 'custom' or 'turnkey'")
+    fetch_kwargs = dict(
+        concurrent=concurrent, source_timeout=source_timeout, chunk_size=chunk_size,
+        progress=progress, cancel_event=cancel_event
+    )
+    with timed("fetch_sources"):
+        if incremental:
+            source_dfs = _fetch_sources_incremental(
+                CAMPAIGN_SOURCES[campaign_type], program_ids, pg_creds, my_creds, ss_creds,
+                extra_columns=extra_columns, **fetch_kwargs
+            )
+        elif use_cache:
+            source_dfs = _fetch_sources_cached(
+                CAMPAIGN_SOURCES[campaign_type], program_ids, campaign_type, pg_creds, my_creds, ss_creds,
+                extra_columns=extra_columns, **fetch_kwargs
+            )
+        else:
+            source_dfs = fetch_engagement_sources(
+                CAMPAIGN_SOURCES[campaign_type], program_ids, pg_creds, my_creds, ss_creds,
+                extra_columns=extra_columns, **fetch_kwargs
+            )
+    _check_cancelled(cancel_event)
+    _report(progress, "combine", "running")
 
-    combined_df = pd.concat([df for df in dfs if not df.empty], ignore_index=True)
+    dfs = [df for df in source_dfs.values() if not df.empty]
+    if not dfs:
+        _report(progress, "combine", "done (no rows)")
+        logger.warning("No %s engagements found for %s", campaign_type, program_ids)
+        return pd.DataFrame()
 
-    combined_df[['program_start_date', 'program_end_date', 'program_status']] = (
-        combined_df['program_activation_ranges'].apply(parse_psycopg_tsmultirange)
-    )
+    with timed("concat") as stage:
+        combined_df = pd.concat(dfs, ignore_index=True)
+        stage["rows"] = len(combined_df)
 
+    # Program metadata only comes from the Postgres sources; a Choozle-only result won't have it
+    for col in ['program_activation_ranges', 'program_name', 'program_drug_brand_name']:
+        if col not in combined_df.columns:
+            combined_df[col] = None
 
-    combined_df[[
-        'program_name',
-        'program_drug_brand_name',
-        'program_start_date',
-        'program_end_date',
-        'program_status'
-    ]] = (
-        combined_df
-        .groupby('program_identifier')[[
-            'program_name',
-            'program_drug_brand_name',
-            'program_start_date',
-            'program_end_date',
-            'program_status'
-        ]]
-        .transform(lambda x: x.ffill().bfill())
-    )
+    # Broadcast program-level metadata onto every row (Choozle rows carry none of their own)
+    with timed("program_dimension"):
+        programs = program_dimension(combined_df)
+        for col in PROGRAM_DIMENSION_COLUMNS:
+            combined_df[col] = combined_df['program_identifier'].map(programs[col])
 
     # Join specialty via provider_npi
-    npis = combined_df['provider_npi'].dropna().unique().tolist()
-    specialties_df = get_provider_specialties_for_npis(npis, pg_creds)
-    if not specialties_df.empty:
-        combined_df = combined_df.merge(specialties_df, on="provider_npi", how="left")
-    else:
-        combined_df["specialty"] = None
-
-    columns_to_keep = [
-        "program_identifier",
-        "program_name",
-        "program_drug_brand_name",
-        "program_start_date",
-        "program_end_date",
-        "program_status",
-        "provider_npi",
-        "specialty",
-        "email_campaign_identifier",
-        "email_campaign_subject",
-        "email_campaign_link_url",
-        "choozle_banner_ad_name",
-        "choozle_banner_link_url",
-        "engaged_on",
-        "engaged_at",
-        "engagement_type",
-        "source",
-        "survey_question_number",
-        "survey_response",
-        "survey_location"
-    ]
-
-    combined_df = combined_df[[col for col in columns_to_keep if col in combined_df.columns]]
-
-    print(f"✅ Combined {campaign_type} engagement dataset contains {len(combined_df)} rows and {len(combined_df.columns)} columns.")
-    return combined_df
+    _check_cancelled(cancel_event)
+    with timed("specialties") as stage:
+        npis = combined_df['provider_npi'].dropna().unique().tolist()
+        specialties_df = get_provider_specialties_for_npis(npis, pg_creds)
+        if not specialties_df.empty:
+            combined_df = combined_df.merge(specialties_df, on="provider_npi", how="left")
+        else:
+            combined_df["specialty"] = None
+        stage["rows"] = len(npis)
 
-def run_time_spent_summary_query(program_ids, my_creds=MYSQL_CREDS, ss_creds=SSH_CREDS):
-    if isinstance(program_ids, int):
-        program_ids = [program_ids]
+    output_columns = COMBINED_COLUMNS + [col for col in (extra_columns or []) if col not in COMBINED_COLUMNS]
+    combined_df = combined_df[[col for col in output_columns if col in combined_df.columns]]
+
+    if optimize:
+        with timed("optimize_dtypes") as stage:
+            compact_df = optimize_dtypes(combined_df)
+            report = memory_report(combined_df, compact_df)
+            stage["bytes"] = int(report.loc["TOTAL", "bytes_after"])
+        before_mb, after_mb = report.loc["TOTAL", "bytes_before"] / 1024 ** 2, report.loc["TOTAL", "bytes_after"] / 1024 ** 2
+        logger.info("Optimized dtypes: %.1f MB -> %.1f MB", before_mb, after_mb)
+        combined_df = compact_df
 
+    logger.info(
+        "Combined %s engagement dataset contains %d rows and %d columns.",
+        campaign_type, len(combined_df), len(combined_df.columns)
+    )
+    _report(progress, "combine", f"done ({len(combined_df):,} rows)")
+    return combined_df
+
+def _time_spent_sessions_query(program_ids, min_seconds, max_seconds):
     placeholders = ','.join(['%s'] * len(program_ids))
 
     query = f"""
-    SELECT
-        NPI,
-        PRG_ID as program_identifier,
-        start_time,
-        end_time,
-        AVG(mins_spent) as ATS,
-        SUM(CASE WHEN (mins_spent*60) < 30 THEN 1 ELSE 0 END) / COUNT(*) AS `3-30 seconds`,
-        SUM(CASE WHEN (mins_spent*60) >= 30 AND (mins_spent*60) < 60 THEN 1 ELSE 0 END) / COUNT(*) AS `30 sec -1 minute`,
-        SUM(CASE WHEN (mins_spent*60) >= 60 AND (mins_spent*60) < 180 THEN 1 ELSE 0 END) / COUNT(*) AS `1 min - 3 minutes`,
-        SUM(CASE WHEN (mins_spent*60) >= 180 AND (mins_spent*60) < 360 THEN 1 ELSE 0 END) / COUNT(*) AS `3 min - 6 minutes`,
-        SUM(CASE WHEN (mins_spent*60) >= 360 THEN 1 ELSE 0 END) / COUNT(*) AS `> 6 min`
+    SELECT program_identifier, NPI, seconds_spent
     FROM (
-        SELECT 
+        SELECT
+            a.fk_prgID AS program_identifier,
             u.npiNumber AS NPI,
-            a.fk_prgID AS PRG_ID,
-            start_time,
-            end_time,
-            (TIMESTAMPDIFF(SECOND, start_time, end_time) / 60) AS mins_spent
+            TIMESTAMPDIFF(SECOND, ts.start_time, ts.end_time) AS seconds_spent
         FROM healthst_master.tbl_app_tracking_time_spent ts
         LEFT JOIN healthst_master.tbl_user_master u ON ts.fk_uid = u.pk_uid
         JOIN healthst_master.tbl_program_assets a ON ts.asset_id = a.pk_paID
         WHERE a.fk_prgID IN ({placeholders})
-          AND (TIMESTAMPDIFF(SECOND, ts.start_time, ts.end_time) / 60) BETWEEN 0.125 AND 60
-    ) AS a
-    WHERE LENGTH(NPI) = 10
-    GROUP BY PRG_ID, NPI, start_time, end_time
+    ) AS s
+    WHERE seconds_spent BETWEEN %s AND %s
+      AND LENGTH(NPI) = 10
     """
+    return query, list(program_ids) + [min_seconds, max_seconds]
 
-    try:
-        # Start SSH tunnel
-        server = SSHTunnelForwarder(
-            (ss_creds['ssh_host'], 22),
-            ssh_username=ss_creds['ssh_user'],
-            ssh_pkey=ss_creds['ssh_key_path'],
-            remote_bind_address=(my_creds['mysql_host'], my_creds['mysql_port']),
-            local_bind_address=('127.0.0.1', 3307)  # Local port forwarded
-        )
-        server.start()
-        # Connect to MySQL using pymysql
-        conn = pymysql.connect(
-            host='127.0.0.1',
-            port=server.local_bind_port,
-            user=my_creds['mysql_user'],
-            password=my_creds['mysql_password'],
-            db=my_creds['mysql_db']
-        )
-        with conn.cursor() as cur:
-            cur.execute(query, program_ids)
-            rows = cur.fetchall()
-            colnames = [desc[0] for desc in cur.description]
-            df = pd.DataFrame(rows, columns=colnames)
-            print(f"✅ Pulled time spent summary for {len(df)} NPI(s): {program_ids}")
+def fetch_time_spent_sessions(program_ids, my_creds=None, ss_creds=None):
+    """
+    Raw tracked sessions (program_identifier, NPI, seconds_spent) for any number of
+    programs in one scan, limited to config.TIME_SPENT_CONFIG's min/max_seconds.
+    """
+    if isinstance(program_ids, int):
+        program_ids = [program_ids]
+
+    settings = time_spent_settings()
+    df = _read_mysql(
+        *_time_spent_sessions_query(program_ids, settings["min_seconds"], settings["max_seconds"]),
+        my_creds, ss_creds, source="time_spent"
+    )
+    if not df.empty:
+        df["seconds_spent"] = df["seconds_spent"].astype("int32")
+    return df
 
-            # ⏱ Print ATS in minutes and seconds
-            # for _, row in df.iterrows():
-            #     ats_minutes = row['ATS']
-            #     minutes = int(ats_minutes)
-            #     seconds = int((ats_minutes - minutes) * 60)
-            #     print(f"🕒 Program {row['program_identifier']}: {minutes} min {seconds} sec average time spent")
+@with_run_timer("time_spent_summary")
+def run_time_spent_summary_query(
+    program_ids,
+    my_creds=None,
+    ss_creds=None,
+    level="npi",
+    bucket_edges=None,
+    labels=None,
+    percentiles=None
+):
+    """
+    Time-on-asset summary per NPI within each program (level="npi") or per program
+    (level="program"): sessions, ATS, median and percentiles in minutes, and the
+    share of sessions in each duration bucket. See time_spent.py for the settings.
+    """
+    if isinstance(program_ids, int):
+        program_ids = [program_ids]
 
-            return df
+    try:
+        sessions = fetch_time_spent_sessions(program_ids, my_creds, ss_creds)
+        with timed("summarize", "time_spent") as stage:
+            df = summarize_durations(sessions, level, bucket_edges, labels, percentiles)
+            stage["rows"] = len(sessions)
+        logger.info("Pulled time spent summary for %d %s group(s) from %d sessions: %s", len(df), level, len(sessions), program_ids)
+        return df
     except Exception as e:
-        print("❌ Time spent summary query failed:", e)
+        logger.exception("Time spent summary query failed: %s", e)
         return pd.DataFrame()
-    finally:
-        conn.close()
-
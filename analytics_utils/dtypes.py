@@ -0,0 +1,109 @@
+# dtypes.py
+"""
+Memory-compact dtypes for the combined engagement frame.
+
+Source queries come back with Python object (or plain string) columns for every
+text field and int64/object for IDs. Most of those columns repeat a handful of
+values across many rows (source, engagement_type, program and campaign names),
+so categoricals shrink them and make groupby/merge on them much cheaper.
+optimize_dtypes() converts:
+    - known low-cardinality text columns (and any other repetitive text) to category
+    - remaining free text (e.g. survey responses) to Arrow-backed strings
+    - IDs and NPIs to the smallest (nullable) integer type that holds them
+    - date/timestamp columns to datetime64, parsed once here
+"""
+import numpy as np
+import pandas as pd
+
+# Text columns that always repeat heavily within a pull
+CATEGORY_COLUMNS = [
+    "source",
+    "engagement_type",
+    "program_name",
+    "program_drug_brand_name",
+    "program_status",
+    "specialty",
+    "email_campaign_subject",
+    "email_campaign_link_url",
+    "choozle_banner_ad_name",
+    "choozle_banner_link_url",
+    "survey_location",
+]
+INTEGER_COLUMNS = ["program_identifier", "provider_npi", "email_campaign_identifier", "survey_question_number"]
+DATE_COLUMNS = ["engaged_on", "engaged_at", "program_start_date", "program_end_date"]
+
+# Other text columns become categories when they have at most this many distinct values per row
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+_INTEGER_TYPES = [(np.int8, "Int8"), (np.int16, "Int16"), (np.int32, "Int32"), (np.int64, "Int64")]
+
+
+def _is_text(series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+def _compact_integer(series):
+    """
+    The smallest integer dtype for an ID column, nullable if it has gaps. Returns the
+    series unchanged if any value isn't a whole number (e.g. an alphanumeric ID).
+    """
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().sum() != series.notna().sum():
+        return series
+    values = numeric.dropna()
+    if not values.empty and not (values == np.floor(values)).all():
+        return series
+    low, high = (values.min(), values.max()) if not values.empty else (0, 0)
+    for np_type, nullable in _INTEGER_TYPES:
+        info = np.iinfo(np_type)
+        if info.min <= low and high <= info.max:
+            return numeric.astype(nullable if numeric.isna().any() else np_type)
+    return series
+
+def _compact_dates(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    parsed = pd.to_datetime(series, errors="coerce")
+    # Leave the column alone rather than silently turning unparseable values into NaT
+    return parsed if parsed.notna().sum() == series.notna().sum() else series
+
+def _compact_text(series, force_category=False):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    if pd.api.types.infer_dtype(series, skipna=True) not in ("string", "empty"):
+        return series  # other Python objects (e.g. activation multiranges) stay as they are
+    if force_category or series.nunique(dropna=True) <= CATEGORY_MAX_UNIQUE_RATIO * max(len(series), 1):
+        return series.astype("category")
+    return series.astype("string[pyarrow]")
+
+
+def optimize_dtypes(df):
+    """
+    A copy of df with compact dtypes (see module docstring). Column order and values are unchanged.
+    """
+    df = df.copy()
+    for col in df.columns:
+        series = df[col]
+        if col in DATE_COLUMNS:
+            df[col] = _compact_dates(series)
+        elif col in INTEGER_COLUMNS:
+            df[col] = _compact_integer(series)
+        elif _is_text(series):
+            df[col] = _compact_text(series, force_category=col in CATEGORY_COLUMNS)
+    return df
+
+
+def memory_report(before, after):
+    """
+    Per-column memory use (bytes, deep) of a frame before and after optimize_dtypes,
+    with a TOTAL row, largest savings first.
+    """
+    report = pd.DataFrame({
+        "dtype_before": before.dtypes.astype(str),
+        "dtype_after": after.dtypes.astype(str),
+        "bytes_before": before.memory_usage(deep=True, index=False),
+        "bytes_after": after.memory_usage(deep=True, index=False),
+    })
+    report["saved"] = report["bytes_before"] - report["bytes_after"]
+    report = report.sort_values("saved", ascending=False)
+    report.loc["TOTAL"] = ["", "", report["bytes_before"].sum(), report["bytes_after"].sum(), report["saved"].sum()]
+    return report
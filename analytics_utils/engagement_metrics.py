@@ -0,0 +1,186 @@
+# engagement_metrics.py
+"""
+Reach, frequency, overlap and funnel metrics on the combined engagement frame.
+
+Every function takes the frame returned by run_combined_engagement_query and returns
+a small summary frame. Rows are never looped over: groups and NPIs are turned into
+integer codes once (groupby ngroup / factorize), and the metrics come from sorting
+and counting those codes with NumPy.
+    - reach_frequency: engagements, reach (distinct NPIs) and frequency per group,
+      with the number of NPIs in each frequency band
+    - source_overlap: NPIs reached by each pair of sources
+    - funnel: NPIs reaching each stage of an ordered funnel (by default email
+      engagement -> asset view -> survey response), per program
+
+Frequency bands and funnel stages come from config.METRICS_CONFIG (see
+METRICS_DEFAULTS). Providers with several specialties appear once per specialty in
+the combined frame, so their engagements count once per specialty here too.
+"""
+import numpy as np
+import pandas as pd
+
+from analytics_utils import config
+from analytics_utils.rollups import engagement_timestamps
+
+# Defaults for anything not set in config.METRICS_CONFIG
+METRICS_DEFAULTS = {
+    # Lower bounds of the frequency bands: 1, 2, 3-4, 5-9, 10+ engagements per NPI
+    "frequency_bands": [1, 2, 3, 5, 10],
+    # Ordered funnel stages; an NPI reaches a stage with an engagement at or after the
+    # one that got them through the previous stage
+    "funnel_stages": [
+        {"name": "Email engagement", "source": "email_engagement"},
+        {"name": "Asset view", "source": "asset_view"},
+        {"name": "Survey response", "source": "survey_response"},
+    ],
+}
+
+
+def metrics_settings():
+    return {**METRICS_DEFAULTS, **(getattr(config, "METRICS_CONFIG", None) or {})}
+
+
+def band_labels(bands):
+    """'1', '2', '3-4', '5-9', '10+' for bands [1, 2, 3, 5, 10]."""
+    labels = [str(lo) if hi - lo == 1 else f"{lo}-{hi - 1}" for lo, hi in zip(bands, bands[1:])]
+    return labels + [f"{bands[-1]}+"]
+
+
+def _npi_codes(df):
+    """Dense integer codes for provider_npi (-1 where missing), and how many distinct NPIs there are."""
+    codes, uniques = pd.factorize(df["provider_npi"])
+    return codes.astype(np.int64), len(uniques)
+
+def _group_codes(df, by):
+    """Group code per row and the group keys (a DataFrame, in code order)."""
+    if not by:
+        return np.zeros(len(df), dtype=np.int64), pd.DataFrame(index=[0])
+    grouped = df.groupby(by, observed=True, sort=True, dropna=False)
+    codes = grouped.ngroup().to_numpy().astype(np.int64)
+    return codes, grouped.size().index.to_frame(index=False)
+
+
+def reach_frequency(df, by=("source",), bands=None):
+    """
+    Per group of `by` columns (one row overall for by=None): engagements, reach
+    (distinct NPIs), average and median engagements per reached NPI, and the number
+    of NPIs in each frequency band. Rows without an NPI count as engagements only.
+    """
+    by = list(by or [])
+    bands = np.asarray(metrics_settings()["frequency_bands"] if bands is None else bands)
+    labels = band_labels(list(bands))
+    columns = by + ["engagements", "reach", "avg_frequency", "median_frequency"] + labels
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    groups, keys = _group_codes(df, by)
+    npis, n_npis = _npi_codes(df)
+    n_groups = len(keys)
+
+    # Engagements per (group, NPI) pair, pairs sorted by group
+    has_npi = npis >= 0
+    pairs, frequency = np.unique(groups[has_npi] * max(n_npis, 1) + npis[has_npi], return_counts=True)
+    pair_groups = pairs // max(n_npis, 1)
+
+    reach = np.bincount(pair_groups, minlength=n_groups)
+    summary = keys.copy()
+    summary["engagements"] = np.bincount(groups, minlength=n_groups)
+    summary["reach"] = reach
+    summary["avg_frequency"] = np.bincount(pair_groups, weights=frequency, minlength=n_groups) / np.maximum(reach, 1)
+
+    # Median of each group's frequencies: sort within groups (pairs are already grouped), take the middle
+    median = np.full(n_groups, np.nan)
+    reached = reach > 0
+    if reached.any():
+        sorted_frequency = frequency[np.lexsort((frequency, pair_groups))]
+        starts = np.concatenate(([0], np.cumsum(reach)[:-1]))
+        lower, upper = starts + (reach - 1) // 2, starts + reach // 2
+        median[reached] = (sorted_frequency[lower[reached]] + sorted_frequency[upper[reached]]) / 2
+    summary["median_frequency"] = median
+
+    band = np.searchsorted(bands, frequency, side="right") - 1
+    in_band = band >= 0  # frequencies below the first band are left out
+    counts = np.bincount(pair_groups[in_band] * len(labels) + band[in_band], minlength=n_groups * len(labels))
+    for i, label in enumerate(labels):
+        summary[label] = counts.reshape(n_groups, len(labels))[:, i]
+    return summary[columns]
+
+
+def source_overlap(df):
+    """
+    Square frame of NPIs reached by both the row source and the column source; the
+    diagonal is each source's reach.
+    """
+    if df.empty:
+        return pd.DataFrame()
+    sources = df["source"].astype("category").cat.remove_unused_categories()
+    names = [str(name) for name in sources.cat.categories]
+    npis, n_npis = _npi_codes(df)
+    has_npi = npis >= 0
+
+    # One bitmask per NPI of the sources that reached them, then count each distinct mask
+    reached_by = np.zeros(n_npis, dtype=np.int64)
+    np.bitwise_or.at(reached_by, npis[has_npi], np.left_shift(1, sources.cat.codes.to_numpy()[has_npi].astype(np.int64)))
+    masks, npi_counts = np.unique(reached_by, return_counts=True)
+    bits = (masks[:, None] >> np.arange(len(names))) & 1  # distinct masks x sources
+    overlap = (bits * npi_counts[:, None]).T @ bits
+    return pd.DataFrame(overlap, index=pd.Index(names, name="source"), columns=names)
+
+
+def _stage_events(df, at, stage, keys):
+    mask = (df["source"] == stage["source"]).to_numpy()
+    if stage.get("engagement_types"):
+        mask &= df["engagement_type"].isin(stage["engagement_types"]).to_numpy()
+    events = df.loc[mask, keys].copy()
+    events["at"] = at[mask]
+    return events[events["at"].notna() & events["provider_npi"].notna()].sort_values("at", kind="stable")
+
+
+def funnel(df, stages=None, by=("program_identifier",), window_days=None):
+    """
+    NPIs reaching each funnel stage in order, per group of `by` columns: an NPI
+    reaches stage k with its first stage-k engagement at or after the engagement that
+    took them through stage k-1 (within window_days of it, if set). Returns one row
+    per group and stage with npis, conversion from the previous stage and from the
+    first stage.
+    """
+    by = list(by or [])
+    stages = metrics_settings()["funnel_stages"] if stages is None else stages
+    columns = by + ["stage", "npis", "conversion_from_previous", "conversion_from_first"]
+    if df.empty or not stages:
+        return pd.DataFrame(columns=columns)
+
+    keys = by + ["provider_npi"]
+    at = engagement_timestamps(df).to_numpy()
+    tolerance = pd.Timedelta(days=window_days) if window_days is not None else None
+
+    # Stage 1: each NPI's first engagement
+    reached = _stage_events(df, at, stages[0], keys).drop_duplicates(keys, keep="first")
+    counts = [reached.groupby(by, observed=True).size() if by else pd.Series([len(reached)])]
+    for stage in stages[1:]:
+        # The next stage-k engagement at or after each NPI's stage k-1 time, per NPI
+        events = _stage_events(df, at, stage, keys).rename(columns={"at": "next_at"})
+        matched = pd.merge_asof(
+            reached, events, left_on="at", right_on="next_at", by=keys,
+            direction="forward", tolerance=tolerance, allow_exact_matches=True,
+        )
+        reached = matched.loc[matched["next_at"].notna(), keys + ["next_at"]].rename(columns={"next_at": "at"})
+        reached = reached.sort_values("at", kind="stable")
+        counts.append(reached.groupby(by, observed=True).size() if by else pd.Series([len(reached)]))
+
+    names = [stage["name"] for stage in stages]
+    table = pd.concat(counts, axis=1, keys=names).fillna(0).astype(np.int64)  # groups x stages
+    npis = table.to_numpy()
+    previous = np.concatenate([npis[:, :1], npis[:, :-1]], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_previous = np.where(previous > 0, npis / previous, np.nan)
+        from_first = np.where(npis[:, :1] > 0, npis / npis[:, :1], np.nan)
+
+    n_groups, n_stages = npis.shape
+    result = table.index.to_frame(index=False) if by else pd.DataFrame(index=range(n_groups))
+    result = result.loc[np.repeat(np.arange(n_groups), n_stages)].reset_index(drop=True)
+    result["stage"] = np.tile(names, n_groups)
+    result["npis"] = npis.ravel()
+    result["conversion_from_previous"] = from_previous.ravel()
+    result["conversion_from_first"] = from_first.ravel()
+    return result[columns]
@@ -0,0 +1,115 @@
+# exports.py
+"""
+Streaming exports of result frames for the Dash app's download endpoint.
+
+iter_export() yields the file in pieces, converting and compressing the frame a
+slice of rows at a time, so a large result is never rendered to one in-memory
+string. Supported formats:
+    - csv.gz:  gzip-compressed CSV
+    - parquet: Parquet (one row group per slice, zstd-compressed)
+    - arrow:   Arrow IPC file (Feather v2, readable with pd.read_feather)
+"""
+import zlib
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_EXPORT_CHUNK_ROWS = 50_000
+
+# format -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    "csv.gz": ("csv.gz", "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever has been written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _exportable(df):
+    # Activation ranges are psycopg Multirange objects, which Arrow can't hold; export their text form
+    if 'program_activation_ranges' in df.columns:
+        df = df.assign(program_activation_ranges=df['program_activation_ranges'].map(
+            lambda value: None if value is None else str(value)
+        ))
+    return df
+
+def _row_slices(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _iter_csv_gz(df, chunk_rows):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    header = True
+    for part in _row_slices(df, chunk_rows):
+        data = compressor.compress(part.to_csv(index=False, header=header).encode("utf-8"))
+        header = False
+        if data:
+            yield data
+    if header:  # no rows: still export the header line
+        yield compressor.compress(df.iloc[0:0].to_csv(index=False).encode("utf-8"))
+    yield compressor.flush()
+
+def _iter_parquet(df, chunk_rows):
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for part in _row_slices(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+            yield sink.drain()
+    yield sink.drain()
+
+def _iter_arrow(df, chunk_rows):
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    sink = _ChunkSink()
+    with pa.ipc.new_file(sink, schema) as writer:
+        for part in _row_slices(df, chunk_rows):
+            writer.write_table(pa.Table.from_pandas(part, schema=schema, preserve_index=False))
+            yield sink.drain()
+    yield sink.drain()
+
+
+_WRITERS = {"csv.gz": _iter_csv_gz, "parquet": _iter_parquet, "arrow": _iter_arrow}
+
+
+def iter_export(df, fmt, chunk_rows=None):
+    """
+    Yields df encoded as fmt (a key of EXPORT_FORMATS) in pieces of roughly chunk_rows rows.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {sorted(EXPORT_FORMATS)}.")
+    for data in _WRITERS[fmt](_exportable(df), chunk_rows or DEFAULT_EXPORT_CHUNK_ROWS):
+        if data:
+            yield data
+
+
+def export_filename(stem, fmt):
+    return f"{stem}.{EXPORT_FORMATS[fmt][0]}"
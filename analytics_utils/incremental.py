@@ -0,0 +1,156 @@
+# incremental.py
+"""
+Local per-program, per-source engagement store for incremental refreshes.
+
+Each (source, program_id) is kept as a Parquet file together with its high-water
+mark: the latest engaged_at/engaged_on seen. Sources whose rows depend on the whole
+program list (db_utils.PROGRAM_SET_SOURCES) are kept per exact program list instead,
+under result_cache.program_set_key. A refresh only asks the database for
+rows at or after (watermark - overlap), and merge() swaps them in for the stored rows
+in that same window, so rows the overlap re-reads are replaced rather than doubled.
+"""
+import datetime as dt
+import hashlib
+import os
+import threading
+
+import pandas as pd
+
+from analytics_utils import config
+from analytics_utils.result_cache import read_parquet_frame, write_parquet_frame
+
+# Defaults for anything not set in config.INCREMENTAL_CONFIG
+INCREMENTAL_DEFAULTS = {
+    "directory": os.path.join("~", ".cache", "healthcasts-analytics", "incremental"),
+    "overlap_days": 2,  # re-read this far behind the watermark to catch late-arriving rows
+}
+
+# Columns that are constant for a program; refreshed from the newest rows on merge
+_PROGRAM_LEVEL_COLUMNS = ['program_name', 'program_drug_brand_name', 'program_activation_ranges']
+
+# Choozle rows are already aggregated to MAX(date) per ad/NPI/activity, so a group
+# re-read with a later date replaces its stored row even if that row predates `since`.
+_AGGREGATED_SOURCES = {"choozle_banner_ad": "engaged_on"}
+
+
+def _to_json_timestamp(value):
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        value = value.to_pydatetime()
+    if isinstance(value, dt.datetime):
+        return {"datetime": value.isoformat()}
+    return {"date": value.isoformat()}
+
+def _from_json_timestamp(value):
+    if value is None:
+        return None
+    if "datetime" in value:
+        return dt.datetime.fromisoformat(value["datetime"])
+    return dt.date.fromisoformat(value["date"])
+
+
+class IncrementalStore:
+    """
+    Stored engagement rows and watermarks, one file per (source, program_id), or per
+    (source, program_set_key) for program-list sources.
+    """
+
+    def __init__(self, directory=None, overlap_days=None):
+        settings = {**INCREMENTAL_DEFAULTS, **(getattr(config, "INCREMENTAL_CONFIG", None) or {})}
+        self.directory = os.path.expanduser(directory or settings["directory"])
+        self.overlap = dt.timedelta(days=settings["overlap_days"] if overlap_days is None else overlap_days)
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, source, program_id, extra_columns=None):
+        # Pulls with different extra columns have different shapes; keep them apart
+        variant = hashlib.sha1(",".join(sorted(extra_columns or [])).encode()).hexdigest()[:8]
+        return os.path.join(self.directory, f"{source}__{program_id}__{variant}.parquet")
+
+    def load(self, source, program_id, extra_columns=None):
+        """
+        (stored rows, watermark) for a program, or (None, None) if nothing is stored yet.
+        """
+        path = self._path(source, program_id, extra_columns)
+        if not os.path.exists(path):
+            return None, None
+        df, meta = read_parquet_frame(path)
+        return df, _from_json_timestamp(meta.get("watermark"))
+
+    def since(self, watermark):
+        """The lower bound to query from for a stored watermark."""
+        if watermark is None:
+            return None
+        return watermark - self.overlap
+
+    def merge(self, source, stored, fresh, since, watermark_col):
+        """
+        Folds rows pulled from `since` on into the stored rows for one program. Stored
+        rows at or after `since` were re-read by that pull, so they are replaced by the
+        fresh rows; older stored rows are kept as they are. Nothing is deduplicated:
+        identical engagement rows are separate engagements. since=None (a full pull)
+        replaces everything stored.
+        """
+        if stored is None or stored.empty or since is None:
+            return fresh.reset_index(drop=True)
+
+        if watermark_col in stored.columns:
+            reread = pd.to_datetime(stored[watermark_col], errors="coerce") >= pd.Timestamp(since)
+            stored = stored[~reread.to_numpy()]
+        if source in _AGGREGATED_SOURCES and not fresh.empty:
+            # An aggregated group re-read with a later date replaces its older stored row
+            ts_col = _AGGREGATED_SOURCES[source]
+            key_cols = [col for col in fresh.columns if col not in _PROGRAM_LEVEL_COLUMNS and col != ts_col]
+            regrouped = stored[key_cols].merge(fresh[key_cols].drop_duplicates(), how="left", indicator=True)["_merge"] == "both"
+            stored = stored[~regrouped.to_numpy()]
+        if fresh.empty:
+            return stored.reset_index(drop=True)
+
+        combined = pd.concat([stored, fresh], ignore_index=True) if not stored.empty else fresh.reset_index(drop=True)
+        # Program metadata can change over a program's life (e.g. a new activation range)
+        for col in _PROGRAM_LEVEL_COLUMNS:
+            if col in fresh.columns and fresh[col].notna().any():
+                latest = fresh[col].dropna().iloc[-1]
+                combined[col] = pd.Series([latest] * len(combined), index=combined.index, dtype=object)
+        return combined
+
+    def save(self, source, program_id, df, watermark_col, extra_columns=None):
+        """Stores a program's rows with the max of watermark_col as its new watermark."""
+        watermark = df[watermark_col].max() if watermark_col in df.columns and not df.empty else None
+        with self._lock:
+            write_parquet_frame(
+                self._path(source, program_id, extra_columns), df,
+                metadata={"watermark": _to_json_timestamp(watermark), "watermark_column": watermark_col}
+            )
+
+    def reset(self, source=None, program_ids=None):
+        """
+        Forgets stored rows (and watermarks) so the next refresh is a full pull.
+        Program-list entries may include any of program_ids, so they always go.
+        """
+        if isinstance(program_ids, int):
+            program_ids = [program_ids]
+        wanted = None if program_ids is None else {str(pid) for pid in program_ids}
+        removed = 0
+        for fname in os.listdir(self.directory):
+            if not fname.endswith(".parquet"):
+                continue
+            entry_source, entry_program = fname[:-len(".parquet")].split("__")[:2]
+            if (source is None or entry_source == source) and (wanted is None or entry_program in wanted or entry_program.startswith("set-")):
+                os.remove(os.path.join(self.directory, fname))
+                removed += 1
+        return removed
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_incremental_store():
+    """The process-wide IncrementalStore, configured from config.INCREMENTAL_CONFIG."""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = IncrementalStore()
+        return _shared_store
@@ -0,0 +1,203 @@
+# instrumentation.py
+"""
+Per-stage timing, row counts, sizes and errors for queries.
+
+Code wraps each stage in timed(stage, source=...):
+
+    with timed("fetch", source="email_engagement") as stage:
+        rows = cur.fetchall()
+        stage["rows"] = len(rows)
+
+Every finished stage becomes a record {stage, source, seconds, rows, bytes, error}
+that is
+    - logged at DEBUG on the "analytics_utils.metrics" logger (the record fields
+      are also attached to the log record as `metrics`, for structured handlers)
+    - passed to the metrics hook, if one is set (set_metrics_hook; see
+      prometheus_metrics_hook for a Prometheus adapter)
+    - added to the active RunTimings, if the stage runs inside run_timer(), which
+      is how run_combined_engagement_query collects a per-run breakdown
+
+The active run is held in a contextvar. Worker threads don't inherit it, so code
+that fans out to a thread pool submits through in_current_context().
+"""
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+metrics_logger = logging.getLogger("analytics_utils.metrics")
+
+_current_run = contextvars.ContextVar("analytics_utils_run", default=None)
+_metrics_hook = None
+
+
+def set_metrics_hook(hook):
+    """Sets a callable that receives every stage record (a dict); None removes it."""
+    global _metrics_hook
+    _metrics_hook = hook
+
+
+class RunTimings:
+    """
+    The stage records of one run, e.g. one Run click in the app.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished = None
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    @property
+    def seconds(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def breakdown(self):
+        """
+        DataFrame of stage records summed per (source, stage): run-level stages first,
+        then each source's stages in the order they ran. Sources run concurrently, so
+        their stage times overlap rather than add up.
+        """
+        with self._lock:
+            records = list(self.records)
+        import pandas as pd  # only needed for reports; keeps this module (and connections.py) light
+
+        columns = ["source", "stage", "seconds", "rows", "bytes", "error"]
+        if not records:
+            return pd.DataFrame(columns=columns)
+        df = pd.DataFrame(records, columns=columns)
+        df["source"] = df["source"].fillna("")
+        return df.groupby(["source", "stage"], sort=False, dropna=False).agg(
+            seconds=("seconds", "sum"),
+            rows=("rows", "sum"),
+            bytes=("bytes", "sum"),
+            error=("error", lambda errors: "; ".join(e for e in errors if e)),
+        ).reset_index().sort_values("source", kind="stable", ignore_index=True)
+
+
+@contextmanager
+def run_timer(name):
+    """
+    Collects every timed() stage below it into a RunTimings. Nested run_timer calls
+    reuse the outer run, so a caller can wrap a query that times itself.
+    """
+    run = _current_run.get()
+    if run is not None:
+        yield run
+        return
+    run = RunTimings(name)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        run.finished = time.perf_counter()
+        _current_run.reset(token)
+        metrics_logger.info("%s finished in %.2fs", name, run.seconds)
+
+
+def with_run_timer(name):
+    """Decorator form of run_timer: every call of the function is (part of) a run."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with run_timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_run():
+    return _current_run.get()
+
+
+def in_current_context(fn):
+    """Wraps fn to run in a copy of the caller's context (so pool threads see the active run)."""
+    context = contextvars.copy_context()
+
+    def run_in_context(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run_in_context
+
+
+def frame_bytes(df):
+    """Approximate in-memory size of a DataFrame (shallow, so it stays cheap on object columns)."""
+    return int(df.memory_usage(deep=False).sum())
+
+
+@contextmanager
+def timed(stage, source=None):
+    """
+    Times a block as one stage. The yielded dict accepts "rows" and "bytes"; an
+    exception is recorded as the stage's error and re-raised.
+    """
+    record = {"stage": stage, "source": source, "seconds": 0.0, "rows": None, "bytes": None, "error": None}
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _emit(record)
+
+
+def record_stage(stage, seconds, source=None, rows=None):
+    """Reports a stage that was timed some other way (e.g. across module imports)."""
+    _emit({"stage": stage, "source": source, "seconds": seconds, "rows": rows, "bytes": None, "error": None})
+
+
+def _emit(record):
+    run = _current_run.get()
+    if run is not None:
+        run.add(record)
+    metrics_logger.debug(
+        "stage=%s source=%s seconds=%.3f rows=%s bytes=%s error=%s",
+        record["stage"], record["source"], record["seconds"], record["rows"], record["bytes"], record["error"],
+        extra={"metrics": record},
+    )
+    hook = _metrics_hook
+    if hook is not None:
+        try:
+            hook(record)
+        except Exception:
+            metrics_logger.exception("Metrics hook failed")
+
+
+def prometheus_metrics_hook(registry=None, prefix="analytics_query"):
+    """
+    A metrics hook that feeds prometheus_client (an optional dependency):
+        <prefix>_stage_seconds{stage, source}      histogram
+        <prefix>_stage_rows_total{stage, source}   counter
+        <prefix>_stage_errors_total{stage, source} counter
+
+        set_metrics_hook(prometheus_metrics_hook())
+    """
+    try:
+        from prometheus_client import REGISTRY, Counter, Histogram
+    except ImportError as e:
+        raise ImportError("prometheus_metrics_hook needs prometheus_client (pip install prometheus-client)") from e
+
+    registry = registry or REGISTRY
+    labels = ["stage", "source"]
+    seconds = Histogram(f"{prefix}_stage_seconds", "Query stage duration", labels, registry=registry)
+    rows = Counter(f"{prefix}_stage_rows", "Rows handled per query stage", labels, registry=registry)
+    errors = Counter(f"{prefix}_stage_errors", "Failed query stages", labels, registry=registry)
+
+    def hook(record):
+        label_values = (record["stage"], record["source"] or "")
+        seconds.labels(*label_values).observe(record["seconds"])
+        if record["rows"]:
+            rows.labels(*label_values).inc(record["rows"])
+        if record["error"]:
+            errors.labels(*label_values).inc()
+
+    return hook
@@ -0,0 +1,134 @@
+# jobs.py
+"""
+Background execution for long-running queries.
+
+The Dash "Run" callback hands its work to a JobManager and returns immediately;
+the page then polls the job for per-source progress and picks up the result when
+it is done. Jobs run on a bounded thread pool (config.JOB_CONFIG["max_workers"]),
+so heavy pulls queue behind each other instead of pinning every web worker thread.
+Cancelling a job sets its cancel_event, which the query functions check between
+steps and while waiting on sources.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from analytics_utils import config
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.JOB_CONFIG
+JOB_DEFAULTS = {
+    "max_workers": 2,              # jobs running at once; the rest wait in the queue
+    "keep_finished_seconds": 3600,  # forget finished jobs nobody collected after this long
+}
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class Job:
+    """
+    State of one background job: status, per-step progress, result and error.
+    """
+
+    def __init__(self, label=""):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.status = QUEUED
+        self.progress = {}  # step -> status text, in insertion order
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def report(self, step, status):
+        """Progress hook handed to the query functions: report(source, "done (120 rows)")."""
+        with self._lock:
+            self.progress[step] = status
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "label": self.label,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "error": self.error,
+                "elapsed": (self.finished_at or time.time()) - self.submitted_at,
+            }
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobManager:
+    """
+    Runs callables as Jobs on a bounded thread pool.
+    """
+
+    def __init__(self, max_workers=None):
+        settings = {**JOB_DEFAULTS, **(getattr(config, "JOB_CONFIG", None) or {})}
+        self.max_workers = max_workers or settings["max_workers"]
+        self.keep_finished_seconds = settings["keep_finished_seconds"]
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, label="", steps=(), **kwargs):
+        """
+        Queues fn(job, *args, **kwargs) and returns the Job. steps pre-populates the
+        progress display (e.g. the sources the job will query).
+        """
+        job = Job(label)
+        for step in steps:
+            job.report(step, QUEUED)
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return
+        job.status = RUNNING
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = CANCELLED if job.cancel_event.is_set() else DONE
+        except Exception as e:
+            if job.cancel_event.is_set():
+                job.status = CANCELLED
+            else:
+                job.status = FAILED
+                job.error = str(e)
+                logger.exception("Job %s failed: %s", job.label or job.id, e)
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id):
+        """Asks a job to stop. Queued jobs never start; running ones stop at the next check."""
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+        return job
+
+    def pop(self, job_id):
+        """Removes a finished job once its result has been collected."""
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_finished_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
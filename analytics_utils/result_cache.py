@@ -0,0 +1,309 @@
+# result_cache.py
+"""
+Two-tier (memory + local Parquet) cache for engagement source query results.
+
+Entries are stored per (source, program_id, campaign_type, query version), so a
+request for programs [A, B] can reuse a cached A and only query B. Sources whose
+rows depend on the whole program list (db_utils.PROGRAM_SET_SOURCES) are stored per
+exact program list instead (program_set_key). The cache is off unless
+RESULT_CACHE_CONFIG["enabled"] is set or a caller passes use_cache=True. Entries expire
+after a TTL, each tier is trimmed to a size budget (oldest first), and entries can
+be invalidated explicitly by source and/or program.
+"""
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from analytics_utils import config
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.RESULT_CACHE_CONFIG
+RESULT_CACHE_DEFAULTS = {
+    "enabled": False,
+    "directory": os.path.join("~", ".cache", "healthcasts-analytics", "results"),
+    "ttl_seconds": 3600,
+    "max_memory_bytes": 512 * 1024 ** 2,
+    "max_disk_bytes": 4 * 1024 ** 3,
+}
+
+_METADATA_KEY = b"analytics_utils.result_cache"
+
+
+def result_cache_settings():
+    return {**RESULT_CACHE_DEFAULTS, **(getattr(config, "RESULT_CACHE_CONFIG", None) or {})}
+
+
+def program_set_key(program_ids):
+    """Cache key standing for one exact program list (order and duplicates ignored)."""
+    ids = ",".join(str(pid) for pid in sorted({int(pid) for pid in program_ids}))
+    return "set-" + hashlib.sha1(ids.encode()).hexdigest()[:12]
+
+
+# --- Activation range (de)serialization ---
+# Parquet can't hold psycopg Multirange objects. The ranges are a program-level
+# attribute, so each per-program entry stores them once in the file metadata.
+def _bound_to_json(value):
+    if isinstance(value, dt.datetime):
+        return {"datetime": value.isoformat()}
+    if isinstance(value, dt.date):
+        return {"date": value.isoformat()}
+    return value
+
+def _bound_from_json(value):
+    if isinstance(value, dict):
+        if "datetime" in value:
+            return dt.datetime.fromisoformat(value["datetime"])
+        return dt.date.fromisoformat(value["date"])
+    return value
+
+def _ranges_to_json(multirange):
+    if multirange is None or not hasattr(multirange, '__iter__'):
+        return None
+    return [
+        {"lower": _bound_to_json(r.lower), "upper": _bound_to_json(r.upper), "bounds": r.bounds, "empty": r.isempty}
+        for r in multirange
+    ]
+
+def _ranges_from_json(ranges):
+    if ranges is None:
+        return None
+    from psycopg.types.multirange import Multirange  # psycopg is only loaded once a cached entry needs it
+    from psycopg.types.range import Range
+
+    return Multirange([
+        Range(empty=True) if r["empty"] else Range(_bound_from_json(r["lower"]), _bound_from_json(r["upper"]), r["bounds"])
+        for r in ranges
+    ])
+
+
+def write_parquet_frame(path, df, metadata=None):
+    """
+    Writes a source frame to Parquet atomically. program_activation_ranges (constant
+    within a per-program frame) is moved into the file metadata along with any
+    extra JSON-serializable metadata.
+    """
+    meta = {"columns": list(df.columns), "has_ranges": 'program_activation_ranges' in df.columns, "extra": metadata or {}}
+    if meta["has_ranges"]:
+        ranges = df['program_activation_ranges'].dropna()
+        meta["ranges"] = _ranges_to_json(ranges.iloc[0]) if not ranges.empty else None
+        df = df.drop(columns='program_activation_ranges')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _METADATA_KEY: json.dumps(meta).encode()})
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+def read_parquet_frame(path):
+    """
+    Reads a frame written by write_parquet_frame. Returns (DataFrame, extra metadata).
+    """
+    table = pq.read_table(path)
+    meta = json.loads((table.schema.metadata or {}).get(_METADATA_KEY, b"{}"))
+    df = table.to_pandas()
+    if meta.get("has_ranges"):
+        ranges = _ranges_from_json(meta.get("ranges"))
+        df['program_activation_ranges'] = pd.Series([ranges] * len(df), index=df.index, dtype=object)
+    df = df[meta.get("columns", list(df.columns))]
+    return df, meta.get("extra", {})
+
+
+class ResultCache:
+    """
+    Per-program cache of source query results, in memory and as Parquet files on disk.
+    """
+
+    def __init__(self, directory=None, ttl_seconds=None, max_memory_bytes=None, max_disk_bytes=None):
+        settings = result_cache_settings()
+        self.directory = os.path.expanduser(directory or settings["directory"])
+        self.ttl_seconds = ttl_seconds or settings["ttl_seconds"]
+        self.max_memory_bytes = max_memory_bytes or settings["max_memory_bytes"]
+        self.max_disk_bytes = max_disk_bytes or settings["max_disk_bytes"]
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._memory = OrderedDict()  # name -> (DataFrame, nbytes, stored_at)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    # --- Keys ---
+    @staticmethod
+    def entry_name(source, program_id, campaign_type, version, extra_columns=None):
+        """
+        File-name-safe key. The readable prefix lets invalidate() match on source/program.
+        """
+        extra = hashlib.sha1(",".join(sorted(extra_columns or [])).encode()).hexdigest()[:8]
+        return f"{source}__{program_id}__{campaign_type}__v{version}__{extra}"
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + ".parquet")
+
+    # --- Memory tier ---
+    def _memory_get(self, name, now):
+        entry = self._memory.get(name)
+        if entry is None:
+            return None
+        df, nbytes, stored_at = entry
+        if now - stored_at > self.ttl_seconds:
+            self._memory_pop(name)
+            return None
+        self._memory.move_to_end(name)
+        return df
+
+    def _memory_put(self, name, df, stored_at):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_memory_bytes:
+            return
+        self._memory_pop(name)
+        self._memory[name] = (df, nbytes, stored_at)
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.max_memory_bytes:
+            oldest = next(iter(self._memory))
+            self._memory_pop(oldest)
+
+    def _memory_pop(self, name):
+        entry = self._memory.pop(name, None)
+        if entry is not None:
+            self._memory_bytes -= entry[1]
+
+    # --- Disk tier ---
+    def _disk_get(self, name, now):
+        path = self._path(name)
+        try:
+            stored_at = os.path.getmtime(path)
+        except OSError:
+            return None, None
+        if time.time() - stored_at > self.ttl_seconds:
+            _remove_quietly(path)
+            return None, None
+        try:
+            df, _ = read_parquet_frame(path)
+        except Exception as e:
+            logger.warning("Unreadable cache entry %s, dropping it: %s", name, e)
+            _remove_quietly(path)
+            return None, None
+
+        # Keep the memory tier's clock in step with how old the file already is
+        return df, now - (time.time() - stored_at)
+
+    def _disk_put(self, name, df):
+        write_parquet_frame(self._path(name), df)
+
+    def _trim_disk(self):
+        entries = []
+        for fname in os.listdir(self.directory):
+            if fname.endswith(".parquet"):
+                path = os.path.join(self.directory, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            _remove_quietly(path)
+            total -= size
+
+    # --- Public ---
+    def get(self, name):
+        """Cached DataFrame for an entry name, or None."""
+        now = time.monotonic()
+        with self._lock:
+            df = self._memory_get(name, now)
+            if df is not None:
+                self.stats["memory_hits"] += 1
+                return df
+
+        df, stored_at = self._disk_get(name, now)
+        with self._lock:
+            if df is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._memory_put(name, df, stored_at)
+        return df
+
+    def put(self, name, df):
+        """Stores a DataFrame in both tiers. Frames that can't be written as Parquet stay in memory only."""
+        with self._lock:
+            self._memory_put(name, df, time.monotonic())
+        try:
+            self._disk_put(name, df)
+            self._trim_disk()
+        except Exception as e:
+            logger.warning("Could not write cache entry %s to disk: %s", name, e)
+
+    def invalidate(self, source=None, program_ids=None):
+        """
+        Drops entries matching a source and/or program IDs (everything if both are None).
+        Returns the number of disk entries removed.
+        """
+        if isinstance(program_ids, int):
+            program_ids = [program_ids]
+        wanted_programs = None if program_ids is None else {str(pid) for pid in program_ids}
+
+        def matches(name):
+            # A program-list entry may include any of the programs, so it always goes
+            entry_source, entry_program = name.split("__")[:2]
+            return (source is None or entry_source == source) and \
+                (wanted_programs is None or entry_program in wanted_programs or entry_program.startswith("set-"))
+
+        with self._lock:
+            for name in [n for n in self._memory if matches(n)]:
+                self._memory_pop(name)
+
+        removed = 0
+        for fname in os.listdir(self.directory):
+            if fname.endswith(".parquet") and matches(fname[:-len(".parquet")]):
+                _remove_quietly(os.path.join(self.directory, fname))
+                removed += 1
+        return removed
+
+    def clear(self):
+        self.invalidate()
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# --- Per-program split/merge helpers used by db_utils ---
+def split_by_program(df, program_ids):
+    """
+    {program_id: rows for that program} for every requested program, including
+    empty frames (with df's columns) for programs that returned no rows.
+    """
+    keys = df['program_identifier'].astype(str) if 'program_identifier' in df.columns else pd.Series(dtype=str)
+    groups = {key: part for key, part in df.groupby(keys, sort=False)} if not df.empty else {}
+    return {
+        pid: groups[str(pid)].reset_index(drop=True) if str(pid) in groups else df.iloc[0:0]
+        for pid in program_ids
+    }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """The process-wide ResultCache, configured from config.RESULT_CACHE_CONFIG."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResultCache()
+        return _shared_cache
@@ -0,0 +1,70 @@
+# result_store.py
+"""
+Server-held query results for the Dash app.
+
+Each Run stores its combined DataFrame here under a random result ID, and only
+that ID is sent to the browser (in a dcc.Store). Table paging, sorting, filtering
+and downloads then look the frame up by ID, so each browser session works on its
+own result and full results never travel through callback payloads.
+
+Results live in this process's memory, so a multi-worker deployment needs sticky
+sessions (or a single worker with threads).
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from analytics_utils import config
+
+# Defaults for anything not set in config.RESULT_STORE_CONFIG
+RESULT_STORE_DEFAULTS = {
+    "max_results": 20,       # oldest results are dropped beyond this
+    "ttl_seconds": 4 * 3600,
+}
+
+
+class ResultStore:
+    """
+    A bounded, expiring map of result ID -> DataFrame (plus optional metadata).
+    """
+
+    def __init__(self, max_results=None, ttl_seconds=None):
+        settings = {**RESULT_STORE_DEFAULTS, **(getattr(config, "RESULT_STORE_CONFIG", None) or {})}
+        self.max_results = max_results or settings["max_results"]
+        self.ttl_seconds = ttl_seconds or settings["ttl_seconds"]
+        self._results = OrderedDict()  # result_id -> (df, meta, stored_at)
+        self._lock = threading.Lock()
+
+    def put(self, df, **meta):
+        """Stores a result and returns its new ID."""
+        result_id = uuid.uuid4().hex
+        with self._lock:
+            self._results[result_id] = (df, meta, time.monotonic())
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result_id
+
+    def get(self, result_id):
+        """The DataFrame for a result ID, or None if unknown or expired."""
+        entry = self.get_entry(result_id)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, result_id):
+        """(DataFrame, metadata) for a result ID, or None if unknown or expired."""
+        if not result_id:
+            return None
+        with self._lock:
+            entry = self._results.get(result_id)
+            if entry is None:
+                return None
+            df, meta, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._results[result_id]
+                return None
+            self._results.move_to_end(result_id)
+            return df, meta
+
+    def discard(self, result_id):
+        with self._lock:
+            self._results.pop(result_id, None)
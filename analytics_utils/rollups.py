@@ -0,0 +1,299 @@
+# rollups.py
+"""
+Precomputed daily engagement rollups per program, for summary views.
+
+A refresh pulls a program's engagements once (run_combined_engagement_query, every
+source) and reduces them to one row per
+    program_identifier x engaged_on x source x engagement_type x specialty
+with
+    - engagements: number of engagement rows
+    - unique_npis: distinct providers that day
+    - npis: the set of those providers (sorted int64 NPIs), so distinct counts stay
+      exact when days, types or specialties are merged
+    - first_engaged_at / last_engaged_at: earliest and latest engagement that day
+
+Rollups are kept as one Parquet file per program (config.ROLLUP_CONFIG["directory"])
+and summarize() answers from them alone; the databases are only touched by refresh().
+A provider with several specialties is counted under each of them. Choozle rows
+follow the Choozle query's BTL concentrate rule for the programs refreshed together,
+as they do in a multi-program Run.
+"""
+import datetime as dt
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from analytics_utils import config, db_utils
+from analytics_utils.instrumentation import timed
+from analytics_utils.result_cache import read_parquet_frame, write_parquet_frame
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.ROLLUP_CONFIG
+ROLLUP_DEFAULTS = {
+    "directory": os.path.join("~", ".cache", "healthcasts-analytics", "rollups"),
+    "incremental": False,  # refresh through the incremental store (only new rows are pulled)
+}
+
+ROLLUP_KEYS = ["program_identifier", "engaged_on", "source", "engagement_type", "specialty"]
+ROLLUP_COLUMNS = ROLLUP_KEYS + ["engagements", "unique_npis", "npis", "first_engaged_at", "last_engaged_at"]
+
+# Grouping columns for each summary view
+SUMMARY_DIMENSIONS = {
+    "source": ["source"],
+    "engagement_type": ["source", "engagement_type"],
+    "specialty": ["specialty"],
+    "day": ["engaged_on"],
+    "day_source": ["engaged_on", "source"],
+    "program": ["program_identifier"],
+}
+SUMMARY_COLUMNS = ["engagements", "unique_npis", "first_engaged_at", "last_engaged_at"]
+
+UNKNOWN = "Unknown"  # rollup key for a missing specialty, source or engagement type
+
+# NPIs are 10-digit numbers, so (group code, NPI) pairs pack into one int64
+_NPI_SPAN = 10 ** 10
+
+
+def rollup_settings():
+    return {**ROLLUP_DEFAULTS, **(getattr(config, "ROLLUP_CONFIG", None) or {})}
+
+
+def _npi_numbers(series):
+    """NPIs as int64, with -1 for missing or malformed ones."""
+    numbers = pd.to_numeric(series, errors="coerce")
+    valid = numbers.notna() & (numbers >= 0) & (numbers < _NPI_SPAN)
+    return np.where(valid, numbers.fillna(-1), -1).astype(np.int64)
+
+def engagement_timestamps(df):
+    """Engagement timestamps: engaged_at where the source has it, else the start of engaged_on."""
+    engaged_on = pd.to_datetime(df["engaged_on"], errors="coerce")
+    if "engaged_at" not in df.columns:
+        return engaged_on
+    engaged_at = pd.to_datetime(df["engaged_at"], errors="coerce")
+    if getattr(engaged_at.dt, "tz", None) is not None:
+        engaged_at = engaged_at.dt.tz_convert(None)
+    return engaged_at.fillna(engaged_on)
+
+def _unique_per_group(codes, npis, n_groups):
+    """
+    The sorted distinct NPIs of each group (codes in 0..n_groups-1), ignoring -1s.
+    """
+    valid = npis >= 0
+    pairs = np.unique(codes[valid].astype(np.int64) * _NPI_SPAN + npis[valid])
+    pair_codes, pair_npis = pairs // _NPI_SPAN, pairs % _NPI_SPAN
+    bounds = np.searchsorted(pair_codes, np.arange(n_groups + 1))
+    return [pair_npis[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def build_rollup(df):
+    """
+    Daily rollup rows (ROLLUP_COLUMNS) of a combined engagement frame, as returned by
+    run_combined_engagement_query.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+    engaged_at = engagement_timestamps(df)
+    specialty = df["specialty"].astype(object).fillna(UNKNOWN).to_numpy() if "specialty" in df.columns else UNKNOWN
+    rows = pd.DataFrame({
+        "program_identifier": pd.to_numeric(df["program_identifier"]).astype(np.int64).to_numpy(),
+        "engaged_on": engaged_at.dt.normalize().to_numpy(),
+        "source": df["source"].astype(object).fillna(UNKNOWN).to_numpy(),
+        "engagement_type": df["engagement_type"].astype(object).fillna(UNKNOWN).to_numpy(),
+        "specialty": specialty,
+        "engaged_at": engaged_at.to_numpy(),
+    })
+    npis = _npi_numbers(df["provider_npi"]) if "provider_npi" in df.columns else np.full(len(df), -1, np.int64)
+    dated = rows["engaged_on"].notna().to_numpy()
+    rows, npis = rows[dated], npis[dated]
+
+    grouped = rows.groupby(ROLLUP_KEYS, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    rollup = grouped["engaged_at"].agg(["size", "min", "max"]).reset_index()
+    rollup.columns = ROLLUP_KEYS + ["engagements", "first_engaged_at", "last_engaged_at"]
+    rollup["npis"] = _unique_per_group(codes, npis, len(rollup))
+    rollup["unique_npis"] = rollup["npis"].map(len).astype(np.int64)
+    return rollup[ROLLUP_COLUMNS]
+
+
+def summarize_rollup(rollup, keys):
+    """
+    Sums rollup rows over everything but keys: engagement counts add up, NPI sets are
+    unioned (so unique_npis stays exact), and first/last take the min/max.
+    """
+    if rollup.empty:
+        return pd.DataFrame(columns=keys + SUMMARY_COLUMNS)
+
+    grouped = rollup.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    summary = grouped.agg(
+        engagements=("engagements", "sum"),
+        first_engaged_at=("first_engaged_at", "min"),
+        last_engaged_at=("last_engaged_at", "max"),
+    ).reset_index()
+
+    sizes = rollup["npis"].map(len).to_numpy()
+    npis = np.concatenate(rollup["npis"].tolist()).astype(np.int64) if sizes.sum() else np.empty(0, np.int64)
+    pairs = np.unique(np.repeat(codes, sizes).astype(np.int64) * _NPI_SPAN + npis)
+    summary["unique_npis"] = np.bincount(pairs // _NPI_SPAN, minlength=len(summary))
+    return summary[keys + SUMMARY_COLUMNS]
+
+
+def _program_info(df):
+    """Program metadata kept alongside a rollup (JSON-serializable)."""
+    if df.empty:
+        return {}
+    first = df.iloc[0]
+    info = {}
+    for col in ["program_name", "program_drug_brand_name", "program_status", "program_start_date", "program_end_date"]:
+        value = first.get(col)
+        if value is None or pd.isna(value):
+            info[col] = None
+        elif isinstance(value, (dt.date, pd.Timestamp)):
+            info[col] = value.isoformat()
+        else:
+            info[col] = str(value)
+    return info
+
+
+class RollupStore:
+    """
+    Daily rollups, one Parquet file per program, with an in-process cache of the
+    files already read (reloaded when a file changes).
+    """
+
+    def __init__(self, directory=None):
+        settings = rollup_settings()
+        self.directory = os.path.expanduser(directory or settings["directory"])
+        self.incremental = settings["incremental"]
+        os.makedirs(self.directory, exist_ok=True)
+        self._loaded = {}  # program_id -> (mtime_ns, rollup, info)
+        self._lock = threading.Lock()
+
+    def _path(self, program_id):
+        return os.path.join(self.directory, f"rollup__{program_id}.parquet")
+
+    # --- Building ---
+    def save(self, program_id, rollup, info=None):
+        info = {**(info or {}), "refreshed_at": dt.datetime.now().isoformat(timespec="seconds")}
+        write_parquet_frame(self._path(program_id), rollup, metadata=info)
+
+    def refresh(self, program_ids, progress=None, cancel_event=None, **query_kwargs):
+        """
+        Pulls every source for program_ids and rebuilds their rollups. Programs with no
+        engagements get an empty rollup. Returns {program_id: number of rollup rows}.
+        Extra keyword arguments go to run_combined_engagement_query.
+        """
+        if isinstance(program_ids, int):
+            program_ids = [program_ids]
+        query_kwargs.setdefault("incremental", self.incremental)
+        # A refresh must see the databases as they are now, not a cached earlier pull
+        query_kwargs.setdefault("use_cache", False)
+        df = db_utils.run_combined_engagement_query(
+            program_ids, campaign_type="all", progress=progress, cancel_event=cancel_event, **query_kwargs
+        )
+
+        counts = {}
+        with timed("rollup_build", "rollups") as stage:
+            by_program = dict(tuple(df.groupby("program_identifier", sort=False))) if not df.empty else {}
+            for pid in program_ids:
+                part = by_program.get(pid, df.iloc[0:0])
+                rollup = build_rollup(part)
+                self.save(pid, rollup, _program_info(part))
+                counts[pid] = len(rollup)
+            stage["rows"] = len(df)
+        logger.info("Refreshed rollups for %d program(s) from %d engagements", len(program_ids), len(df))
+        return counts
+
+    # --- Reading ---
+    def load_program(self, program_id):
+        """(rollup, info) for one program, or (None, None) if it has never been refreshed."""
+        path = self._path(program_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None, None
+        with self._lock:
+            cached = self._loaded.get(program_id)
+            if cached is not None and cached[0] == mtime:
+                return cached[1], cached[2]
+        rollup, info = read_parquet_frame(path)
+        with self._lock:
+            self._loaded[program_id] = (mtime, rollup, info)
+        return rollup, info
+
+    def load(self, program_ids):
+        """
+        Rollup rows for program_ids, plus {program_id: info} for the programs that have
+        rollups. Programs never refreshed are simply missing from both.
+        """
+        if isinstance(program_ids, int):
+            program_ids = [program_ids]
+        frames, infos = [], {}
+        for pid in program_ids:
+            rollup, info = self.load_program(pid)
+            if rollup is not None:
+                infos[pid] = info
+                if not rollup.empty:  # an empty (all-object) frame would make concat upcast every column
+                    frames.append(rollup)
+        rollup = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ROLLUP_COLUMNS)
+        return rollup, infos
+
+    def summarize(self, program_ids, by="source", start=None, end=None, sources=None):
+        """
+        Summary of the stored rollups per SUMMARY_DIMENSIONS[by] (engagements, unique
+        NPIs, first/last engaged), limited to days from start to end (inclusive) and
+        to the given sources. Returns (summary, {program_id: info}).
+        """
+        with timed("rollup_summary", "rollups") as stage:
+            rollup, infos = self.load(program_ids)
+            mask = pd.Series(True, index=rollup.index)
+            if start is not None:
+                mask &= rollup["engaged_on"] >= pd.Timestamp(start)
+            if end is not None:
+                mask &= rollup["engaged_on"] <= pd.Timestamp(end)
+            if sources:
+                mask &= rollup["source"].isin(sources)
+            summary = summarize_rollup(rollup[mask], SUMMARY_DIMENSIONS[by])
+            stage["rows"] = int(mask.sum())
+        return summary, infos
+
+    def refreshed_programs(self):
+        """Program IDs that have stored rollups."""
+        return sorted(
+            int(fname[len("rollup__"):-len(".parquet")])
+            for fname in os.listdir(self.directory)
+            if fname.startswith("rollup__") and fname.endswith(".parquet")
+        )
+
+    def remove(self, program_ids):
+        """Deletes the rollups for program_ids; returns how many were removed."""
+        if isinstance(program_ids, int):
+            program_ids = [program_ids]
+        removed = 0
+        for pid in program_ids:
+            with self._lock:
+                self._loaded.pop(pid, None)
+            try:
+                os.remove(self._path(pid))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_rollup_store():
+    """The process-wide RollupStore, configured from config.ROLLUP_CONFIG."""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = RollupStore()
+        return _shared_store
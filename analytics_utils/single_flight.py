@@ -0,0 +1,167 @@
+# single_flight.py
+"""
+Coalescing of identical concurrent queries.
+
+When several people Run the same programs at once, only the first call actually
+queries the databases; calls with the same key that arrive while it is in flight
+wait for it and get the same result (or the same exception). Nothing is kept once
+the flight lands: a later call runs again (the result cache is the layer for that).
+
+    flights = get_single_flight()
+    df = flights.do(
+        engagement_query_key(program_ids, campaign_type),
+        lambda progress, cancel_event: db_utils.run_combined_engagement_query(
+            program_ids, campaign_type=campaign_type, progress=progress, cancel_event=cancel_event),
+        progress=job.report, cancel_event=job.cancel_event,
+    )
+
+Every caller's progress hook sees the shared query's progress (earlier steps are
+replayed when a caller joins). The shared query is only cancelled once every caller
+waiting on it has cancelled; a caller that cancels alone just stops waiting. The
+first caller runs the query on its own thread, so it finishes it for the others even
+after cancelling. Callers share one DataFrame and must not modify it in place.
+
+Counts of calls, executions and coalesced calls are kept in stats(); each coalesced
+wait is also timed as a "coalesced_wait" stage (instrumentation.py), so it reaches
+the metrics hook and the run's timing breakdown.
+"""
+import logging
+import threading
+
+from analytics_utils import config
+from analytics_utils.db_utils import QueryCancelled
+from analytics_utils.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.SINGLE_FLIGHT_CONFIG
+SINGLE_FLIGHT_DEFAULTS = {
+    "enabled": True,
+}
+
+
+def engagement_query_key(program_ids, campaign_type, **query_kwargs):
+    """Key for a combined engagement query: order and duplicates of program_ids don't matter."""
+    if isinstance(program_ids, int):
+        program_ids = [program_ids]
+    return (tuple(sorted({int(pid) for pid in program_ids})), campaign_type, tuple(sorted(query_kwargs.items())))
+
+
+class _Flight:
+    """
+    One in-flight call: its outcome, the latest progress, and who is waiting on it.
+    Also serves as the shared call's cancel_event (see is_set).
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.progress = {}  # step -> latest status
+        self.listeners = []
+        self.cancel_events = []
+        self.lock = threading.Lock()
+
+    def report(self, step, status):
+        with self.lock:
+            self.progress[step] = status
+            for listener in self.listeners:
+                listener(step, status)
+
+    def join(self, progress, cancel_event):
+        with self.lock:
+            self.cancel_events.append(cancel_event if cancel_event is not None else threading.Event())
+            if progress is not None:
+                self.listeners.append(progress)
+                for step, status in self.progress.items():
+                    progress(step, status)
+
+    def leave(self, progress):
+        with self.lock:
+            if progress in self.listeners:
+                self.listeners.remove(progress)
+
+    def is_set(self):
+        # The shared call stops only once every caller has cancelled
+        with self.lock:
+            return all(event.is_set() for event in self.cancel_events)
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; concurrent callers with the same key
+    share its outcome.
+    """
+
+    def __init__(self, enabled=None):
+        settings = {**SINGLE_FLIGHT_DEFAULTS, **(getattr(config, "SINGLE_FLIGHT_CONFIG", None) or {})}
+        self.enabled = settings["enabled"] if enabled is None else enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def do(self, key, fn, progress=None, cancel_event=None):
+        """
+        fn(progress=..., cancel_event=...)'s result, from this call or from the
+        identical call already in flight. Raises QueryCancelled if cancel_event is set
+        while waiting on another call.
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key) if self.enabled else None
+            leader = flight is None
+            if leader:
+                self._stats["executions"] += 1
+                flight = _Flight()
+                if self.enabled:
+                    self._flights[key] = flight
+            else:
+                self._stats["coalesced"] += 1
+                coalesced = self._stats["coalesced"]
+        flight.join(progress, cancel_event)
+
+        if leader:
+            try:
+                flight.result = fn(progress=flight.report, cancel_event=flight)
+                return flight.result
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+                flight.done.set()
+
+        logger.info("Joined the in-flight query for %s (%d call(s) coalesced so far)", key, coalesced)
+        with timed("coalesced_wait", source="single_flight") as stage:
+            try:
+                while not flight.done.wait(0.5):
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise QueryCancelled("Query was cancelled.")
+            finally:
+                flight.leave(progress)
+            if flight.error is not None:
+                raise flight.error
+            stage["rows"] = len(flight.result) if hasattr(flight.result, "__len__") else None
+        return flight.result
+
+    def stats(self):
+        """Calls made, calls that ran, calls that shared another's run, and flights in the air."""
+        with self._lock:
+            stats = dict(self._stats, in_flight=len(self._flights))
+        stats["coalesced_ratio"] = stats["coalesced"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+_shared_flights = None
+_shared_flights_lock = threading.Lock()
+
+
+def get_single_flight():
+    """The process-wide SingleFlight, configured from config.SINGLE_FLIGHT_CONFIG."""
+    global _shared_flights
+    with _shared_flights_lock:
+        if _shared_flights is None:
+            _shared_flights = SingleFlight()
+        return _shared_flights
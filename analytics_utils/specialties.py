@@ -0,0 +1,191 @@
+# specialties.py
+"""
+Cached NPI -> specialty lookups against dbt.int_provider_specialties.
+
+Specialties almost never change, so each SpecialtyResolver keeps an in-process
+LRU cache with a TTL and only queries the NPIs it hasn't seen recently. Misses
+are fetched in one round trip with a single array parameter (= ANY(%s)) rather
+than an IN list with one placeholder per NPI.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from analytics_utils import config
+from analytics_utils.connections import get_postgres_pool, postgres_creds
+from analytics_utils.instrumentation import timed
+
+logger = logging.getLogger(__name__)
+
+SPECIALTY_TABLE = "dbt.int_provider_specialties"
+
+# Defaults for anything not set in config.SPECIALTY_CACHE_CONFIG
+SPECIALTY_CACHE_DEFAULTS = {
+    "max_size": 500_000,      # NPIs kept in memory (least recently used are evicted)
+    "ttl_seconds": 86_400,    # re-query an NPI after this long
+}
+
+
+def _npi_key(npi):
+    # NPIs arrive as str, int, or float (an int column with NaNs); key them all the same way
+    if isinstance(npi, float) and npi.is_integer():
+        npi = int(npi)
+    return str(npi).strip()
+
+
+class SpecialtyResolver:
+    """
+    Resolves provider NPIs to specialties, caching results (including NPIs with no
+    specialty) per NPI. Thread-safe; share one instance per set of credentials via
+    get_specialty_resolver().
+    """
+
+    def __init__(self, creds, max_size=None, ttl_seconds=None):
+        settings = {**SPECIALTY_CACHE_DEFAULTS, **(getattr(config, "SPECIALTY_CACHE_CONFIG", None) or {})}
+        self.creds = creds
+        self.max_size = max_size or settings["max_size"]
+        self.ttl_seconds = ttl_seconds or settings["ttl_seconds"]
+
+        self._cache = OrderedDict()  # npi key -> (tuple of specialties, expires_at)
+        self._lock = threading.Lock()
+        self._npi_cast = None
+        self.hits = 0
+        self.misses = 0
+
+    # --- Cache ---
+    def _get(self, key, now):
+        entry = self._cache.get(key)
+        if entry is None or entry[1] < now:
+            return None
+        self._cache.move_to_end(key)
+        return entry[0]
+
+    def _put_many(self, specialties_by_key, now):
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            for key, specialties in specialties_by_key.items():
+                self._cache[key] = (tuple(specialties), expires_at)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    # --- Database ---
+    def _array_cast(self, cur):
+        """
+        NPIs are sent as one text[] parameter and cast to the column's own array type,
+        so the comparison stays index-friendly whether provider_npi is text or numeric.
+        """
+        if self._npi_cast is None:
+            schema, table = SPECIALTY_TABLE.split(".")
+            cur.execute(
+                "SELECT data_type FROM information_schema.columns "
+                "WHERE table_schema = %s AND table_name = %s AND column_name = 'provider_npi'",
+                [schema, table]
+            )
+            row = cur.fetchone()
+            data_type = row[0] if row else "text"
+            self._npi_cast = "" if data_type == "text" else f"::{data_type}[]"
+        return self._npi_cast
+
+    def _fetch(self, keys):
+        found = {key: [] for key in keys}
+        with get_postgres_pool(self.creds).connection() as conn:
+            with conn.cursor() as cur:
+                cast = self._array_cast(cur)
+                with timed("specialty_fetch", "specialties") as stage:
+                    cur.execute(
+                        f"SELECT provider_npi, specialty FROM {SPECIALTY_TABLE} "
+                        f"WHERE provider_npi = ANY(%s::text[]{cast})",
+                        [list(keys)]
+                    )
+                    rows = cur.fetchall()
+                    stage["rows"] = len(rows)
+                for npi, specialty in rows:
+                    found.setdefault(_npi_key(npi), []).append(specialty)
+        return found
+
+    def warm_up(self, chunk_size=50_000):
+        """
+        Preloads every row of dbt.int_provider_specialties into the cache.
+        Returns the number of NPIs loaded.
+        """
+        loaded = 0
+        with get_postgres_pool(self.creds).connection() as conn:
+            with conn.cursor(name="specialty_warm_up") as cur:
+                cur.itersize = chunk_size
+                cur.execute(f"SELECT provider_npi, specialty FROM {SPECIALTY_TABLE} ORDER BY provider_npi")
+                pending = {}
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for npi, specialty in rows:
+                        pending.setdefault(_npi_key(npi), []).append(specialty)
+                    # Hold back the last NPI in case its rows continue in the next chunk
+                    last_key = _npi_key(rows[-1][0])
+                    carry = pending.pop(last_key)
+                    self._put_many(pending, time.monotonic())
+                    loaded += len(pending)
+                    pending = {last_key: carry}
+                self._put_many(pending, time.monotonic())
+                loaded += len(pending)
+        logger.info("Warmed specialty cache with %d NPIs", loaded)
+        return loaded
+
+    # --- Public ---
+    def resolve(self, npis):
+        """
+        Returns a DataFrame of (provider_npi, specialty) for the given NPIs, one row per
+        specialty, with provider_npi values exactly as passed in. Only cache misses hit
+        the database.
+        """
+        now = time.monotonic()
+        keys = {npi: _npi_key(npi) for npi in npis}
+
+        cached, missing = {}, set()
+        with self._lock:
+            for key in set(keys.values()):
+                specialties = self._get(key, now)
+                if specialties is None:
+                    missing.add(key)
+                else:
+                    cached[key] = specialties
+            self.hits += len(cached)
+            self.misses += len(missing)
+
+        if missing:
+            fetched = self._fetch(missing)
+            self._put_many(fetched, now)
+            cached.update(fetched)
+
+        rows = [(npi, specialty) for npi, key in keys.items() for specialty in cached.get(key, ())]
+        return pd.DataFrame(rows, columns=["provider_npi", "specialty"])
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.max_size}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# --- Process-wide registry ---
+_RESOLVERS = {}
+_RESOLVERS_LOCK = threading.Lock()
+
+
+def get_specialty_resolver(creds=None):
+    """
+    Return the shared SpecialtyResolver for these Postgres credentials (default: config's).
+    """
+    creds = postgres_creds(creds)
+    key = tuple(sorted(creds.items()))
+    with _RESOLVERS_LOCK:
+        resolver = _RESOLVERS.get(key)
+        if resolver is None:
+            resolver = _RESOLVERS[key] = SpecialtyResolver(creds)
+        return resolver
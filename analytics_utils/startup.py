@@ -0,0 +1,155 @@
+# startup.py
+"""
+Worker start-up: an opt-in connection warm-up and start-up timings.
+
+Importing db_utils loads no drivers and opens nothing, so by default the first Run
+a worker serves pays for the driver imports, the SSH tunnel and the first logins
+(they show up as import / tunnel / login stages in its timing breakdown). warm_up()
+does that work ahead of time: it opens the Postgres pool and the MySQL tunnel with
+one connection each. Pools belong to the process that opened them (a forked child
+drops inherited ones), so warm up after the fork, e.g. from gunicorn's post_fork:
+
+    # gunicorn.conf.py
+    from analytics_utils.startup import gunicorn_post_fork as post_fork
+
+or set STARTUP_CONFIG["warm_up"] to have app.py start it in the background when it
+is imported (in the worker itself, unless gunicorn runs with --preload).
+
+startup_report() holds this process's start-up costs, which are also logged and
+reported as "startup" stages to the metrics hook (instrumentation.py):
+    - app_import: importing app.py (recorded by app.py)
+    - warm_up: the whole warm-up, plus one stage per database
+    - first_request: the first request this process served, and how long after
+      start-up (app import, or the fork) it arrived
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+from analytics_utils import config
+from analytics_utils.connections import get_mysql_pool, get_postgres_pool
+from analytics_utils.instrumentation import record_stage, timed
+
+logger = logging.getLogger(__name__)
+
+# Defaults for anything not set in config.STARTUP_CONFIG
+STARTUP_DEFAULTS = {
+    "warm_up": False,      # app.py warms up in the background when imported
+    "warm_up_postgres": True,
+    "warm_up_mysql": True,
+}
+
+_TRACKED_MODULES = ["pandas", "psycopg", "psycopg_pool", "pymysql", "sshtunnel", "paramiko"]
+
+_started = time.perf_counter()
+_report = {}
+_report_lock = threading.Lock()
+
+
+def startup_settings():
+    return {**STARTUP_DEFAULTS, **(getattr(config, "STARTUP_CONFIG", None) or {})}
+
+
+def _after_fork():
+    # A forked worker starts its own clock and report (app_import was paid before the fork)
+    global _started
+    _started = time.perf_counter()
+    for name in [name for name in _report if name != "app_import"]:
+        del _report[name]
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def record(name, seconds, **fields):
+    """Adds a start-up timing to the report, logs it and reports it as a "startup" stage."""
+    with _report_lock:
+        _report[name] = {"seconds": round(seconds, 3), **fields}
+    logger.info("Startup %s took %.2fs%s", name, seconds, "".join(f", {k}={v}" for k, v in fields.items()))
+    record_stage(name, seconds, source="startup")
+
+
+def startup_report():
+    """This process's start-up timings, plus which of pandas and the drivers are loaded so far."""
+    with _report_lock:
+        report = dict(_report)
+    report["pid"] = os.getpid()
+    report["uptime_seconds"] = round(time.perf_counter() - _started, 3)
+    report["modules_loaded"] = [name for name in _TRACKED_MODULES if name in sys.modules]
+    return report
+
+
+# --- Warm-up ---
+def _warm_up_postgres():
+    with get_postgres_pool().connection() as conn:
+        conn.execute("SELECT 1")
+
+def _warm_up_mysql():
+    with get_mysql_pool().connection() as conn:
+        conn.ping(reconnect=False)
+
+
+def warm_up(postgres=None, mysql=None):
+    """
+    Opens the default Postgres pool and MySQL tunnel (with one connection each) in
+    this process. Failures are logged, not raised: queries then connect on first use
+    as usual. Returns {database: seconds or None if it failed}.
+    """
+    settings = startup_settings()
+    targets = {
+        "postgres": (settings["warm_up_postgres"] if postgres is None else postgres, _warm_up_postgres),
+        "mysql": (settings["warm_up_mysql"] if mysql is None else mysql, _warm_up_mysql),
+    }
+    start = time.perf_counter()
+    seconds = {}
+    for database, (enabled, open_connection) in targets.items():
+        if not enabled:
+            continue
+        step_start = time.perf_counter()
+        try:
+            with timed("warm_up", database):
+                open_connection()
+            seconds[database] = round(time.perf_counter() - step_start, 3)
+        except Exception as e:
+            seconds[database] = None
+            logger.warning("Warm-up of %s failed; it will connect on first use: %s", database, e)
+    record("warm_up", time.perf_counter() - start, **seconds)
+    return seconds
+
+def warm_up_in_background(**kwargs):
+    """Runs warm_up() on a daemon thread, so a worker can take requests meanwhile."""
+    thread = threading.Thread(target=warm_up, kwargs=kwargs, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def gunicorn_post_fork(server, worker):
+    """gunicorn post_fork hook: warms up each worker's connections after it forks."""
+    warm_up_in_background()
+
+
+# --- First request ---
+def track_first_request(server):
+    """Records how long the first request this process serves takes (a Flask app)."""
+    from flask import g
+
+    state = {"pending": True}
+    lock = threading.Lock()
+
+    @server.before_request
+    def _first_request_started():
+        if state["pending"]:
+            g.startup_request_started = time.perf_counter()
+
+    @server.after_request
+    def _first_request_finished(response):
+        request_started = g.pop("startup_request_started", None)
+        if request_started is not None:
+            with lock:
+                first, state["pending"] = state["pending"], False
+            if first:
+                record(
+                    "first_request", time.perf_counter() - request_started,
+                    after_start_seconds=round(request_started - _started, 3),
+                )
+        return response
@@ -0,0 +1,119 @@
+# table_query.py
+"""
+Server-side filtering, sorting and paging for Dash DataTables.
+
+With page_action/sort_action/filter_action set to "custom", the DataTable sends its
+filter_query, sort_by and page_current to a callback instead of holding every row
+in the browser. These helpers evaluate those requests against a DataFrame with
+vectorized pandas operations so only the current page is serialized.
+"""
+import math
+
+import pandas as pd
+
+# DataTable filter operators, in the order they must be tried (longest first)
+FILTER_OPERATORS = [
+    ("ge ", ">="),
+    ("le ", "<="),
+    ("lt ", "<"),
+    ("gt ", ">"),
+    ("ne ", "!="),
+    ("eq ", "="),
+    ("contains ",),
+    ("datestartswith ",),
+]
+
+
+def split_filter_part(filter_part):
+    """
+    Parses one clause of a DataTable filter_query, e.g. '{engaged_on} >= 2024-01-01'.
+    Returns (column, operator, value), or (None, None, None) if it can't be parsed.
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[:1]
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1:-1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+
+_STRING_OPERATORS = ('contains', 'datestartswith')
+
+
+def _comparable(series, value, operator=None):
+    """
+    Aligns a column and a filter value for comparison: numeric if both can be, else
+    the column's string form (dates, categoricals and mixed object columns). The
+    string operators (contains, datestartswith) always compare string forms.
+    """
+    if isinstance(value, float) and pd.api.types.is_numeric_dtype(series) and operator not in _STRING_OPERATORS:
+        return series, value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # an NPI or ID typed into the filter box parses as e.g. 9296.0
+    return series.astype(str), str(value)
+
+
+def apply_filter(df, filter_query):
+    """Applies a DataTable filter_query ('clause && clause ...') as one boolean mask."""
+    if not filter_query:
+        return df
+
+    mask = pd.Series(True, index=df.index)
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        series, value = _comparable(df[col_name], value, operator)
+
+        if operator == 'contains':
+            part = series.str.contains(str(value), case=False, regex=False, na=False)
+        elif operator == 'datestartswith':
+            part = series.str.startswith(str(value), na=False)
+        else:
+            part = {
+                'ge': series.__ge__, 'le': series.__le__, 'lt': series.__lt__,
+                'gt': series.__gt__, 'ne': series.__ne__, 'eq': series.__eq__,
+            }[operator](value)
+        mask &= part.fillna(False).astype(bool)
+    return df[mask]
+
+
+def apply_sort(df, sort_by):
+    """Sorts by a DataTable sort_by list ([{'column_id': ..., 'direction': 'asc'|'desc'}, ...])."""
+    sort_by = [s for s in (sort_by or []) if s.get('column_id') in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(
+        [s['column_id'] for s in sort_by],
+        ascending=[s['direction'] == 'asc' for s in sort_by],
+        kind='stable',
+        na_position='last',
+    )
+
+
+def table_page(df, page_current, page_size, sort_by=None, filter_query=None):
+    """
+    The rows for one DataTable page after filtering and sorting, as DataTable records,
+    plus the page count and the number of matching rows.
+    """
+    view = apply_sort(apply_filter(df, filter_query), sort_by)
+    page_current = page_current or 0
+    start = page_current * page_size
+    page = view.iloc[start:start + page_size]
+    page_count = max(math.ceil(len(view) / page_size), 1)
+    return page.to_dict("records"), page_count, len(view)
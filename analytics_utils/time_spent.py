@@ -0,0 +1,107 @@
+# time_spent.py
+"""
+Time-on-asset distribution engine.
+
+Works on raw session durations (one row per tracked session: program_identifier,
+NPI, seconds_spent) pulled in a single scan for any number of programs, and
+computes per group with vectorized NumPy:
+    - sessions: number of sessions
+    - ATS: average time spent, in minutes
+    - median and the configured percentiles, in minutes
+    - the share of sessions falling in each duration bucket
+
+Bucket edges, labels, percentiles and the valid session range come from
+config.TIME_SPENT_CONFIG (see TIME_SPENT_DEFAULTS).
+"""
+import numpy as np
+import pandas as pd
+
+from analytics_utils import config
+
+# Defaults for anything not set in config.TIME_SPENT_CONFIG
+TIME_SPENT_DEFAULTS = {
+    "min_seconds": 8,        # shorter sessions are accidental opens
+    "max_seconds": 3600,     # longer ones are tabs left open
+    "bucket_edges_seconds": [30, 60, 180, 360],
+    "bucket_labels": ["3-30 seconds", "30 sec -1 minute", "1 min - 3 minutes", "3 min - 6 minutes", "> 6 min"],
+    "percentiles": [25, 75, 90],  # the median is always included
+}
+
+# Grouping keys for each summary level
+SUMMARY_LEVELS = {
+    "program": ["program_identifier"],
+    "npi": ["program_identifier", "NPI"],
+}
+
+
+def time_spent_settings():
+    return {**TIME_SPENT_DEFAULTS, **(getattr(config, "TIME_SPENT_CONFIG", None) or {})}
+
+
+def bucket_labels(edges):
+    """Readable labels for the buckets cut at edges (seconds): '< 30s', '30s-60s', ..., '>= 360s'."""
+    edges = [f"{edge:g}s" for edge in edges]
+    if not edges:
+        return ["all"]
+    return [f"< {edges[0]}"] + [f"{lo}-{hi}" for lo, hi in zip(edges, edges[1:])] + [f">= {edges[-1]}"]
+
+
+def _group_quantiles(sorted_values, starts, counts, q):
+    """
+    Linear-interpolated quantile q (0-1) of every group at once. sorted_values holds
+    each group's values contiguously and in order, starting at starts.
+    """
+    position = starts + q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize_durations(sessions, level="npi", bucket_edges=None, labels=None, percentiles=None):
+    """
+    Time-spent summary of raw sessions (program_identifier, NPI, seconds_spent) per
+    group of SUMMARY_LEVELS[level]. Durations are reported in minutes and bucket
+    columns as the share of each group's sessions.
+    """
+    settings = time_spent_settings()
+    edges = np.asarray(settings["bucket_edges_seconds"] if bucket_edges is None else bucket_edges, dtype=float)
+    if labels is None:
+        labels = settings["bucket_labels"]
+        if not labels or len(labels) != len(edges) + 1:
+            labels = bucket_labels(edges)  # configured edges without matching labels
+    if len(labels) != len(edges) + 1:
+        raise ValueError(f"Expected {len(edges) + 1} bucket labels for {len(edges)} edges, got {len(labels)}.")
+    percentiles = settings["percentiles"] if percentiles is None else percentiles
+    keys = SUMMARY_LEVELS[level]
+
+    stat_columns = ["sessions", "ATS", "median"] + [f"p{p:g}" for p in percentiles] + list(labels)
+    if sessions.empty:
+        return pd.DataFrame(columns=keys + stat_columns)
+
+    seconds = sessions["seconds_spent"].to_numpy(dtype=float)
+    grouped = sessions.groupby(keys, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    groups = grouped.size().index  # group keys, in code order
+    n_groups = len(groups)
+
+    # One sort puts every group's durations together and in order
+    order = np.lexsort((seconds, codes))
+    sorted_seconds = seconds[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    stats = {
+        "sessions": counts,
+        "ATS": np.bincount(codes, weights=seconds, minlength=n_groups) / counts / 60,
+        "median": _group_quantiles(sorted_seconds, starts, counts, 0.5) / 60,
+    }
+    for p in percentiles:
+        stats[f"p{p:g}"] = _group_quantiles(sorted_seconds, starts, counts, p / 100) / 60
+
+    buckets = np.searchsorted(edges, seconds, side="right")
+    shares = np.bincount(codes * len(labels) + buckets, minlength=n_groups * len(labels)).reshape(n_groups, len(labels))
+    shares = shares / counts[:, None]
+    for i, label in enumerate(labels):
+        stats[label] = shares[:, i]
+
+    return pd.DataFrame(stats, index=groups).reset_index()
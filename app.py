@@ -1,14 +1,31 @@
+import time
+_import_started = time.perf_counter()  # reported as the app_import start-up stage
+
+import logging
 import os
 import re
 import pandas as pd
 
 import dash
+from flask import Response, abort, jsonify, request, stream_with_context
 from dash import Dash, html, dcc, callback, Input, Output, State
 from dash.dash_table import DataTable
 import dash_bootstrap_components as dbc
 
 # Import user utilities
-from analytics_utils import db_utils
+from analytics_utils import config, db_utils, engagement_metrics, startup
+from analytics_utils.exports import EXPORT_FORMATS, export_filename, iter_export
+from analytics_utils.instrumentation import run_timer
+from analytics_utils.jobs import JobManager, DONE, CANCELLED
+from analytics_utils.result_store import ResultStore
+from analytics_utils.rollups import get_rollup_store
+from analytics_utils.single_flight import engagement_query_key, get_single_flight
+from analytics_utils.table_query import table_page
+
+logging.basicConfig(
+    level=getattr(config, "LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
 
 # -------------- Helpers --------------
 def parse_program_ids(text: str):
@@ -26,10 +43,118 @@ def parse_program_ids(text: str):
             pass
     return ids
 
+
+def run_engagement_job(job, program_ids, campaign_type):
+    """
+    Job body for a Run click; progress and cancellation go through the job.
+    Identical Runs already in flight are joined rather than repeated (single_flight.py).
+    Returns the combined frame and the run's stage timings.
+    """
+    def query(progress, cancel_event):
+        return db_utils.run_combined_engagement_query(
+            program_ids,
+            campaign_type=campaign_type,
+            progress=progress,
+            cancel_event=cancel_event,
+        )
+
+    with run_timer(f"engagement {campaign_type}") as run:
+        df = get_single_flight().do(
+            engagement_query_key(program_ids, campaign_type), query,
+            progress=job.report, cancel_event=job.cancel_event,
+        )
+    return df, run
+
+
+def run_rollup_refresh_job(job, program_ids):
+    """Job body for a Refresh rollups click: pulls every source and rebuilds the rollups."""
+    return get_rollup_store().refresh(program_ids, progress=job.report, cancel_event=job.cancel_event)
+
+
+def summary_records(summary):
+    """Rollup summary rows as DataTable records, with readable dates."""
+    summary = summary.copy()
+    if "engaged_on" in summary.columns:
+        summary["engaged_on"] = pd.to_datetime(summary["engaged_on"]).dt.strftime("%Y-%m-%d")
+    for col in ["first_engaged_at", "last_engaged_at"]:
+        summary[col] = pd.to_datetime(summary[col]).dt.strftime("%Y-%m-%d %H:%M")
+    return summary.to_dict("records")
+
+
+def compute_metrics(df, view):
+    """The summary frame for one METRICS_VIEWS entry, ready for a DataTable."""
+    if view == "overlap":
+        metrics = engagement_metrics.source_overlap(df).reset_index()
+    elif view == "funnel":
+        metrics = engagement_metrics.funnel(df)
+    else:
+        metrics = engagement_metrics.reach_frequency(df, by=METRICS_VIEWS[view][1])
+    return metrics.round(3)
+
+
+def render_timings(run):
+    """Collapsible per-stage timing breakdown for the result summary."""
+    breakdown = run.breakdown()
+    breakdown["seconds"] = breakdown["seconds"].map("{:.2f}".format)
+    breakdown["rows"] = breakdown["rows"].map(lambda n: f"{n:,.0f}" if n else "")
+    breakdown["MB"] = breakdown.pop("bytes").map(lambda n: f"{n / 1024 ** 2:,.1f}" if n else "")
+    return html.Details(
+        [
+            html.Summary(f"Timing breakdown ({run.seconds:.1f}s total; sources overlap)"),
+            dbc.Table.from_dataframe(breakdown, size="sm", striped=True, className="small mt-2"),
+        ],
+        className="mt-2",
+    )
+
+
+def render_progress(snapshot):
+    steps = snapshot["progress"]
+    finished = sum(1 for status in steps.values() if status not in ("queued", "running"))
+    return html.Div(
+        [
+            dbc.Progress(value=finished, max=max(len(steps), 1), striped=True, animated=True, className="mb-2"),
+            html.Ul([html.Li(f"{step}: {status}") for step, status in steps.items()], className="small mb-1"),
+            html.Div(f"{snapshot['status'].capitalize()} for {snapshot['elapsed']:.0f}s", className="small text-muted"),
+        ]
+    )
+
 # -------------- App ------------------
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 server = app.server
 
+# Full results stay on the server; the browser only holds a result ID
+results = ResultStore()
+PAGE_SIZE = 15
+
+# Queries run in the background so a long pull doesn't hold the request open
+jobs = JobManager()
+JOB_POLL_MS = 1000
+# Jobs live in the worker that started them; a poll that lands elsewhere can't see them
+JOB_NOT_FOUND = (
+    "❌ This job is no longer available on this server (it expired, or the request "
+    "reached a different worker). Please run it again."
+)
+
+# Metric views over the current result: (label, reach/frequency grouping)
+METRICS_VIEWS = {
+    "reach_source": ("Reach & frequency by source", ["source"]),
+    "reach_specialty": ("Reach & frequency by specialty", ["specialty"]),
+    "reach_source_specialty": ("Reach & frequency by source and specialty", ["source", "specialty"]),
+    "reach_program": ("Reach & frequency by program", ["program_identifier"]),
+    "reach_total": ("Overall reach & frequency", None),
+    "overlap": ("Source overlap (NPIs reached by both)", None),
+    "funnel": ("Email → asset → survey funnel by program", None),
+}
+
+SUMMARY_VIEWS = {
+    "source": "Source",
+    "engagement_type": "Source and engagement type",
+    "specialty": "Specialty",
+    "day": "Day",
+    "day_source": "Day and source",
+    "program": "Program",
+}
+
 app.layout = dbc.Container(
     [
         html.H2("Engagement Explorer (Basic Dash App)"),
@@ -69,6 +194,10 @@ app.layout = dbc.Container(
                     dbc.Button("Run", id="run-btn", color="primary"),
                     width="auto",
                 ),
+                dbc.Col(
+                    dbc.Button("Cancel", id="cancel-btn", color="danger", outline=True, className="ms-2", disabled=True),
+                    width="auto",
+                ),
                 dbc.Col(
                     dbc.Button("Test Postgres", id="test-pg", color="secondary", outline=True, className="ms-2"),
                     width="auto",
@@ -85,12 +214,21 @@ app.layout = dbc.Container(
             className="mb-3",
         ),
 
+        html.Div(id="job-progress"),
         html.Div(id="result-summary"),
-        dcc.Download(id="download-data"),
+        dcc.Store(id="result-id"),
+        dcc.Store(id="job-id"),
+        dcc.Interval(id="job-poll", interval=JOB_POLL_MS, disabled=True),
 
         DataTable(
             id="engagement-table",
-            page_size=15,
+            page_current=0,
+            page_size=PAGE_SIZE,
+            page_action="custom",
+            sort_action="custom",
+            sort_mode="multi",
+            filter_action="custom",
+            filter_query="",
             style_table={"overflowX": "auto"},
             style_cell={"minWidth": 120, "whiteSpace": "normal", "height": "auto"},
         ),
@@ -98,12 +236,96 @@ app.layout = dbc.Container(
         dbc.Row(
             [
                 dbc.Col(
-                    dbc.Button("Download CSV", id="download-btn", color="success", className="mt-2"),
+                    dcc.Dropdown(
+                        id="download-format",
+                        options=[
+                            {"label": "CSV (gzip)", "value": "csv.gz"},
+                            {"label": "Parquet", "value": "parquet"},
+                            {"label": "Arrow / Feather", "value": "arrow"},
+                        ],
+                        value="csv.gz",
+                        clearable=False,
+                        style={"minWidth": 180},
+                    ),
                     width="auto",
-                )
+                    className="mt-2",
+                ),
+                dbc.Col(
+                    dbc.Button("Download", id="download-btn", color="success", className="mt-2",
+                               external_link=True, disabled=True),
+                    width="auto",
+                ),
             ]
         ),
 
+        html.H4("Metrics", className="mt-4"),
+        dcc.Dropdown(
+            id="metrics-view",
+            options=[{"label": label, "value": view} for view, (label, _) in METRICS_VIEWS.items()],
+            value="reach_source",
+            clearable=False,
+            style={"maxWidth": 420},
+            className="mb-2",
+        ),
+        DataTable(
+            id="metrics-table",
+            page_size=PAGE_SIZE,
+            sort_action="native",
+            style_table={"overflowX": "auto"},
+            style_cell={"minWidth": 100},
+        ),
+
+        html.Hr(),
+        html.H4("Program summary"),
+        html.P(
+            "Answered from the daily rollups without querying the databases. "
+            "Refresh rollups pulls the programs above again.",
+            className="small text-muted",
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    [
+                        dbc.Label("Summarize by"),
+                        dcc.Dropdown(
+                            id="summary-by",
+                            options=[{"label": label, "value": view} for view, label in SUMMARY_VIEWS.items()],
+                            value="source",
+                            clearable=False,
+                        ),
+                    ],
+                    md=3,
+                ),
+                dbc.Col(
+                    [
+                        dbc.Label("Engaged between"),
+                        html.Div(dcc.DatePickerRange(id="summary-dates", clearable=True)),
+                    ],
+                    md=5,
+                ),
+                dbc.Col(
+                    dbc.Button("Summarize", id="summary-btn", color="primary", className="mt-4"),
+                    width="auto",
+                ),
+                dbc.Col(
+                    dbc.Button("Refresh rollups", id="rollup-refresh-btn", color="secondary", outline=True, className="mt-4"),
+                    width="auto",
+                ),
+            ],
+            className="mb-3",
+        ),
+        html.Div(id="rollup-progress"),
+        html.Div(id="summary-status", className="mb-2"),
+        dcc.Store(id="rollup-job-id"),
+        dcc.Interval(id="rollup-poll", interval=JOB_POLL_MS, disabled=True),
+        DataTable(
+            id="summary-table",
+            page_size=PAGE_SIZE,
+            sort_action="native",
+            style_table={"overflowX": "auto"},
+            style_cell={"minWidth": 120},
+        ),
+
         html.Hr(),
         html.P("Tip: Update credentials in analytics_utils/config.py. Functions come from db_utils.py."),
     ],
@@ -133,40 +355,234 @@ def test_connections(pg_clicks, my_clicks):
 
 
 @callback(
-    Output("engagement-table", "data"),
-    Output("engagement-table", "columns"),
+    Output("job-id", "data"),
+    Output("job-poll", "disabled"),
+    Output("cancel-btn", "disabled"),
     Output("result-summary", "children"),
     Input("run-btn", "n_clicks"),
     State("program-ids", "value"),
     State("campaign-type", "value"),
+    State("job-id", "data"),
     prevent_initial_call=True,
 )
-def run_query(n_clicks, ids_text, campaign_type):
+def run_query(n_clicks, ids_text, campaign_type, running_job_id):
     program_ids = parse_program_ids(ids_text or "")
     if not program_ids:
-        return [], [], "Provide at least one valid program ID."
+        return dash.no_update, dash.no_update, dash.no_update, "Provide at least one valid program ID."  # type: ignore
+
+    # A new Run replaces whatever this page was still waiting on
+    jobs.cancel(running_job_id)
+    job = jobs.submit(
+        run_engagement_job, program_ids, campaign_type,
+        label=f"{campaign_type} {program_ids}",
+        steps=db_utils.CAMPAIGN_SOURCES[campaign_type] + ["combine"],
+    )
+    return job.id, False, False, f"Queued query for programs: {program_ids}."
+
 
-    df = db_utils.run_combined_engagement_query(program_ids, campaign_type=campaign_type)
+@callback(
+    Output("job-progress", "children"),
+    Output("job-poll", "disabled", allow_duplicate=True),
+    Output("cancel-btn", "disabled", allow_duplicate=True),
+    Output("result-id", "data"),
+    Output("engagement-table", "columns"),
+    Output("engagement-table", "page_current"),
+    Output("result-summary", "children", allow_duplicate=True),
+    Input("job-poll", "n_intervals"),
+    State("job-id", "data"),
+    State("result-id", "data"),
+    prevent_initial_call=True,
+)
+def poll_job(n_intervals, job_id, previous_result_id):
+    unchanged = (dash.no_update,) * 4  # type: ignore
+    job = jobs.get(job_id)
+    if job is None:
+        return None, True, True, *unchanged[:3], JOB_NOT_FOUND
+    snapshot = job.snapshot()
+    if not job.finished:
+        return render_progress(snapshot), False, False, *unchanged
+
+    jobs.pop(job_id)
+    if snapshot["status"] == CANCELLED:
+        return None, True, True, *unchanged[:3], "Query cancelled."
+    if snapshot["status"] != DONE:
+        return None, True, True, *unchanged[:3], f"❌ Query failed: {snapshot['error']}"
+
+    df, run = job.result
+    results.discard(previous_result_id)
     if df is None or df.empty:
-        return [], [], f"No results for {program_ids}."
+        return None, True, True, None, [], 0, html.Div([f"No results for {job.label}.", render_timings(run)])
 
     cols = [{"name": c, "id": c} for c in df.columns]
-    summary = f"Returned {len(df):,} rows across {len(df.columns)} columns for programs: {program_ids}."
-    # cache in a simple global for download (demo-friendly)
-    app.server.df_cache = df  # type: ignore
-    return df.to_dict("records"), cols, summary
+    summary = html.Div(
+        [
+            f"Returned {len(df):,} rows across {len(df.columns)} columns for {job.label} "
+            f"in {snapshot['elapsed']:.1f}s.",
+            render_timings(run),
+        ]
+    )
+    return None, True, True, results.put(df), cols, 0, summary
 
 
 @callback(
-    Output("download-data", "data"),
-    Input("download-btn", "n_clicks"),
+    Output("cancel-btn", "disabled", allow_duplicate=True),
+    Input("cancel-btn", "n_clicks"),
+    State("job-id", "data"),
     prevent_initial_call=True,
 )
-def download_csv(n_clicks):
-    df = getattr(app.server, "df_cache", None)  # type: ignore
+def cancel_query(n_clicks, job_id):
+    jobs.cancel(job_id)
+    return True
+
+
+@callback(
+    Output("engagement-table", "data"),
+    Output("engagement-table", "page_count"),
+    Input("result-id", "data"),
+    Input("engagement-table", "page_current"),
+    Input("engagement-table", "page_size"),
+    Input("engagement-table", "sort_by"),
+    Input("engagement-table", "filter_query"),
+)
+def update_table(result_id, page_current, page_size, sort_by, filter_query):
+    # Only the requested page is serialized; filtering/sorting run on the server-held frame
+    df = results.get(result_id)
+    if df is None:
+        return [], 1
+    rows, page_count, _ = table_page(df, page_current, page_size, sort_by, filter_query)
+    return rows, page_count
+
+
+@callback(
+    Output("download-btn", "href"),
+    Output("download-btn", "disabled"),
+    Input("result-id", "data"),
+    Input("download-format", "value"),
+)
+def update_download_link(result_id, fmt):
+    if not result_id:
+        return None, True
+    return f"/download/{result_id}?format={fmt}", False
+
+
+@callback(
+    Output("metrics-table", "columns"),
+    Output("metrics-table", "data"),
+    Input("result-id", "data"),
+    Input("metrics-view", "value"),
+)
+def update_metrics(result_id, view):
+    # Computed from the server-held result; only the small summary goes to the browser
+    df = results.get(result_id)
     if df is None or df.empty:
-        return dash.no_update  # type: ignore
-    return dcc.send_data_frame(df.to_csv, "engagements.csv", index=False)
+        return [], []
+    metrics = compute_metrics(df, view)
+    return [{"name": str(c), "id": str(c)} for c in metrics.columns], metrics.rename(columns=str).to_dict("records")
+
+
+@callback(
+    Output("summary-table", "columns"),
+    Output("summary-table", "data"),
+    Output("summary-status", "children"),
+    Input("summary-btn", "n_clicks"),
+    State("program-ids", "value"),
+    State("summary-by", "value"),
+    State("summary-dates", "start_date"),
+    State("summary-dates", "end_date"),
+    prevent_initial_call=True,
+)
+def summarize_programs(n_clicks, ids_text, by, start_date, end_date):
+    program_ids = parse_program_ids(ids_text or "")
+    if not program_ids:
+        return [], [], "Provide at least one valid program ID."
+
+    start = time.perf_counter()
+    summary, infos = get_rollup_store().summarize(program_ids, by=by, start=start_date, end=end_date)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    missing = [pid for pid in program_ids if pid not in infos]
+    status = [f"Summarized {len(infos)} program(s) from rollups in {elapsed_ms:.0f} ms."]
+    if infos:
+        status.append(f" Oldest refresh: {min(info['refreshed_at'] for info in infos.values())}.")
+    if missing:
+        status.append(f" No rollups yet for {missing}; use Refresh rollups.")
+    columns = [{"name": c, "id": c} for c in summary.columns]
+    return columns, summary_records(summary), "".join(status)
+
+
+@callback(
+    Output("rollup-job-id", "data"),
+    Output("rollup-poll", "disabled"),
+    Output("summary-status", "children", allow_duplicate=True),
+    Input("rollup-refresh-btn", "n_clicks"),
+    State("program-ids", "value"),
+    State("rollup-job-id", "data"),
+    prevent_initial_call=True,
+)
+def refresh_rollups(n_clicks, ids_text, running_job_id):
+    program_ids = parse_program_ids(ids_text or "")
+    if not program_ids:
+        return dash.no_update, dash.no_update, "Provide at least one valid program ID."  # type: ignore
+    if jobs.get(running_job_id) is not None:
+        return dash.no_update, dash.no_update, "A rollup refresh is already running."  # type: ignore
+
+    job = jobs.submit(
+        run_rollup_refresh_job, program_ids,
+        label=f"rollups {program_ids}",
+        steps=db_utils.CAMPAIGN_SOURCES["all"] + ["combine"],
+    )
+    return job.id, False, f"Queued rollup refresh for programs: {program_ids}."
+
+
+@callback(
+    Output("rollup-progress", "children"),
+    Output("rollup-poll", "disabled", allow_duplicate=True),
+    Output("summary-status", "children", allow_duplicate=True),
+    Input("rollup-poll", "n_intervals"),
+    State("rollup-job-id", "data"),
+    prevent_initial_call=True,
+)
+def poll_rollup_job(n_intervals, job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return None, True, JOB_NOT_FOUND
+    snapshot = job.snapshot()
+    if not job.finished:
+        return render_progress(snapshot), False, dash.no_update  # type: ignore
+
+    jobs.pop(job_id)
+    if snapshot["status"] != DONE:
+        return None, True, f"❌ Rollup refresh failed: {snapshot['error'] or snapshot['status']}"
+    counts = job.result
+    return None, True, f"Refreshed rollups for {len(counts)} program(s) ({sum(counts.values()):,} rows). Click Summarize."
+
+
+@server.route("/download/<result_id>")
+def download_result(result_id):
+    # Streams the requesting session's own result, encoded a slice of rows at a time
+    fmt = request.args.get("format", "csv.gz")
+    df = results.get(result_id)
+    if df is None or fmt not in EXPORT_FORMATS:
+        abort(404)
+    return Response(
+        stream_with_context(iter_export(df, fmt)),
+        mimetype=EXPORT_FORMATS[fmt][1],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename("engagements", fmt)}"'},
+    )
+
+
+@server.route("/startup-report")
+def startup_report():
+    # This worker's import, warm-up and first-request timings
+    return jsonify(startup.startup_report())
+
+
+# Database drivers load and pools open on first use; set STARTUP_CONFIG["warm_up"]
+# (or use startup.gunicorn_post_fork) to open them before the first Run instead
+startup.record("app_import", time.perf_counter() - _import_started)
+startup.track_first_request(server)
+if startup.startup_settings()["warm_up"]:
+    startup.warm_up_in_background()
 
 
 if __name__ == "__main__":
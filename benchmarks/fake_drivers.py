@@ -0,0 +1,238 @@
+# fake_drivers.py
+"""
+In-process stand-ins for the Postgres and MySQL pools, serving SyntheticData.
+
+The fakes answer the SQL db_utils and specialties actually send (matched on the
+table names and the placeholders they use), filter the synthetic frames the way
+the database would, and hand back rows as tuples through the DB-API calls the
+readers make (execute, fetchall, fetchmany, description). Everything above the
+driver (query building, frames, program dimension, specialties, dtypes) runs for
+real, so the timings reflect this code rather than a network.
+
+    with fake_databases(generate(rows=1_000_000)):
+        db_utils.run_combined_engagement_query(program_ids, use_cache=False)
+
+latency adds a fixed delay to every execute, as a crude stand-in for round trips.
+The COPY path (bulk_fetch.py) needs a real server; the fake raises
+NotSupportedError, so sources listed in COPY_FETCH_SOURCES fall back to rows.
+"""
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import psycopg
+import pymysql
+
+from analytics_utils import db_utils, specialties
+
+Column = namedtuple("Column", ["name", "type_code"])  # desc.name for psycopg, desc[0] for pymysql
+
+_SELECTED_COLUMN = re.compile(r't\."(\w+)"')
+_SOURCE_LITERAL = re.compile(r"'(\w+)' as source")
+_SINCE_FILTER = re.compile(r'AND t\."(\w+)" >= %s')
+_FROM_TABLE = re.compile(r"FROM (\w+\.\w+) t\b")
+_TEMP_TABLE = re.compile(r"TEMPORARY TABLE (?:IF EXISTS )?(\w+)")
+
+
+class _FakeCursor:
+    """Holds one result as a DataFrame and pages through it as tuples."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.itersize = None
+        self._result = None
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._result = None
+
+    def _set_result(self, df):
+        self._result = df
+        self._position = 0
+        self.description = [Column(name, None) for name in df.columns]
+
+    def _set_rows(self, columns, rows):
+        self._set_result(pd.DataFrame(rows, columns=columns))
+
+    def execute(self, query, params=None):
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        self._execute(query, list(params or []))
+
+    def fetchall(self):
+        return self.fetchmany(len(self._result) - self._position)
+
+    def fetchmany(self, size):
+        chunk = self._result.iloc[self._position:self._position + size]
+        self._position += len(chunk)
+        # Column-wise tolist() + zip is several times faster than itertuples, so the
+        # fake's own row building stays small next to what it's timing
+        return list(zip(*(chunk[name].tolist() for name in chunk.columns)))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+
+# --- Postgres ---
+class FakePostgresCursor(_FakeCursor):
+
+    def _execute(self, query, params):
+        data = self.connection.data
+        if "LIMIT 0" in query:
+            raise psycopg.NotSupportedError("COPY isn't available on the fake Postgres driver")
+        if "information_schema.columns" in query:
+            if "provider_npi" in query:
+                return self._set_rows(["data_type"], [("text",)])
+            table = data.postgres.get(".".join(params[:2]))
+            return self._set_rows(["column_name"], [(c,) for c in (table.columns if table is not None else [])])
+        if specialties.SPECIALTY_TABLE in query:
+            df = data.specialties
+            if "ANY" in query:
+                df = df[df["provider_npi"].isin(params[0])]
+            else:
+                df = df.sort_values("provider_npi")
+            return self._set_result(df[["provider_npi", "specialty"]])
+        return self._set_result(self._engagement_rows(query, params))
+
+    def _engagement_rows(self, query, params):
+        df = self.connection.data.postgres[_FROM_TABLE.search(query).group(1)]
+        df = df[df["program_identifier"].isin(np.asarray(params[0], dtype=np.int64))]
+        since = _SINCE_FILTER.search(query)
+        if since:
+            df = df[df[since.group(1)] >= params[1]]
+        select_list = query.split("FROM", 1)[0]
+        columns = list(dict.fromkeys(_SELECTED_COLUMN.findall(select_list))) or list(df.columns)
+        return df[columns].assign(source=_SOURCE_LITERAL.search(query).group(1))
+
+    def copy(self, *args, **kwargs):
+        raise psycopg.NotSupportedError("COPY isn't available on the fake Postgres driver")
+
+
+class FakePostgresConnection:
+
+    def __init__(self, data, latency=0.0):
+        self.data = data
+        self.latency = latency
+
+    def cursor(self, name=None, **kwargs):
+        return FakePostgresCursor(self)
+
+
+# --- MySQL ---
+class FakeMySQLCursor(_FakeCursor):
+
+    def _execute(self, query, params):
+        data = self.connection.data
+        temp_table = _TEMP_TABLE.search(query)
+        if temp_table:
+            if query.lstrip().startswith("DROP"):
+                self.connection.temp_tables.pop(temp_table.group(1), None)
+            else:
+                self.connection.temp_tables[temp_table.group(1)] = []
+            return self._set_rows([], [])
+        if "tbl_banner_data" in query:
+            return self._set_result(self._choozle_rows(query, params))
+        if "tbl_app_tracking_time_spent" in query:
+            program_ids, (min_seconds, max_seconds) = params[:-2], params[-2:]
+            df = data.time_spent
+            return self._set_result(df[df["program_identifier"].isin(program_ids) & df["seconds_spent"].between(min_seconds, max_seconds)])
+        raise pymysql.ProgrammingError(f"Fake MySQL driver can't answer: {query.strip()[:80]}")
+
+    def executemany(self, query, seq_params):
+        table = re.search(r"INTO (\w+)", query).group(1)
+        self.connection.temp_tables[table].extend(params[0] for params in seq_params)
+
+    def _choozle_rows(self, query, params):
+        data = self.connection.data
+        has_since = "date >= %s" in query
+        if "JOIN" in query:  # temp-table form
+            program_ids = self.connection.temp_tables[db_utils._CHOOZLE_PROGRAMS_TABLE]
+            concentrate_ids = self.connection.temp_tables[db_utils._CHOOZLE_CONCENTRATE_TABLE]
+            since = params[0] if has_since else None
+        else:
+            n = (len(params) - has_since) // 2
+            program_ids, concentrate_ids = params[:n], params[-n:]
+            since = params[n] if has_since else None
+        concentrate = data.concentrate
+        npis = concentrate.loc[concentrate["fk_prgID"].isin(concentrate_ids), "npi"]
+        df = data.choozle
+        mask = df["program_identifier"].isin(program_ids) & df["provider_npi"].isin(npis)
+        if since is not None:
+            mask &= df["engaged_on"] >= since
+        return df[mask]
+
+
+class FakeMySQLConnection:
+
+    def __init__(self, data, latency=0.0):
+        self.data = data
+        self.latency = latency
+        self.temp_tables = {}
+
+    def cursor(self, cursor_class=None):
+        return FakeMySQLCursor(self)
+
+    def ping(self, reconnect=False):
+        return True
+
+
+class FakePool:
+    """Pool interface of connections.py (connection() context manager) over fake connections."""
+
+    def __init__(self, connection_factory, data, latency=0.0):
+        self._factory = connection_factory
+        self._data = data
+        self._latency = latency
+        self.checkouts = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            self.checkouts += 1
+        yield self._factory(self._data, self._latency)
+
+
+@contextmanager
+def fake_databases(data, latency=0.0):
+    """
+    Points db_utils and specialties at fake pools serving data (SyntheticData) for
+    the duration of the block, with the catalog and specialty caches emptied on
+    the way in and out.
+    """
+    postgres = FakePool(FakePostgresConnection, data, latency)
+    mysql = FakePool(FakeMySQLConnection, data, latency)
+    patched = [
+        (db_utils, "get_postgres_pool", lambda creds: postgres),
+        (db_utils, "get_mysql_pool", lambda my_creds, ss_creds: mysql),
+        (specialties, "get_postgres_pool", lambda creds: postgres),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patched]
+    for module, name, fake in patched:
+        setattr(module, name, fake)
+    reset_caches()
+    try:
+        yield postgres, mysql
+    finally:
+        for module, name, original in originals:
+            setattr(module, name, original)
+        reset_caches()
+
+
+def reset_caches():
+    """Empties the per-process catalog and specialty caches, so the next run starts cold."""
+    db_utils._table_columns_cache.clear()
+    for resolver in list(specialties._RESOLVERS.values()):
+        resolver.clear()
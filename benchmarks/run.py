@@ -0,0 +1,247 @@
+"""
+Offline benchmarks for db_utils and the Dash callbacks, on synthetic data.
+
+    python -m benchmarks.run --rows 1000000 --programs 50 --repeat 3
+    python -m benchmarks.run --rows 1000000 --programs 50 --compare benchmarks/results/baseline.json
+
+Generates synthetic engagement, Choozle and time-spent data (benchmarks/synthetic.py),
+serves it through fake database drivers (benchmarks/fake_drivers.py), and times
+    - combined: every stage of run_combined_engagement_query (from its run_timer breakdown)
+    - dash: update_table for a plain, sorted and filtered page, JSON-encoded the way
+      Dash sends callback output, and each download format streamed to the end
+    - time_spent: run_time_spent_summary_query at NPI and program level
+Each case then runs once more under tracemalloc for its peak Python/NumPy memory
+(Arrow buffers aren't tracked there; rss_peak_mb is the process high-water mark).
+The tracemalloc pass is slow at millions of rows; --skip-memory leaves it out.
+
+Times are the best of --repeat runs. Results are written as JSON (default
+benchmarks/results/<timestamp>-<rows>.json); with --compare, any measurement at
+least --min-seconds long, or peak memory, that grew more than --threshold over the
+baseline is reported and the exit status is 1.
+"""
+import argparse
+import datetime as dt
+import json
+import logging
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+
+from analytics_utils import db_utils
+from analytics_utils.exports import EXPORT_FORMATS, iter_export
+from analytics_utils.instrumentation import run_timer
+from benchmarks.fake_drivers import fake_databases, reset_caches
+from benchmarks.synthetic import generate
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# DataTable requests replayed against update_table
+TABLE_REQUESTS = {
+    "page": dict(page_current=0, sort_by=None, filter_query=None),
+    "sorted_page": dict(page_current=3, sort_by=[{"column_id": "engaged_on", "direction": "desc"}], filter_query=None),
+    "filtered_page": dict(
+        page_current=0,
+        sort_by=[{"column_id": "provider_npi", "direction": "asc"}],
+        filter_query="{engagement_type} contains click && {engaged_on} >= 2024-06-01",
+    ),
+}
+
+
+def _stage_key(case, source, stage):
+    return "/".join(part for part in (case, source, stage) if part)
+
+def _run_breakdown(case, run):
+    measurements = {_stage_key(case, None, "total"): {"seconds": run.seconds}}
+    for record in run.breakdown().to_dict("records"):
+        measurements[_stage_key(case, record["source"], record["stage"])] = {
+            "seconds": record["seconds"],
+            "rows": int(record["rows"]) if record["rows"] else None,  # stages without a row count sum to 0
+        }
+    return measurements
+
+
+# --- Cases ---
+# Each case returns {measurement name: {"seconds": ..., "rows": ...}} for one run
+def bench_combined(data, campaign_type="custom", chunk_size=None):
+    reset_caches()
+    with run_timer("benchmark") as run:
+        df = db_utils.run_combined_engagement_query(
+            data.program_ids, campaign_type=campaign_type, chunk_size=chunk_size, use_cache=False
+        )
+    measurements = _run_breakdown("combined", run)
+    measurements["combined/total"]["rows"] = len(df)
+    return measurements, df
+
+def bench_dash(df, page_size=15):
+    # Imported here: app.py builds the Dash app at import time
+    import app
+
+    measurements = {}
+    result_id = app.results.put(df)
+    try:
+        for name, table_request in TABLE_REQUESTS.items():
+            start = time.perf_counter()
+            rows, page_count = app.update_table(result_id, page_size=page_size, **table_request)
+            payload = to_json_plotly({"data": rows, "page_count": page_count})
+            measurements[f"dash/update_table/{name}"] = {"seconds": time.perf_counter() - start, "rows": len(rows), "bytes": len(payload)}
+        for fmt in EXPORT_FORMATS:
+            start, size = time.perf_counter(), 0
+            for chunk in iter_export(df, fmt):
+                size += len(chunk)
+            measurements[f"dash/download/{fmt}"] = {"seconds": time.perf_counter() - start, "rows": len(df), "bytes": size}
+    finally:
+        app.results.discard(result_id)
+    return measurements
+
+def bench_time_spent(data):
+    measurements = {}
+    for level in ("npi", "program"):
+        with run_timer("benchmark") as run:
+            df = db_utils.run_time_spent_summary_query(data.program_ids, level=level)
+        for name, measurement in _run_breakdown(f"time_spent_{level}", run).items():
+            measurements[name] = measurement
+        measurements[f"time_spent_{level}/total"]["rows"] = len(df)
+    return measurements
+
+
+def _best_of(repeat, fn):
+    """Runs fn repeat times and keeps each measurement's fastest run."""
+    best = {}
+    for _ in range(repeat):
+        for name, measurement in fn().items():
+            if name not in best or measurement["seconds"] < best[name]["seconds"]:
+                best[name] = measurement
+    return best
+
+def _peak_mb(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmarks(data, repeat=3, campaign_type="custom", chunk_size=None, memory=True):
+    combined_df = None
+
+    def combined():
+        nonlocal combined_df
+        measurements, combined_df = bench_combined(data, campaign_type, chunk_size)
+        return measurements
+
+    cases = {
+        "combined": combined,
+        "dash": lambda: bench_dash(combined_df),
+        "time_spent": lambda: bench_time_spent(data),
+    }
+    results, peaks = {}, {}
+    for case, fn in cases.items():
+        logging.getLogger(__name__).info("Benchmarking %s", case)
+        results.update(_best_of(repeat, fn))
+        if memory:
+            peaks[case] = _peak_mb(fn)
+    for case, peak in peaks.items():
+        results[f"{case}/peak_memory"] = {"seconds": None, "peak_mb": peak}
+    return results
+
+
+# --- Reporting ---
+def compare(results, baseline, threshold=0.2, min_seconds=0.05):
+    """
+    Measurements that grew by more than threshold (a fraction) over the baseline, as
+    (name, unit, before, after): times at least min_seconds long and peak memory.
+    """
+    regressions = []
+    for name, measurement in results.items():
+        for unit in ("seconds", "peak_mb"):
+            before = baseline.get(name, {}).get(unit)
+            after = measurement.get(unit)
+            if before is None or after is None or (unit == "seconds" and max(before, after) < min_seconds):
+                continue
+            if after > before * (1 + threshold):
+                regressions.append((name, unit, before, after))
+    return regressions
+
+def print_results(results, baseline=None):
+    print(f"{'measurement':<58}{'seconds':>10}{'rows':>12}{'baseline':>10}")
+    for name, m in results.items():
+        if m.get("seconds") is None:
+            print(f"{name:<58}{m['peak_mb']:>9.1f}M")
+            continue
+        before = (baseline or {}).get(name, {}).get("seconds")
+        rows = f"{m['rows']:,}" if m.get("rows") is not None else ""
+        print(f"{name:<58}{m['seconds']:>10.3f}{rows:>12}{'' if before is None else f'{before:.3f}':>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic engagement rows (10k to 10M)")
+    parser.add_argument("--programs", type=int, default=20)
+    parser.add_argument("--npis", type=int, default=None, help="distinct NPIs (default rows / 20)")
+    parser.add_argument("--sessions", type=int, default=None, help="time-spent sessions (default rows / 2)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--campaign-type", default="custom", choices=list(db_utils.CAMPAIGN_SOURCES))
+    parser.add_argument("--chunk-size", type=int, default=None, help="stream sources in chunks of this many rows")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every fake query")
+    parser.add_argument("--skip-memory", action="store_true", help="skip the (slow) tracemalloc pass")
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None, help="baseline results JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging, e.g. 0.2 = 20%%")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="ignore measurements shorter than this")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    logging.getLogger(__name__).setLevel(logging.INFO)
+
+    start = time.perf_counter()
+    data = generate(args.rows, args.programs, args.npis, args.sessions, args.seed)
+    print(f"Generated {data.engagement_rows:,} engagement rows and {len(data.time_spent):,} sessions "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    with fake_databases(data, latency=args.latency_ms / 1000):
+        results = run_benchmarks(data, args.repeat, args.campaign_type, args.chunk_size, memory=not args.skip_memory)
+
+    report = {
+        "meta": {
+            "timestamp": dt.datetime.now().isoformat(timespec="seconds"),
+            "rows": args.rows, "programs": args.programs, "npis": args.npis, "sessions": args.sessions,
+            "seed": args.seed, "repeat": args.repeat, "campaign_type": args.campaign_type,
+            "chunk_size": args.chunk_size, "latency_ms": args.latency_ms,
+            "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+            "platform": platform.platform(),
+            # ru_maxrss is in KiB on Linux, bytes on macOS
+            "rss_peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024),
+        },
+        "results": results,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_results(results, baseline["results"] if baseline else None)
+
+    output = args.output or RESULTS_DIR / f"{dt.datetime.now():%Y%m%d-%H%M%S}-{args.rows}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Saved results to {output}")
+
+    if baseline:
+        settings = ["rows", "programs", "npis", "sessions", "seed", "campaign_type", "chunk_size", "latency_ms"]
+        changed = [key for key in settings if baseline["meta"].get(key) != report["meta"][key]]
+        if changed:
+            print(f"Warning: the baseline was run with different {', '.join(changed)}")
+        regressions = compare(results, baseline["results"], args.threshold, args.min_seconds)
+        for name, unit, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f} -> {after:.3f} {unit} (+{after / before - 1:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# synthetic.py
+"""
+Synthetic stand-ins for the tables db_utils reads, at any scale.
+
+generate(rows, programs, ...) returns a SyntheticData holding DataFrames shaped
+like what each query returns:
+    - postgres["dbt.email_engagements"] etc.: the dbt engagement tables, with the
+      columns the source queries select (activation ranges as psycopg Multiranges)
+    - choozle: Choozle banner rows as the aggregated Choozle query returns them
+      (one row per CHOOZLE_GROUP_KEY group)
+    - concentrate: BTL concentrate NPIs per program
+    - time_spent: raw app sessions (program_identifier, NPI, seconds_spent)
+    - specialties: dbt.int_provider_specialties
+
+Values are drawn with NumPy from a seeded generator, so a given (rows, programs,
+seed) always produces the same data.
+"""
+import datetime as dt
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from psycopg.types.multirange import Multirange
+from psycopg.types.range import Range
+
+# Share of the engagement rows each source gets
+SOURCE_SHARES = {
+    "email_engagement": 0.5,
+    "asset_view": 0.2,
+    "survey_response": 0.1,
+    "adbutler_banner_ad": 0.1,
+    "choozle_banner_ad": 0.1,
+}
+POSTGRES_TABLES = {
+    "email_engagement": "dbt.email_engagements",
+    "asset_view": "dbt.asset_views",
+    "survey_response": "dbt.survey_responses",
+    "adbutler_banner_ad": "dbt.banner_ad_impressions",
+}
+ENGAGEMENT_TYPES = {
+    "email_engagement": ["email_open", "email_click"],
+    "asset_view": ["asset_view"],
+    "survey_response": ["survey_response"],
+    "adbutler_banner_ad": ["banner_impression", "banner_click"],
+    "choozle_banner_ad": ["choozle_banner_impression", "choozle_banner_click"],
+}
+SPECIALTIES = ["Oncology", "Cardiology", "Dermatology", "Neurology", "Rheumatology", "Internal Medicine", "Family Medicine"]
+
+FIRST_PROGRAM_ID = 9000
+START_DATE = np.datetime64("2024-01-01")
+
+
+@dataclass
+class SyntheticData:
+    program_ids: list
+    postgres: dict = field(default_factory=dict)   # table name -> DataFrame
+    choozle: pd.DataFrame = None
+    concentrate: pd.DataFrame = None
+    time_spent: pd.DataFrame = None
+    specialties: pd.DataFrame = None
+
+    @property
+    def engagement_rows(self):
+        return sum(len(df) for df in self.postgres.values()) + len(self.choozle)
+
+
+def _activation_ranges(program_ids, rng):
+    ranges = {}
+    for pid in program_ids:
+        start = dt.datetime(2024, 1, 1) + dt.timedelta(days=int(rng.integers(0, 90)))
+        if rng.random() < 0.3:
+            ranges[pid] = Multirange([Range(start, None, "[)")])  # still active
+        else:
+            ranges[pid] = Multirange([Range(start, start + dt.timedelta(days=int(rng.integers(60, 300))), "[)")])
+    return ranges
+
+def _npis(n, rng):
+    return (1_000_000_000 + rng.choice(899_999_999, size=n, replace=False)).astype(str)
+
+def _timestamps(n, rng, days=365):
+    seconds = rng.integers(0, days * 86_400, size=n)
+    return START_DATE.astype("datetime64[s]") + seconds.astype("timedelta64[s]")
+
+
+def _dates(timestamps):
+    return timestamps.astype("datetime64[D]").astype(object)  # datetime.date
+
+
+def _engagement_frame(source, n, program_ids, npis, ranges, rng):
+    programs = rng.choice(program_ids, size=n)
+    engaged_at = _timestamps(n, rng)
+    df = pd.DataFrame({
+        "program_identifier": programs,
+        "program_name": pd.Categorical([f"Program {pid}" for pid in programs]),
+        "program_drug_brand_name": pd.Categorical([f"Brand {pid % 40}" for pid in programs]),
+        "program_activation_ranges": pd.Series([ranges[pid] for pid in programs], dtype=object),
+        "provider_npi": rng.choice(npis, size=n),
+        "engaged_on": _dates(engaged_at),
+        # datetime.datetime, as psycopg returns them (object dtype, so pandas keeps them as is)
+        "engaged_at": pd.Series(engaged_at.astype(object), dtype=object),
+        "engagement_type": rng.choice(ENGAGEMENT_TYPES[source], size=n),
+    })
+    if source == "email_engagement":
+        campaign = rng.integers(1, 400, size=n)
+        df["email_campaign_identifier"] = campaign
+        df["email_campaign_subject"] = pd.Categorical([f"Subject line {c}" for c in campaign])
+        df["email_campaign_link_url"] = pd.Categorical([f"https://example.com/c/{c}" for c in campaign])
+    elif source == "survey_response":
+        df["survey_question_number"] = rng.integers(1, 12, size=n)
+        df["survey_response"] = [f"Answer {a}" for a in rng.integers(0, 5_000, size=n)]
+        df["survey_location"] = rng.choice(["pre", "post", "in_app"], size=n)
+    return df
+
+# The Choozle query's GROUP BY (engaged_on is MAX(date) within each group)
+CHOOZLE_GROUP_KEY = ["program_identifier", "provider_npi", "choozle_banner_ad_name", "engagement_type"]
+
+
+def _choozle_frame(n, program_ids, npis, rng):
+    # Up to n rows, at most one per query group
+    ads = rng.integers(1, 60, size=n)
+    df = pd.DataFrame({
+        "program_identifier": rng.choice(program_ids, size=n),
+        "provider_npi": rng.choice(npis, size=n),
+        "engaged_on": _dates(_timestamps(n, rng)),
+        "choozle_banner_ad_name": [f"Ad {a}" for a in ads],
+        "engagement_type": rng.choice(ENGAGEMENT_TYPES["choozle_banner_ad"], size=n, p=[0.95, 0.05]),
+        "choozle_banner_link_url": [f"https://example.com/ad/{a}" for a in ads],
+        "source": "choozle_banner_ad",
+    })
+    return df.drop_duplicates(CHOOZLE_GROUP_KEY).reset_index(drop=True)
+
+
+def generate(rows=100_000, programs=20, npis=None, sessions=None, seed=0):
+    """
+    Synthetic data with about `rows` engagement rows spread over `programs` programs
+    and `npis` distinct providers (default rows // 20), plus `sessions` time-spent
+    sessions (default rows // 2).
+    """
+    rng = np.random.default_rng(seed)
+    program_ids = list(range(FIRST_PROGRAM_ID, FIRST_PROGRAM_ID + programs))
+    npi_pool = _npis(npis or max(rows // 20, 100), rng)
+    ranges = _activation_ranges(program_ids, rng)
+
+    data = SyntheticData(program_ids=program_ids)
+    for source, table in POSTGRES_TABLES.items():
+        data.postgres[table] = _engagement_frame(source, int(rows * SOURCE_SHARES[source]), program_ids, npi_pool, ranges, rng)
+    data.choozle = _choozle_frame(int(rows * SOURCE_SHARES["choozle_banner_ad"]), program_ids, npi_pool, rng)
+
+    # Most Choozle NPIs are in the concentrate; the query filters on it
+    data.concentrate = pd.DataFrame({
+        "fk_prgID": rng.choice(program_ids, size=len(npi_pool)),
+        "npi": npi_pool,
+    })
+    data.concentrate = data.concentrate[rng.random(len(npi_pool)) < 0.9].reset_index(drop=True)
+
+    n_sessions = sessions if sessions is not None else rows // 2
+    data.time_spent = pd.DataFrame({
+        "program_identifier": rng.choice(program_ids, size=n_sessions),
+        "NPI": rng.choice(npi_pool, size=n_sessions),
+        # Roughly log-normal session lengths, clipped to the query's 8s-60min window
+        "seconds_spent": np.clip(rng.lognormal(4.5, 1.2, size=n_sessions), 8, 3600).astype(np.int64),
+    })
+
+    data.specialties = pd.DataFrame({
+        "provider_npi": npi_pool,
+        "specialty": rng.choice(SPECIALTIES, size=len(npi_pool)),
+    })
+    return data
@@ -0,0 +1,49 @@
+"""
+Export many programs' engagements to Parquet, partitioned by program and source
+(batch_export.py). Rerun the same command to resume an interrupted export.
+
+    python -m examples.batch_export exports/q3 9296 9469 9316
+    python -m examples.batch_export exports/q3 --programs-file programs.txt --workers 3
+"""
+import argparse
+import logging
+
+from analytics_utils import db_utils
+from analytics_utils.batch_export import BatchExport
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("output_dir")
+    parser.add_argument("program_ids", nargs="*", type=int)
+    parser.add_argument("--programs-file", help="file of program IDs, one per line")
+    parser.add_argument("--campaign-type", default="custom", choices=list(db_utils.CAMPAIGN_SOURCES))
+    parser.add_argument("--programs-per-unit", type=int, default=None, help="programs pulled per query")
+    parser.add_argument("--workers", type=int, default=None, help="units running at once")
+    parser.add_argument("--sequential-sources", action="store_true",
+                        help="query a unit's sources one after another (one connection per unit)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    program_ids = list(args.program_ids)
+    if args.programs_file:
+        with open(args.programs_file) as f:
+            program_ids += [int(line) for line in f if line.strip()]
+    if not program_ids:
+        parser.error("no program IDs given")
+
+    export = BatchExport(
+        args.output_dir, campaign_type=args.campaign_type, programs_per_unit=args.programs_per_unit,
+        max_workers=args.workers, sequential_sources=args.sequential_sources,
+    )
+    summary = export.run(program_ids)
+    print(
+        f"{summary['programs_done']}/{summary['programs_requested']} programs exported; "
+        f"{summary['rows']:,} rows in {summary['seconds']:.1f}s ({summary['rows_per_second'] or 0:,.0f} rows/s) this run"
+    )
+    if summary["failed_units"]:
+        print(f"{summary['failed_units']} unit(s) failed; rerun to retry them")
+
+
+if __name__ == "__main__":
+    main()
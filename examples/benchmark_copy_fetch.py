@@ -0,0 +1,60 @@
+"""
+Compare the row-by-row and COPY (bulk_fetch.py) paths for the Postgres sources.
+
+    python -m examples.benchmark_copy_fetch 9296 9469 --sources email_engagement asset_view --repeat 3
+
+For each source, runs the same query both ways against the configured database and
+prints the best wall time, rows, and in-memory size of each result, plus whether
+the two frames hold the same values.
+"""
+import argparse
+import time
+
+from analytics_utils import db_utils
+from analytics_utils.bulk_fetch import read_postgres_copy
+from analytics_utils.config import POSTGRES_CREDS
+from analytics_utils.connections import get_postgres_pool
+
+
+def _read_copy(query, params, creds):
+    with get_postgres_pool(creds).connection() as conn:
+        return read_postgres_copy(query, params, conn)
+
+def _best_of(repeat, fn, *args):
+    best, df = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def _same_values(a, b):
+    if a.shape != b.shape or list(a.columns) != list(b.columns):
+        return False
+    return a.astype(str).replace({"<NA>": "None", "NaT": "None", "nan": "None"}).equals(
+        b.astype(str).replace({"<NA>": "None", "NaT": "None", "nan": "None"})
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("program_ids", nargs="+", type=int)
+    parser.add_argument("--sources", nargs="+", default=list(db_utils.POSTGRES_SOURCE_TABLES))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'source':<22}{'path':<6}{'seconds':>10}{'rows':>12}{'MB':>10}")
+    for source in args.sources:
+        query, params = db_utils._postgres_source_query(source, args.program_ids, POSTGRES_CREDS)
+        results = {}
+        for path, reader in (("rows", db_utils._read_postgres), ("copy", _read_copy)):
+            seconds, df = _best_of(args.repeat, reader, query, params, POSTGRES_CREDS)
+            results[path] = df
+            mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+            print(f"{source:<22}{path:<6}{seconds:>10.2f}{len(df):>12,}{mb:>10.1f}")
+        print(f"{'':<22}same values: {_same_values(results['rows'], results['copy'])}")
+
+
+if __name__ == "__main__":
+    main()
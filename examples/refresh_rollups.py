@@ -0,0 +1,34 @@
+"""
+Refresh the daily rollups (rollups.py) behind the app's summary view, e.g. nightly.
+
+    python -m examples.refresh_rollups 9296 9469 9316
+    python -m examples.refresh_rollups --stored   # every program that already has rollups
+"""
+import argparse
+import logging
+
+from analytics_utils.rollups import get_rollup_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("program_ids", nargs="*", type=int)
+    parser.add_argument("--stored", action="store_true", help="also refresh every program with stored rollups")
+    parser.add_argument("--batch-size", type=int, default=50, help="programs pulled per query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    store = get_rollup_store()
+    program_ids = list(dict.fromkeys(args.program_ids + (store.refreshed_programs() if args.stored else [])))
+    if not program_ids:
+        parser.error("no program IDs given")
+
+    for i in range(0, len(program_ids), args.batch_size):
+        batch = program_ids[i:i + args.batch_size]
+        counts = store.refresh(batch)
+        for pid in batch:
+            print(f"{pid}: {counts[pid]:,} rollup rows")
+
+
+if __name__ == "__main__":
+    main()
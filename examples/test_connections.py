@@ -1,5 +1,9 @@
+import logging
+
 from analytics_utils import db_utils
 
+logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
 print("\n--- Testing PostgreSQL ---")
 db_utils.test_postgres_connection()
 
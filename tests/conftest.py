@@ -0,0 +1,9 @@
+# conftest.py
+"""Runs the tests against config_sample.py when no local config.py exists."""
+import importlib
+import sys
+
+try:
+    importlib.import_module("analytics_utils.config")
+except ModuleNotFoundError:
+    sys.modules["analytics_utils.config"] = importlib.import_module("analytics_utils.config_sample")
@@ -0,0 +1,39 @@
+import pymysql
+import pytest
+
+from analytics_utils import db_utils
+from benchmarks import fake_drivers
+from benchmarks.fake_drivers import fake_databases
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture
+def data(monkeypatch):
+    # Two programs are enough to take the temp-table path
+    monkeypatch.setattr(db_utils.config, "CHOOZLE_QUERY_CONFIG", {"temp_table_min_programs": 2}, raising=False)
+    return generate(rows=5_000, programs=3, seed=2)
+
+
+def _fail_temp_tables(monkeypatch, error):
+    execute = fake_drivers.FakeMySQLCursor.execute
+
+    def failing_execute(self, query, params=None):
+        if "CREATE TEMPORARY TABLE" in query:
+            raise error
+        return execute(self, query, params)
+    monkeypatch.setattr(fake_drivers.FakeMySQLCursor, "execute", failing_execute)
+
+
+def test_missing_privilege_falls_back_to_in_lists(data, monkeypatch):
+    with fake_databases(data):
+        expected = db_utils._read_choozle(data.program_ids, None, None)
+        _fail_temp_tables(monkeypatch, pymysql.OperationalError(1142, "CREATE command denied"))
+        fallback = db_utils._read_choozle(data.program_ids, None, None)
+    assert len(expected) > 0
+    assert len(fallback) == len(expected)
+
+
+def test_other_errors_are_raised(data, monkeypatch):
+    _fail_temp_tables(monkeypatch, pymysql.OperationalError(1205, "Lock wait timeout exceeded"))
+    with fake_databases(data), pytest.raises(pymysql.OperationalError):
+        db_utils._read_choozle(data.program_ids, None, None)
@@ -0,0 +1,60 @@
+import threading
+
+import pymysql
+import pytest
+
+from analytics_utils.connections import MySQLTunnelPool
+
+
+class _FakeTunnel:
+    def __init__(self):
+        self.is_active = True
+        self.local_bind_port = 40000
+
+    def stop(self, force=False):
+        self.is_active = False
+
+
+class _FakeConnection:
+    def close(self):
+        pass
+
+
+def _pool(monkeypatch, connect):
+    pool = MySQLTunnelPool({}, {}, max_size=8)
+    monkeypatch.setattr(pool, "_start_tunnel", _FakeTunnel)
+    monkeypatch.setattr(pool, "_connect", connect)
+    return pool
+
+
+def test_dead_forward_restarts_the_tunnel_once(monkeypatch):
+    first_tunnel = threading.Barrier(5)
+    pool = None
+
+    def connect(port):
+        # Every connection over the first tunnel is lost until all threads have hit it
+        if pool._generation == 1:
+            first_tunnel.wait(timeout=5)
+            raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server")
+        return _FakeConnection()
+
+    pool = _pool(monkeypatch, connect)
+    pool._ensure_tunnel()
+    threads = [threading.Thread(target=pool._new_connection) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = pool.get_stats()
+    assert stats["tunnel_starts"] == 2
+    assert stats["connections_opened"] == 5
+
+
+def test_access_denied_keeps_the_tunnel(monkeypatch):
+    def connect(port):
+        raise pymysql.err.OperationalError(1045, "Access denied for user")
+
+    pool = _pool(monkeypatch, connect)
+    with pytest.raises(pymysql.err.OperationalError):
+        pool._new_connection()
+    assert pool.get_stats()["tunnel_starts"] == 1
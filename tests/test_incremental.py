@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from analytics_utils import db_utils, incremental
+from benchmarks.fake_drivers import fake_databases
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture
+def data():
+    return generate(rows=20_000, programs=4, seed=1)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = incremental.IncrementalStore(directory=str(tmp_path), overlap_days=2)
+    monkeypatch.setattr(incremental, "_shared_store", store)
+    return store
+
+
+def _choozle(df):
+    rows = df[df["source"] == "choozle_banner_ad"]
+    columns = ["program_identifier", "provider_npi", "choozle_banner_ad_name", "engagement_type", "engaged_on"]
+    return rows[columns].astype(str).sort_values(columns).reset_index(drop=True)
+
+
+def _run(program_ids, **kwargs):
+    return db_utils.run_combined_engagement_query(program_ids, use_cache=False, optimize=False, **kwargs)
+
+
+@pytest.mark.parametrize("first, second", [([0, 1], [0]), ([0], [0, 1])])
+def test_choozle_follows_the_requested_program_list(data, store, first, second):
+    first = [data.program_ids[i] for i in first]
+    second = [data.program_ids[i] for i in second]
+    with fake_databases(data):
+        _run(first, incremental=True)
+        refreshed = _run(second, incremental=True)
+        expected = _run(second)
+    assert len(_choozle(expected)) > 0
+    pd.testing.assert_frame_equal(_choozle(refreshed), _choozle(expected))
+
+
+def test_refresh_matches_a_full_pull(data, store):
+    with fake_databases(data):
+        _run(data.program_ids, incremental=True)
+        refreshed = _run(data.program_ids, incremental=True)
+        expected = _run(data.program_ids)
+    assert len(refreshed) == len(expected)
+    assert refreshed["source"].value_counts().to_dict() == expected["source"].value_counts().to_dict()
+
+
+def test_merge_replaces_the_overlap_window(store):
+    stored = pd.DataFrame({"engaged_at": pd.to_datetime(["2024-01-01", "2024-01-05", "2024-01-06"]), "n": [1, 2, 3]})
+    fresh = pd.DataFrame({"engaged_at": pd.to_datetime(["2024-01-05", "2024-01-06", "2024-01-07"]), "n": [2, 3, 4]})
+    merged = store.merge("email_engagement", stored, fresh, pd.Timestamp("2024-01-04"), "engaged_at")
+    assert merged["n"].tolist() == [1, 2, 3, 4]
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from analytics_utils import db_utils, result_cache
+from analytics_utils.result_cache import ResultCache, program_set_key
+from benchmarks.fake_drivers import fake_databases
+from benchmarks.synthetic import generate
+
+
+@pytest.fixture
+def data():
+    return generate(rows=20_000, programs=4, seed=4)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResultCache(directory=str(tmp_path))
+    monkeypatch.setattr(result_cache, "_shared_cache", cache)
+    return cache
+
+
+def _sorted(df):
+    df = df.drop(columns="program_activation_ranges", errors="ignore").astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def _run(program_ids, **kwargs):
+    return db_utils.run_combined_engagement_query(program_ids, optimize=False, **kwargs)
+
+
+def test_program_set_key_ignores_order_and_duplicates():
+    assert program_set_key([3, 1, 2]) == program_set_key([1, 2, 3, 3])
+    assert program_set_key([1, 2]) != program_set_key([1, 2, 3])
+
+
+def test_subset_served_from_cache_matches_a_direct_query(data, cache):
+    a, b = data.program_ids[:2]
+    with fake_databases(data):
+        _run([a, b], use_cache=True)
+        misses = cache.stats["misses"]
+        cached = _run([a], use_cache=True)
+        expected = _run([a], use_cache=False)
+    # Per-program sources come from the cache; Choozle is a new program list
+    assert cache.stats["misses"] == misses + 1
+    pd.testing.assert_frame_equal(_sorted(cached), _sorted(expected))
+
+
+def test_same_program_list_in_any_order_is_served_whole(data, cache):
+    a, b = data.program_ids[:2]
+    with fake_databases(data):
+        first = _run([a, b], use_cache=True)
+        misses = cache.stats["misses"]
+        second = _run([b, a], use_cache=True)
+    assert cache.stats["misses"] == misses
+    pd.testing.assert_frame_equal(_sorted(second), _sorted(first))
+
+
+def test_invalidating_a_program_drops_program_list_entries(data, cache):
+    a, b = data.program_ids[:2]
+    with fake_databases(data):
+        _run([a, b], use_cache=True)
+    cache.invalidate(program_ids=[b])
+    name = cache.entry_name("choozle_banner_ad", program_set_key([a, b]), "custom", db_utils.QUERY_VERSION)
+    assert cache.get(name) is None
+    assert cache.get(cache.entry_name("email_engagement", a, "custom", db_utils.QUERY_VERSION)) is not None
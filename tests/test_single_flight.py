@@ -0,0 +1,85 @@
+import threading
+import time
+
+from analytics_utils.db_utils import QueryCancelled
+from analytics_utils.single_flight import SingleFlight, engagement_query_key
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _start(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def test_key_ignores_program_order():
+    assert engagement_query_key([2, 1, 1], "custom") == engagement_query_key([1, 2], "custom")
+    assert engagement_query_key([1, 2], "custom") != engagement_query_key([1, 2], "turnkey")
+
+
+def test_identical_calls_share_one_execution():
+    flights = SingleFlight(enabled=True)
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def query(progress, cancel_event):
+        started.set()
+        release.wait(5)
+        return "rows"
+
+    leader = _start(lambda: results.append(flights.do("key", query)))
+    started.wait(5)
+    follower = _start(lambda: results.append(flights.do("key", query)))
+    _wait_until(lambda: flights.stats()["coalesced"] == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ["rows", "rows"]
+    assert flights.stats()["executions"] == 1
+
+
+def test_shared_query_cancels_only_when_every_caller_has():
+    flights = SingleFlight(enabled=True)
+    started = threading.Event()
+    leader_cancel, follower_cancel = threading.Event(), threading.Event()
+    outcomes = {}
+
+    def query(progress, cancel_event):
+        started.set()
+        while not cancel_event.is_set():
+            time.sleep(0.01)
+        raise QueryCancelled("Query was cancelled.")
+
+    def call(name, cancel_event):
+        try:
+            flights.do("key", query, cancel_event=cancel_event)
+        except QueryCancelled:
+            outcomes[name] = "cancelled"
+
+    leader = _start(lambda: call("leader", leader_cancel))
+    started.wait(5)
+    follower = _start(lambda: call("follower", follower_cancel))
+    _wait_until(lambda: flights.stats()["coalesced"] == 1)
+
+    # The follower alone stops waiting; the shared query keeps running for the leader
+    follower_cancel.set()
+    follower.join(5)
+    assert outcomes == {"follower": "cancelled"}
+    assert leader.is_alive()
+
+    leader_cancel.set()
+    leader.join(5)
+    assert outcomes == {"follower": "cancelled", "leader": "cancelled"}
+
+
+def test_disabled_runs_every_call():
+    flights = SingleFlight(enabled=False)
+    assert flights.do("key", lambda progress, cancel_event: 1) == 1
+    assert flights.do("key", lambda progress, cancel_event: 2) == 2
+    assert flights.stats()["executions"] == 2
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from analytics_utils.table_query import apply_filter
+
+
+def _frame():
+    return pd.DataFrame({
+        "program_identifier": [9296, 9469, 9316],
+        "provider_npi": pd.array([1234567890, 1987654321, None], dtype="Int64"),
+        "engagement_type": ["click", "open", "click"],
+    })
+
+
+def test_contains_on_numeric_column():
+    df = _frame()
+    assert apply_filter(df, "{program_identifier} contains 929")["program_identifier"].tolist() == [9296]
+    assert apply_filter(df, "{provider_npi} contains 1234567890")["program_identifier"].tolist() == [9296]
+
+
+def test_datestartswith_on_numeric_column():
+    df = _frame()
+    assert apply_filter(df, "{program_identifier} datestartswith 94")["program_identifier"].tolist() == [9469]
+
+
+def test_numeric_comparison_still_numeric():
+    df = _frame()
+    assert apply_filter(df, "{program_identifier} > 9300")["program_identifier"].tolist() == [9469, 9316]
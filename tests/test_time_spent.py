@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from analytics_utils.time_spent import summarize_durations
+
+
+@pytest.fixture
+def sessions():
+    rng = np.random.default_rng(3)
+    n = 2_000
+    return pd.DataFrame({
+        "program_identifier": rng.choice([9001, 9002, 9003], size=n),
+        "NPI": rng.choice(["1000000001", "1000000002", "1000000003", "1000000004"], size=n),
+        "seconds_spent": rng.integers(8, 3600, size=n),
+    })
+
+
+@pytest.mark.parametrize("level, keys", [("program", ["program_identifier"]), ("npi", ["program_identifier", "NPI"])])
+def test_quantiles_match_pandas(sessions, level, keys):
+    summary = summarize_durations(sessions, level=level, percentiles=[25, 90]).set_index(keys)
+    grouped = sessions.groupby(keys)["seconds_spent"]
+    for column, q in (("median", 0.5), ("p25", 0.25), ("p90", 0.9)):
+        expected = grouped.quantile(q) / 60
+        np.testing.assert_allclose(summary[column].to_numpy(), expected.to_numpy())
+    np.testing.assert_allclose(summary["ATS"].to_numpy(), (grouped.mean() / 60).to_numpy())
+    assert summary["sessions"].tolist() == grouped.size().tolist()
+
+
+def test_bucket_shares(sessions):
+    summary = summarize_durations(sessions, level="program", bucket_edges=[60, 600], labels=["short", "mid", "long"])
+    np.testing.assert_allclose(summary[["short", "mid", "long"]].sum(axis=1), 1.0)
+    first = sessions[sessions["program_identifier"] == 9001]["seconds_spent"]
+    assert summary.loc[0, "short"] == pytest.approx((first < 60).mean())
+    assert summary.loc[0, "long"] == pytest.approx((first >= 600).mean())
+
+
+def test_single_session_group():
+    one = pd.DataFrame({"program_identifier": [9001], "NPI": ["1000000001"], "seconds_spent": [120]})
+    summary = summarize_durations(one, level="npi", percentiles=[75])
+    assert summary.loc[0, ["median", "p75", "ATS"]].tolist() == [2.0, 2.0, 2.0]